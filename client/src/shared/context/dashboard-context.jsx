@@ -428,17 +428,17 @@ export const DashboardProvider = (props) => {
         headers: {
           Authorization: `Bearer ${token}`,
         },
+        responseType: "blob",
       });
 
       if (res.status === 200) {
-        // Prepare for file download
+        // Prepare for file download; the project is streamed as NDJSON records
         const fileName = `project_download-${state.name}`;
-        const json = JSON.stringify(res.data, null, 4);
-        const blob = new Blob([json], { type: "application/json" });
+        const blob = new Blob([res.data], { type: "application/x-ndjson" });
         const href = URL.createObjectURL(blob);
         const link = document.createElement("a");
         link.href = href;
-        link.download = fileName + ".json";
+        link.download = fileName + ".jsonl";
         document.body.appendChild(link);
         link.click();
         document.body.removeChild(link);
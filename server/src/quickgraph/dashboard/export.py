@@ -0,0 +1,273 @@
+"""Annotation downloads.
+
+Annotations are exported one batch of dataset items at a time. Items are read in id order
+and the markup of a batch is read from a cursor sorted by `dataset_item_id` and merged
+into the items as both are walked, so memory use is bounded by the batch size rather
+than the size of the project.
+"""
+
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..utils.streaming import (
+    EXPORT_BATCH_SIZE,
+    NDJSON_MEDIA_TYPE,
+    encode_json,
+    encode_json_line,
+)
+from .schemas import DownloadFormat
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_MEDIA_TYPES = {
+    DownloadFormat.json: "application/json",
+    DownloadFormat.jsonl: NDJSON_MEDIA_TYPE,
+    DownloadFormat.conll: "text/plain",
+}
+
+# Tag of tokens outside of any entity in CoNLL downloads
+OUTSIDE_TAG = "O"
+
+DATASET_ITEM_PROJECTION = {
+    "tokens": 1,
+    "original": 1,
+    "text": 1,
+    "extra_fields": 1,
+    "external_id": 1,
+    "save_states": 1,
+    "flags": 1,
+}
+
+MARKUP_PROJECTION = {
+    "dataset_item_id": 1,
+    "classification": 1,
+    "start": 1,
+    "end": 1,
+    "source_id": 1,
+    "target_id": 1,
+    "ontology_item_id": 1,
+    "created_by": 1,
+}
+
+
+def create_dataset_item_filter(
+    project_id: ObjectId, usernames: List[str], flags: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """Creates the dataset item filter of a download.
+
+    Only flags raised by the given annotators are considered; `no_flags` selects the
+    items none of them have flagged.
+    """
+    _filter = {"project_id": project_id}
+    if not flags or "everything" in flags:
+        return _filter
+
+    if "no_flags" in flags:
+        _filter["flags"] = {"$not": {"$elemMatch": {"created_by": {"$in": usernames}}}}
+    else:
+        _filter["flags"] = {
+            "$elemMatch": {"state": {"$in": flags}, "created_by": {"$in": usernames}}
+        }
+    return _filter
+
+
+def create_download_item(
+    dataset_item: Dict[str, Any],
+    markup: List[Dict[str, Any]],
+    usernames: List[str],
+    ontology_id2fullname: Dict[str, str],
+) -> Dict[str, Any]:
+    """Creates the download record of a dataset item and the markup of its annotators."""
+    return {
+        "id": str(dataset_item["_id"]),
+        "original": dataset_item["original"],
+        "text": dataset_item["text"],
+        "tokens": dataset_item["tokens"],
+        "extra_fields": dataset_item.get("extra_fields"),
+        "external_id": dataset_item.get("external_id"),
+        "saved_by": [
+            ss["created_by"]
+            for ss in dataset_item.get("save_states") or []
+            if ss["created_by"] in usernames
+        ],
+        "flags": [
+            {"state": f["state"], "annotator": f["created_by"]}
+            for f in dataset_item.get("flags") or []
+            if f.get("created_by") in usernames
+        ],
+        "entities": [
+            {
+                "id": str(m["_id"]),
+                "start": m["start"],
+                "end": m["end"],
+                "label": ontology_id2fullname.get(m["ontology_item_id"]),
+                "annotator": m["created_by"],
+            }
+            for m in markup
+            if m["classification"] == "entity"
+        ],
+        "relations": [
+            {
+                "id": str(m["_id"]),
+                "source_id": str(m["source_id"]),
+                "target_id": str(m["target_id"]),
+                "label": ontology_id2fullname.get(m["ontology_item_id"]),
+                "annotator": m["created_by"],
+            }
+            for m in markup
+            if m["classification"] == "relation"
+        ],
+    }
+
+
+def create_conll_item(item: Dict[str, Any], usernames: List[str]) -> str:
+    """Creates one CoNLL block of BIO tagged tokens per annotator of a download record.
+
+    Entities overlapping an earlier (or, at the same start, longer) entity of the same
+    annotator cannot be tagged and are left out.
+    """
+    tokens = item["tokens"]
+    blocks = []
+    for username in usernames:
+        tags = [OUTSIDE_TAG] * len(tokens)
+        entities = sorted(
+            (
+                e
+                for e in item["entities"]
+                if e["annotator"] == username and e["label"] is not None
+            ),
+            key=lambda e: (e["start"], e["start"] - e["end"]),
+        )
+        for e in entities:
+            span = range(e["start"], min(e["end"], len(tokens) - 1) + 1)
+            if any(tags[i] != OUTSIDE_TAG for i in span):
+                continue
+            for i in span:
+                tags[i] = f"{'B' if i == e['start'] else 'I'}-{e['label']}"
+
+        lines = [f"# id = {item['id']}", f"# annotator = {username}"]
+        lines += [f"{token}\t{tag}" for token, tag in zip(tokens, tags)]
+        blocks.append("\n".join(lines) + "\n\n")
+    return "".join(blocks)
+
+
+async def find_download_items(
+    db: AsyncIOMotorDatabase,
+    project_id: ObjectId,
+    usernames: List[str],
+    ontology_id2fullname: Dict[str, str],
+    flags: Optional[List[str]] = None,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Yields the download records of a project's dataset items in batches."""
+    item_filter = create_dataset_item_filter(
+        project_id=project_id, usernames=usernames, flags=flags
+    )
+
+    last_id = None
+    while True:
+        _filter = (
+            item_filter if last_id is None else {**item_filter, "_id": {"$gt": last_id}}
+        )
+        dataset_items = (
+            await db["data"]
+            .find(_filter, DATASET_ITEM_PROJECTION)
+            .sort("_id", 1)
+            .limit(EXPORT_BATCH_SIZE)
+            .to_list(None)
+        )
+        if len(dataset_items) == 0:
+            break
+        last_id = dataset_items[-1]["_id"]
+
+        markup_cursor = (
+            db["markup"]
+            .find(
+                {
+                    "project_id": project_id,
+                    "created_by": {"$in": usernames},
+                    "dataset_item_id": {
+                        "$gte": dataset_items[0]["_id"],
+                        "$lte": last_id,
+                    },
+                },
+                MARKUP_PROJECTION,
+            )
+            .sort("dataset_item_id", 1)
+        )
+
+        # Merge join of the items and the markup, both in dataset item id order.
+        items = []
+        position = 0
+        item_markup = []
+        async for m in markup_cursor:
+            while (
+                position < len(dataset_items)
+                and dataset_items[position]["_id"] < m["dataset_item_id"]
+            ):
+                items.append(
+                    create_download_item(
+                        dataset_items[position],
+                        item_markup,
+                        usernames,
+                        ontology_id2fullname,
+                    )
+                )
+                item_markup = []
+                position += 1
+            # Markup of items excluded by the item filter is skipped.
+            if (
+                position < len(dataset_items)
+                and dataset_items[position]["_id"] == m["dataset_item_id"]
+            ):
+                item_markup.append(m)
+        for dataset_item in dataset_items[position:]:
+            items.append(
+                create_download_item(
+                    dataset_item, item_markup, usernames, ontology_id2fullname
+                )
+            )
+            item_markup = []
+
+        yield items
+
+
+async def download_annotations(
+    db: AsyncIOMotorDatabase,
+    project_id: ObjectId,
+    usernames: List[str],
+    ontology_id2fullname: Dict[str, str],
+    download_format: DownloadFormat = DownloadFormat.json,
+    flags: Optional[List[str]] = None,
+) -> AsyncIterator[str]:
+    """Encodes the annotations of a project's annotators as they are read.
+
+    JSON downloads are an object keyed by dataset item id, JSONL downloads hold one
+    record per line and CoNLL downloads one block of tagged tokens per item and annotator.
+    """
+    count = 0
+    if download_format == DownloadFormat.json:
+        yield "{"
+
+    async for items in find_download_items(
+        db=db,
+        project_id=project_id,
+        usernames=usernames,
+        ontology_id2fullname=ontology_id2fullname,
+        flags=flags,
+    ):
+        if download_format == DownloadFormat.json:
+            yield ("," if count else "") + ",".join(
+                f"{encode_json(item['id'])}:{encode_json(item)}" for item in items
+            )
+        elif download_format == DownloadFormat.jsonl:
+            yield "".join(encode_json_line(item) for item in items)
+        else:
+            yield "".join(create_conll_item(item, usernames) for item in items)
+        count += len(items)
+
+    if download_format == DownloadFormat.json:
+        yield "}"
+    logger.info(f"Downloaded {count} dataset items of project {project_id}")
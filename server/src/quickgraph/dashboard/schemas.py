@@ -1,6 +1,7 @@
 """Dashboard schemas."""
 
 from datetime import datetime
+from enum import Enum
 from typing import Any, Dict, List, Optional, Union
 
 from pydantic import BaseModel, ConfigDict, Field
@@ -17,6 +18,12 @@ from ..project.schemas import (
 from ..utils.schemas import PydanticObjectIdAnnotated
 
 
+class DownloadFormat(str, Enum):
+    json = "json"
+    jsonl = "jsonl"
+    conll = "conll"
+
+
 class Annotator(BaseModel):
     username: str = Field(description="Username associated with annotator")
     role: AnnotatorRoles = Field(description="Role assigned to annotator")
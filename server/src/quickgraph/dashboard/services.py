@@ -1,5 +1,6 @@
 """Dashboard services."""
 
+import asyncio
 import datetime
 import itertools
 import logging
@@ -8,17 +9,26 @@ from typing import Any, Dict, List, Optional
 
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
 
 from ..markup.schemas import Classifications as MarkupClassifications
-from ..project.schemas import OntologyItem
+from ..markup.snapshots import attach_endpoint_snapshots
+from ..project.assignments import count_assigned_dataset_items
 from ..project.services import find_one_project
-from ..utils.misc import flatten_hierarchical_ontology
+from ..resources.services import get_project_compiled_ontologies
+from ..utils.agreement import AgreementCalculator
+from ..utils.cache import find_project
+from ..utils.context import detach_request_context
 from .schemas import Annotator, DashboardInformation, DashboardPlot
+from .stats import PROJECT_STATS_COLLECTION
 
 DATE_FORMAT = "%d/%m/%Y"
 
 logger = logging.getLogger(__name__)
 
+# Background statistics refreshes running in this process, keyed by project.
+_refresh_tasks: Dict[ObjectId, asyncio.Task] = {}
+
 
 async def get_dashboard_information(
     db: AsyncIOMotorDatabase, project_id: ObjectId, username: str
@@ -30,6 +40,7 @@ async def get_dashboard_information(
         return None
 
     logger.info(f"Project settings: {project.settings}")
+    scope_sizes = await count_assigned_dataset_items(db=db, project_id=project_id)
 
     return DashboardInformation(
         user_is_pm=project.created_by == username,
@@ -45,7 +56,7 @@ async def get_dashboard_information(
                 username=a.username,
                 state=a.state,
                 role=a.role,
-                scope_size=len(a.scope),
+                scope_size=scope_sizes.get(a.username, 0),
             )
             for a in project.annotators
         ],
@@ -147,17 +158,9 @@ async def create_markup_plot_data(
     ).to_list(None)
 
     # Get ontology
-    ontology = await db.resources.find_one(
-        {
-            "project_id": project_id,
-            "classification": "ontology",
-            "sub_classification": classification,
-        },
-        {"content": 1},
-    )
-    ontology = [OntologyItem(**item) for item in ontology["content"]]
-    flat_ontology = flatten_hierarchical_ontology(ontology=ontology)
-    ontology_id2fullname = {item.id: item.fullname for item in flat_ontology}
+    ontology = (await get_project_compiled_ontologies(db=db, project_id=project_id))[
+        classification
+    ]
 
     # Get counts
     counts = defaultdict(dict)
@@ -169,7 +172,7 @@ async def create_markup_plot_data(
         else:
             counts[ontology_item_id][username] = 1
 
-    dataset = [{"x": ontology_id2fullname[k], **v} for k, v in counts.items()]
+    dataset = [{"x": ontology.id2fullname[k], **v} for k, v in counts.items()]
 
     # Sort by the maximum value in each dictionary, excluding the 'x' key.
     dataset = sorted(
@@ -184,7 +187,7 @@ async def create_markup_plot_data(
         name=f"{classification.replace('y', 'ie').capitalize()}s",
         caption=f"Distribution of Applied {classification.replace('y','ie').capitalize()}s",
         no_data_title=f"No {classification.replace('y', 'ie')}s have been applied by project annotators yet",
-        meta={"label_colors": {item.fullname: item.color for item in flat_ontology}},
+        meta={"label_colors": dict(ontology.fullname2color)},
     )
 
 
@@ -305,86 +308,295 @@ async def calculate_project_progress(project_id: ObjectId, db: AsyncIOMotorDatab
     """
     Calculates the overall progress of a project
     """
+    project = await find_project(db=db, project_id=project_id)
 
     pipeline = [
-        {"$match": {"_id": project_id}},
-        {"$project": {"dataset_id": 1, "settings": 1}},
-        {
-            "$lookup": {
-                "from": "data",
-                "localField": "dataset_id",
-                "foreignField": "dataset_id",
-                "as": "data",
-            }
-        },
+        {"$match": {"dataset_id": project["dataset_id"]}},
         {
-            "$addFields": {
-                "data": {
-                    "$map": {
-                        "input": "$data",
-                        "as": "item",
-                        "in": {
-                            "$mergeObjects": [
-                                "$$item",
-                                {
-                                    "save_states_count": {
-                                        "$size": {"$ifNull": ["$$item.save_states", []]}
-                                    }
-                                },
-                            ]
-                        },
-                    }
-                }
-            }
-        },
-        {
-            "$addFields": {
+            "$group": {
+                "_id": None,
+                "data_count": {"$sum": 1},
                 "data_filtered_count": {
-                    "$size": {
-                        "$filter": {
-                            "input": "$data",
-                            "as": "item",
-                            "cond": {
+                    "$sum": {
+                        "$cond": [
+                            {
                                 "$gte": [
-                                    "$$item.save_states_count",
-                                    "$settings.annotators_per_item",
-                                ],
+                                    {"$size": {"$ifNull": ["$save_states", []]}},
+                                    project["settings"]["annotators_per_item"],
+                                ]
                             },
-                        }
+                            1,
+                            0,
+                        ]
                     }
                 },
-                "data_count": {"$size": "$data"},
             }
         },
+    ]
+
+    result = await db["data"].aggregate(pipeline).to_list(None)
+    data_count = result[0]["data_count"] if result else 0
+    data_filtered_count = result[0]["data_filtered_count"] if result else 0
+
+    return {
+        "data_count": data_count,
+        "data_filtered_count": data_filtered_count,
+        "percentage": 0 if data_count == 0 else data_filtered_count / data_count * 100,
+    }
+
+
+async def compute_project_overview(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> Optional[Dict[str, Any]]:
+    """Computes the project dashboard overview metrics and plots."""
+    # Fetch project details
+    project = await find_project(db=db, project_id=project_id)
+    if project is None:
+        return None
+    is_relation_project = project["tasks"]["relation"]
+
+    # Create overview plot data
+    plot_data = await create_overview_plot_data(
+        db=db,
+        project_id=project_id,
+        is_relation_project=is_relation_project,
+    )
+
+    # Calculate overview metrics
+    project_progress_metrics = await calculate_project_progress(project_id, db)
+
+    dataset_item_pipeline = [
+        {"$match": {"project_id": project_id}},
         {
-            "$addFields": {
-                "percentage": {
-                    "$cond": [
-                        {"$eq": ["$data_count", 0]},
-                        0,
-                        {
-                            "$multiply": [
-                                {"$divide": ["$data_filtered_count", "$data_count"]},
-                                100,
-                            ]
-                        },
-                    ]
-                }
+            "$project": {
+                "_id": 1,
+                "save_count": {"$size": {"$ifNull": ["$save_states", []]}},
             }
         },
         {
-            "$project": {
-                "_id": 0,
-                "data_count": 1,
-                "data_filtered_count": 1,
-                "percentage": 1,
+            "$match": {
+                "save_count": {"$gte": project["settings"]["annotators_per_item"]}
             }
         },
     ]
 
-    result = await db["projects"].aggregate(pipeline).to_list(None)
+    dataset_items = await db["data"].aggregate(dataset_item_pipeline).to_list(None)
+    dataset_item_ids = [di["_id"] for di in dataset_items]
+    logger.info(f"calculating agreement on {len(dataset_items)} dataset items")
+
+    # Get agreement metrics for accepted entities on dataset items that have been saved by majority
+    entity_markup = (
+        await db["markup"]
+        .find(
+            {
+                "project_id": project_id,
+                "classification": "entity",
+                "suggested": False,
+                "dataset_item_id": {"$in": dataset_item_ids},
+            }
+        )
+        .to_list(None)
+    )
 
-    return result[0]
+    # Relation is accepted only on dataset items that have been saved by majority
+    relation_markup = []
+    if is_relation_project:
+        # Relations embed snapshots of their source and target entities.
+        relation_markup = (
+            await db["markup"]
+            .find(
+                {
+                    "project_id": project_id,
+                    "classification": "relation",
+                    "suggested": False,
+                    "dataset_item_id": {"$in": dataset_item_ids},
+                },
+                {
+                    "ontology_item_id": 1,
+                    "created_by": 1,
+                    "dataset_item_id": 1,
+                    "source_id": 1,
+                    "target_id": 1,
+                    "source": 1,
+                    "target": 1,
+                },
+            )
+            .to_list(None)
+        )
+        relation_markup = await attach_endpoint_snapshots(
+            db=db, relations=relation_markup
+        )
+
+    agreement_calculator = AgreementCalculator(
+        entity_data=[
+            {
+                "start": m["start"],
+                "end": m["end"],
+                "label": m["ontology_item_id"],
+                "username": m["created_by"],
+                "doc_id": str(m["dataset_item_id"]),
+            }
+            for m in entity_markup
+        ],
+        relation_data=[
+            {
+                "label": m["ontology_item_id"],
+                "username": m["created_by"],
+                "source": {
+                    "start": m["source"]["start"],
+                    "end": m["source"]["end"],
+                    "label": m["source"]["ontology_item_id"],
+                },
+                "target": {
+                    "start": m["target"]["start"],
+                    "end": m["target"]["end"],
+                    "label": m["target"]["ontology_item_id"],
+                },
+                "doc_id": str(m["dataset_item_id"]),
+            }
+            for m in relation_markup
+        ],
+    )
+
+    entity_overall_agreement_score = agreement_calculator.overall_agreement()
+
+    relation_overall_agreement_score = agreement_calculator.overall_agreement(
+        "relation"
+    )
+
+    overall_agreement_score = agreement_calculator.overall_average_agreement()
+
+    agreed_entity_count = agreement_calculator.count_majority_agreements()
+
+    agreed_relation_count = agreement_calculator.count_majority_agreements("relation")
+
+    output = {
+        "metrics": [
+            {
+                "index": 0,
+                "name": "Project Progress",
+                "title": "Progress made to date (only counts documents saved by the minimum number of annotators)",
+                "value": f"{project_progress_metrics['percentage']:0.0f}%",
+            },
+            {
+                "index": 2,
+                "name": "Average Entity Agreement",
+                "title": "Average entity inter-annotator agreement",
+                "value": (
+                    None
+                    if entity_overall_agreement_score is None
+                    else f"{entity_overall_agreement_score*100:0.0f}%"
+                ),
+            },
+            {
+                "index": 4,
+                "name": "Entities Created",
+                "title": "Count of agreed upon entities (silver and weak) created by annotators",
+                "value": agreed_entity_count,
+            },
+        ],
+        "plots": plot_data,
+    }
+
+    if project["tasks"]["relation"]:
+        output["metrics"] += [
+            {
+                "index": 3,
+                "name": "Average Relation Agreement",
+                "title": "Average relation inter-annotator agreement",
+                "value": (
+                    None
+                    if relation_overall_agreement_score is None
+                    else f"{relation_overall_agreement_score*100:0.0f}%"
+                ),
+            },
+            {
+                "index": 5,
+                "name": "Triples Created",
+                "title": "Count of agreed upon triples (silver and weak) created by annotators",
+                "value": agreed_relation_count,
+            },
+            {
+                "index": 1,
+                "name": "Overall Agreement",
+                "title": "Weighted average overall inter-annotator agreement",
+                "value": (
+                    None
+                    if (overall_agreement_score is None)
+                    else f"{overall_agreement_score*100:0.0f}%"
+                ),
+            },
+        ]
+
+    return output
+
+
+async def refresh_project_stats(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> Optional[Dict[str, Any]]:
+    """Recomputes and stores the statistics of a project."""
+    computed_at = datetime.datetime.utcnow()
+    overview = await compute_project_overview(db=db, project_id=project_id)
+    if overview is None:
+        return None
+
+    stats = await db[PROJECT_STATS_COLLECTION].find_one_and_update(
+        {"_id": project_id},
+        {
+            "$set": {"overview": overview, "computed_at": computed_at},
+            "$setOnInsert": {"changed_at": computed_at},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return stats
+
+
+def is_stale(stats: Dict[str, Any]) -> bool:
+    return stats["changed_at"] > stats["computed_at"]
+
+
+async def refresh_project_stats_in_background(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> None:
+    """Schedules a statistics refresh unless one is already running for the project."""
+    if project_id in _refresh_tasks:
+        return
+
+    async def _refresh():
+        detach_request_context()
+        try:
+            await refresh_project_stats(db=db, project_id=project_id)
+        except Exception as e:
+            logger.error(f"Error refreshing project stats {project_id}: {e}")
+        finally:
+            _refresh_tasks.pop(project_id, None)
+
+    _refresh_tasks[project_id] = asyncio.create_task(_refresh())
+
+
+async def get_project_overview(
+    db: AsyncIOMotorDatabase, project_id: ObjectId, refresh: bool = False
+) -> Optional[Dict[str, Any]]:
+    """Reads the project overview from its stored statistics.
+
+    Statistics are computed on first read or when `refresh` is set. Stale statistics are
+    returned as is and refreshed in the background.
+    """
+    stats = await db[PROJECT_STATS_COLLECTION].find_one({"_id": project_id})
+
+    if refresh or stats is None or "overview" not in stats:
+        stats = await refresh_project_stats(db=db, project_id=project_id)
+        if stats is None:
+            return None
+    elif is_stale(stats):
+        await refresh_project_stats_in_background(db=db, project_id=project_id)
+
+    return {
+        **stats["overview"],
+        "updated_at": stats["computed_at"],
+        "stale": is_stale(stats),
+    }
 
 
 async def filter_annotations(
@@ -406,9 +618,7 @@ async def filter_annotations(
     )
 
     # Fetch save_states of dataset items
-    project = await db["projects"].find_one(
-        {"_id": project_id}, {"annotators": 1, "tasks": 1}
-    )
+    project = await find_project(db=db, project_id=project_id)
 
     # Create markup filters
 
@@ -0,0 +1,34 @@
+"""Project statistics staleness.
+
+Project statistics are cached in the `project_stats` collection and recomputed when
+the data they are computed from has changed since. These helpers only record changes,
+so services that are themselves imported by the dashboard can mark statistics stale.
+"""
+
+import datetime
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+PROJECT_STATS_COLLECTION = "project_stats"
+
+
+async def mark_project_stats_stale(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> None:
+    """Records that data the project statistics are computed from has changed."""
+    await db[PROJECT_STATS_COLLECTION].update_one(
+        {"_id": project_id},
+        {"$set": {"changed_at": datetime.datetime.utcnow()}},
+    )
+
+
+async def mark_dataset_item_project_stats_stale(
+    db: AsyncIOMotorDatabase, dataset_item_id: ObjectId
+) -> None:
+    """Marks the statistics of the project a dataset item belongs to as stale."""
+    dataset_item = await db["data"].find_one(
+        {"_id": dataset_item_id}, {"project_id": 1}
+    )
+    if dataset_item and dataset_item.get("project_id"):
+        await mark_project_stats_stale(db=db, project_id=dataset_item["project_id"])
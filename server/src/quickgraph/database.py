@@ -5,6 +5,8 @@ from typing import Optional
 
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorClientSession
 
+from .utils.context import CommandCounter
+
 logger = logging.getLogger(__name__)
 
 client: Optional[AsyncIOMotorClient] = None
@@ -19,7 +21,7 @@ def connect_to_mongo(uri: str) -> None:
     logger.info(f"Connecting to MongoDB at {uri}")
     global client
     if client is None:
-        client = AsyncIOMotorClient(uri)
+        client = AsyncIOMotorClient(uri, event_listeners=[CommandCounter()])
         logger.info("Connected to MongoDB.")
 
 
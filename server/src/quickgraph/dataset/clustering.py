@@ -0,0 +1,384 @@
+"""Dataset clustering.
+
+Dataset items are clustered on their sentence embeddings with HDBSCAN. Embeddings are
+persisted as float32 binary vectors in the `embeddings` collection (keyed by content
+hash so copies of an item share them) and each cluster's exemplars are stored in the
+`clusters` collection. New items are assigned to the nearest existing cluster from its
+exemplars; a full recluster only runs when a dataset is created or on request.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import hdbscan
+import numpy as np
+from bson import Binary, ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from ..jobs.services import JobContext
+from .embeddings import content_hash, encode_texts
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_COLLECTION = "embeddings"
+CLUSTERS_COLLECTION = "clusters"
+
+# Maximum number of exemplars stored per cluster for approximate prediction.
+MAX_EXEMPLARS = 50
+# Number of ids per `$in` query when reading stored embeddings.
+QUERY_BATCH_SIZE = 10000
+# Number of dataset items embedded between progress reports when clustering.
+EMBEDDING_BATCH_SIZE = 5000
+
+
+def whitespace_tokenizer(text):
+    """Tokenize text using whitespace."""
+    return text.split()
+
+
+def extract_keywords(texts: List[str], top_n: int) -> List[str]:
+    """Extract top keywords from a list of texts using TF-IDF."""
+    if not texts:
+        return []
+
+    vectorizer = TfidfVectorizer(
+        stop_words="english",
+        tokenizer=whitespace_tokenizer,
+        token_pattern=None,
+    )
+    try:
+        tfidf_matrix = vectorizer.fit_transform(texts)
+        indices = np.argsort(vectorizer.idf_)[::-1]
+        features = vectorizer.get_feature_names_out()
+        return [features[i] for i in indices[:top_n]]
+    except Exception as e:
+        logger.error(f"Error extracting keywords: {str(e)}")
+        return []
+
+
+def to_binary(vector: np.ndarray) -> Binary:
+    return Binary(np.ascontiguousarray(vector, dtype=np.float32).tobytes())
+
+
+def from_binary(data: bytes, dim: int = None) -> np.ndarray:
+    vector = np.frombuffer(data, dtype=np.float32)
+    return vector if dim is None else vector.reshape(-1, dim)
+
+
+async def get_embeddings(db: AsyncIOMotorDatabase, texts: List[str]) -> np.ndarray:
+    """Returns embeddings for texts, encoding and persisting only those not yet stored."""
+    hashes = [content_hash(t) for t in texts]
+    unique_texts = dict(zip(hashes, texts))
+    unique_hashes = list(unique_texts.keys())
+
+    stored = {}
+    for i in range(0, len(unique_hashes), QUERY_BATCH_SIZE):
+        async for doc in db[EMBEDDINGS_COLLECTION].find(
+            {"_id": {"$in": unique_hashes[i : i + QUERY_BATCH_SIZE]}}
+        ):
+            stored[doc["_id"]] = from_binary(doc["vector"])
+
+    missing = [h for h in unique_hashes if h not in stored]
+    if missing:
+        encoded = await asyncio.to_thread(
+            encode_texts, [unique_texts[h] for h in missing]
+        )
+        await db[EMBEDDINGS_COLLECTION].bulk_write(
+            [
+                UpdateOne(
+                    {"_id": h}, {"$setOnInsert": {"vector": to_binary(e)}}, upsert=True
+                )
+                for h, e in zip(missing, encoded)
+            ],
+            ordered=False,
+        )
+        stored.update(zip(missing, encoded))
+
+    return np.vstack([stored[h] for h in hashes])
+
+
+def nearest_distances(points: np.ndarray, exemplars: np.ndarray) -> np.ndarray:
+    """Euclidean distance from each point to its nearest exemplar."""
+    distances = (
+        np.sum(points**2, axis=1)[:, None]
+        + np.sum(exemplars**2, axis=1)[None, :]
+        - 2 * points @ exemplars.T
+    )
+    return np.sqrt(np.clip(distances.min(axis=1), 0, None))
+
+
+def fit_clusters(
+    texts: List[str],
+    embeddings: np.ndarray,
+    min_cluster_size: int = 2,
+    min_samples: int = 1,
+    top_n_keywords: int = 5,
+) -> Tuple[np.ndarray, Dict[int, List[str]], Dict[int, Tuple[np.ndarray, float]]]:
+    """Cluster embeddings with HDBSCAN.
+
+    Args:
+        texts: Texts the embeddings were computed from, used for keywords
+        embeddings: Embeddings of the texts
+        min_cluster_size: Minimum size for a cluster (default: 2)
+        min_samples: Minimum samples for HDBSCAN (default: 1)
+        top_n_keywords: Number of keywords to extract per cluster (default: 5)
+
+    Returns:
+        Tuple of cluster assignments, cluster keywords and, per cluster, its
+        exemplars and the distance threshold used for approximate prediction
+    """
+    if not texts:
+        raise ValueError("Input texts list cannot be empty")
+
+    # Adjust min_cluster_size based on dataset size
+    adjusted_min_cluster_size = min(min_cluster_size, len(texts))
+    if adjusted_min_cluster_size != min_cluster_size:
+        logger.warning(
+            f"Adjusted min_cluster_size from {min_cluster_size} to {adjusted_min_cluster_size} "
+            f"due to small dataset size"
+        )
+
+    hdbscan_exemplars = None
+    if len(texts) == 1:
+        # Handle single document case
+        logger.info("Single document detected, assigning to cluster 0")
+        clusters = np.array([0])
+    else:
+        clusterer = hdbscan.HDBSCAN(
+            min_cluster_size=adjusted_min_cluster_size,
+            min_samples=min_samples,
+            metric="euclidean",
+            prediction_data=True,
+        )
+        clusters = clusterer.fit_predict(embeddings)
+
+        logger.info(
+            f"Found {len(set(clusters)) - (1 if -1 in clusters else 0)} clusters"
+        )
+
+        # Check if all points are noise
+        if all(cluster_id == -1 for cluster_id in clusters):
+            logger.warning("No valid clusters found; all points marked as noise")
+            # Fallback: treat all documents as one cluster
+            clusters = np.zeros(len(texts), dtype=int)
+        else:
+            try:
+                hdbscan_exemplars = clusterer.exemplars_
+            except Exception as e:
+                logger.warning(f"Unable to compute cluster exemplars: {e}")
+
+    # Group texts by cluster
+    cluster_members = defaultdict(list)
+    for idx, cluster_id in enumerate(clusters):
+        cluster_members[int(cluster_id)].append(idx)
+
+    rng = np.random.default_rng(0)
+    cluster_keywords = {}
+    cluster_exemplars = {}
+    for cluster_id, members in cluster_members.items():
+        if cluster_id == -1:  # Skip noise cluster
+            continue
+        cluster_keywords[cluster_id] = extract_keywords(
+            [texts[i] for i in members], top_n_keywords
+        )
+
+        member_embeddings = embeddings[members]
+        exemplars = (
+            hdbscan_exemplars[cluster_id]
+            if hdbscan_exemplars is not None
+            else member_embeddings
+        )
+        if len(exemplars) > MAX_EXEMPLARS:
+            exemplars = exemplars[
+                rng.choice(len(exemplars), MAX_EXEMPLARS, replace=False)
+            ]
+        threshold = float(nearest_distances(member_embeddings, exemplars).max())
+        cluster_exemplars[cluster_id] = (exemplars.astype(np.float32), threshold)
+
+    return clusters, cluster_keywords, cluster_exemplars
+
+
+def predict_clusters(embeddings: np.ndarray, clusters: List[Dict]) -> List[int]:
+    """Approximately predicts clusters for new embeddings from stored exemplars.
+
+    A point joins the cluster of its nearest exemplar if it is no further away than
+    the cluster's members were at fit time; otherwise it is treated as noise (-1).
+    """
+    if len(clusters) == 0:
+        return [-1] * len(embeddings)
+
+    exemplars = np.vstack([c["exemplars"] for c in clusters])
+    exemplar_clusters = np.concatenate(
+        [np.full(len(c["exemplars"]), i) for i, c in enumerate(clusters)]
+    )
+    distances = (
+        np.sum(embeddings**2, axis=1)[:, None]
+        + np.sum(exemplars**2, axis=1)[None, :]
+        - 2 * embeddings @ exemplars.T
+    )
+    nearest = distances.argmin(axis=1)
+    nearest_distance = np.sqrt(
+        np.clip(distances[np.arange(len(embeddings)), nearest], 0, None)
+    )
+
+    predictions = []
+    for exemplar_idx, distance in zip(nearest, nearest_distance):
+        cluster = clusters[exemplar_clusters[exemplar_idx]]
+        predictions.append(
+            cluster["cluster_id"] if distance <= cluster["threshold"] else -1
+        )
+    return predictions
+
+
+async def update_item_clusters(
+    db: AsyncIOMotorDatabase,
+    dataset_item_ids: List[ObjectId],
+    clusters: List[int],
+    cluster_keywords: Dict[int, List[str]],
+) -> None:
+    """Writes cluster assignments to dataset items, one update per cluster."""
+    cluster_items = defaultdict(list)
+    for dataset_item_id, cluster_id in zip(dataset_item_ids, clusters):
+        cluster_items[int(cluster_id)].append(dataset_item_id)
+
+    for cluster_id, ids in cluster_items.items():
+        await db["data"].update_many(
+            {"_id": {"$in": ids}},
+            {
+                "$set": {
+                    "cluster_id": cluster_id,
+                    "cluster_keywords": cluster_keywords.get(cluster_id, []),
+                }
+            },
+        )
+
+
+async def cluster_dataset(
+    db: AsyncIOMotorDatabase, dataset_id: ObjectId, job: Optional[JobContext] = None
+) -> int:
+    """Fully (re)clusters a dataset and stores its cluster exemplars.
+
+    Progress is reported to `job` after each batch of embedded items and before the
+    clusters are written. Returns the number of clusters found.
+    """
+    dataset_item_ids = []
+    texts = []
+    async for item in db["data"].find({"dataset_id": dataset_id}, {"original": 1}):
+        dataset_item_ids.append(item["_id"])
+        texts.append(item["original"])
+
+    if len(texts) == 0:
+        return 0
+
+    embeddings = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        embeddings.append(
+            await get_embeddings(db=db, texts=texts[i : i + EMBEDDING_BATCH_SIZE])
+        )
+        if job:
+            embedded = min(i + EMBEDDING_BATCH_SIZE, len(texts))
+            await job.update_progress(
+                0.7 * embedded / len(texts),
+                f"Embedded {embedded} of {len(texts)} dataset items",
+            )
+    clusters, cluster_keywords, cluster_exemplars = await asyncio.to_thread(
+        fit_clusters, texts=texts, embeddings=np.vstack(embeddings)
+    )
+    if job:
+        await job.update_progress(0.9, "Writing clusters")
+
+    await update_item_clusters(
+        db=db,
+        dataset_item_ids=dataset_item_ids,
+        clusters=clusters,
+        cluster_keywords=cluster_keywords,
+    )
+
+    await db[CLUSTERS_COLLECTION].delete_many({"dataset_id": dataset_id})
+    await db[CLUSTERS_COLLECTION].insert_many(
+        [
+            {
+                "dataset_id": dataset_id,
+                "cluster_id": cluster_id,
+                "keywords": cluster_keywords[cluster_id],
+                "exemplars": to_binary(exemplars),
+                "dim": exemplars.shape[1],
+                "threshold": threshold,
+            }
+            for cluster_id, (exemplars, threshold) in cluster_exemplars.items()
+        ]
+    )
+
+    logger.info(
+        f"Clustered dataset {dataset_id} into {len(cluster_exemplars)} clusters"
+    )
+    return len(cluster_exemplars)
+
+
+async def assign_dataset_items_to_clusters(
+    db: AsyncIOMotorDatabase, dataset_id: ObjectId, dataset_item_ids: List[ObjectId]
+) -> None:
+    """Assigns new dataset items to the existing clusters of their dataset."""
+    if len(dataset_item_ids) == 0:
+        return
+
+    clusters = [
+        {**c, "exemplars": from_binary(c["exemplars"], c["dim"])}
+        async for c in db[CLUSTERS_COLLECTION].find({"dataset_id": dataset_id})
+    ]
+    if len(clusters) == 0:
+        logger.info(f"Dataset {dataset_id} has no clusters; recluster to assign items")
+        return
+
+    items = (
+        await db["data"]
+        .find({"_id": {"$in": dataset_item_ids}}, {"original": 1})
+        .to_list(None)
+    )
+    embeddings = await get_embeddings(db=db, texts=[i["original"] for i in items])
+    predictions = await asyncio.to_thread(predict_clusters, embeddings, clusters)
+
+    await update_item_clusters(
+        db=db,
+        dataset_item_ids=[i["_id"] for i in items],
+        clusters=predictions,
+        cluster_keywords={c["cluster_id"]: c["keywords"] for c in clusters},
+    )
+
+
+async def copy_dataset_clusters(
+    db: AsyncIOMotorDatabase, source_dataset_id: ObjectId, target_dataset_id: ObjectId
+) -> None:
+    """Copies the cluster exemplars of a dataset, e.g. from a blueprint to a project."""
+    clusters = [
+        {**c, "dataset_id": target_dataset_id}
+        async for c in db[CLUSTERS_COLLECTION].find(
+            {"dataset_id": source_dataset_id}, {"_id": 0}
+        )
+    ]
+    if clusters:
+        await db[CLUSTERS_COLLECTION].insert_many(clusters)
+
+
+async def find_dataset_clusters(
+    db: AsyncIOMotorDatabase, dataset_id: ObjectId
+) -> List[Dict]:
+    """Lists the clusters of a dataset and their keywords."""
+    pipeline = [
+        {"$match": {"dataset_id": dataset_id}},
+        {
+            "$group": {
+                "_id": "$cluster_id",
+                "keywords": {"$first": "$cluster_keywords"},
+            }
+        },
+        {"$sort": {"_id": 1}},
+    ]
+    return [
+        {"value": c["_id"], "keywords": c["keywords"]}
+        async for c in db["data"].aggregate(pipeline)
+    ]
@@ -0,0 +1,101 @@
+"""Dataset embedding service.
+
+A process-wide SentenceTransformer model is loaded lazily on first use and shared by
+all callers. Embeddings are computed in batches and cached in memory by the hash of the
+text content so unchanged dataset items are never re-embedded.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from ..settings import settings
+
+logger = logging.getLogger(__name__)
+
+_model: Optional[SentenceTransformer] = None
+_model_lock = threading.Lock()
+
+# LRU cache of content hash -> float32 embedding.
+_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_model() -> SentenceTransformer:
+    """Returns the shared embedding model, loading it on first use."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                logger.info(
+                    f"Loading embedding model: {settings.embeddings.model_name}"
+                )
+                _model = SentenceTransformer(settings.embeddings.model_name)
+    return _model
+
+
+def content_hash(text: str) -> str:
+    """Hash of the text content used to key cached embeddings."""
+    return hashlib.sha1(
+        f"{settings.embeddings.model_name}:{text}".encode("utf-8")
+    ).hexdigest()
+
+
+def get_cached_embeddings(hashes: List[str]) -> List[Optional[np.ndarray]]:
+    with _cache_lock:
+        embeddings = []
+        for h in hashes:
+            embedding = _cache.get(h)
+            if embedding is not None:
+                _cache.move_to_end(h)
+            embeddings.append(embedding)
+        return embeddings
+
+
+def cache_embeddings(hashes: List[str], embeddings: np.ndarray) -> None:
+    with _cache_lock:
+        for h, embedding in zip(hashes, embeddings):
+            _cache[h] = embedding
+            _cache.move_to_end(h)
+        while len(_cache) > settings.embeddings.cache_size:
+            _cache.popitem(last=False)
+
+
+def encode_texts(texts: List[str]) -> np.ndarray:
+    """Embeds texts, only encoding those whose content is not already cached.
+
+    This is blocking; call it from a worker thread when on the event loop.
+    """
+    hashes = [content_hash(t) for t in texts]
+    embeddings = get_cached_embeddings(hashes)
+
+    # Encode each distinct uncached text once.
+    missing = {}
+    for h, text, embedding in zip(hashes, texts, embeddings):
+        if embedding is None and h not in missing:
+            missing[h] = text
+
+    if missing:
+        logger.info(f"Encoding {len(missing)} of {len(texts)} texts")
+        encoded = (
+            get_model()
+            .encode(
+                list(missing.values()),
+                batch_size=settings.embeddings.batch_size,
+                convert_to_numpy=True,
+            )
+            .astype(np.float32)
+        )
+        cache_embeddings(list(missing.keys()), encoded)
+        encoded_by_hash = dict(zip(missing.keys(), encoded))
+        embeddings = [
+            e if e is not None else encoded_by_hash[h]
+            for h, e in zip(hashes, embeddings)
+        ]
+
+    return np.vstack(embeddings)
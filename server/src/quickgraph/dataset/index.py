@@ -0,0 +1,409 @@
+"""Dataset token index.
+
+Positional inverted index over dataset item tokens. Each posting is stored as a
+document `{dataset_id, dataset_item_id, token, term, positions}` in the `token_index`
+collection so that entity/relation propagation can find exact token spans without
+scanning item text. `term` is the normalized token used for search.
+"""
+
+import asyncio
+import logging
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import BulkWriteError, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+TOKEN_INDEX_COLLECTION = "token_index"
+
+# Version of the postings format. Datasets record the version their index was built
+# with in `token_index_version`; datasets without the current version are rebuilt.
+# Version 3 rebuilds indexes that concurrent builds may have left with duplicates.
+TOKEN_INDEX_VERSION = 3
+
+# Datasets whose index is being built hold the time the build was claimed; a claim older
+# than the timeout (seconds) is assumed to belong to a build that died.
+TOKEN_INDEX_BUILD_FIELD = "token_index_build_started_at"
+TOKEN_INDEX_BUILD_TIMEOUT = 3600
+
+# Seconds between checks for a build claimed elsewhere to finish
+TOKEN_INDEX_POLL_INTERVAL = 1
+
+# An item holds one posting per distinct token.
+TOKEN_INDEX_INDEXES = [
+    IndexModel([("dataset_id", ASCENDING), ("token", ASCENDING)]),
+    IndexModel(
+        [
+            ("dataset_id", ASCENDING),
+            ("term", ASCENDING),
+            ("dataset_item_id", ASCENDING),
+        ]
+    ),
+    IndexModel([("dataset_item_id", ASCENDING), ("token", ASCENDING)], unique=True),
+]
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Number of postings written per `insert_many` when (re)building the index.
+INDEX_BATCH_SIZE = 5000
+
+# Leading and trailing non-word characters are not part of a search term.
+TERM_EDGE_PATTERN = re.compile(r"^\W+|\W+$")
+
+
+def normalize_term(token: str) -> str:
+    """Normalizes a token or search word to its search term."""
+    token = token.lower()
+    return TERM_EDGE_PATTERN.sub("", token) or token
+
+
+def surface_form_terms(surface_form: str) -> List[str]:
+    """Normalizes the words of an entity surface form to search terms, in order."""
+    return [normalize_term(w) for w in surface_form.split(" ") if w]
+
+
+def create_postings(
+    dataset_id: ObjectId, dataset_item_id: ObjectId, tokens: List[str]
+) -> List[Dict[str, Any]]:
+    """Creates the posting documents for a single dataset item."""
+    positions = defaultdict(list)
+    for i, token in enumerate(tokens):
+        positions[token].append(i)
+
+    return [
+        {
+            "dataset_id": dataset_id,
+            "dataset_item_id": dataset_item_id,
+            "token": token,
+            "term": normalize_term(token),
+            "positions": p,
+        }
+        for token, p in positions.items()
+    ]
+
+
+async def index_dataset_items(
+    db: AsyncIOMotorDatabase,
+    dataset_id: ObjectId,
+    dataset_item_ids: Optional[List[ObjectId]] = None,
+) -> int:
+    """Adds dataset items to the token index.
+
+    If `dataset_item_ids` is not supplied, every item in the dataset is indexed.
+    Existing postings for the items are replaced. Returns the number of postings written.
+    """
+    _filter = {"dataset_id": dataset_id}
+    if dataset_item_ids is not None:
+        if len(dataset_item_ids) == 0:
+            return 0
+        _filter["_id"] = {"$in": dataset_item_ids}
+        await db[TOKEN_INDEX_COLLECTION].delete_many(
+            {"dataset_item_id": {"$in": dataset_item_ids}}
+        )
+    else:
+        await db[TOKEN_INDEX_COLLECTION].delete_many({"dataset_id": dataset_id})
+
+    count = 0
+    batch = []
+    async for item in db["data"].find(_filter, {"tokens": 1}):
+        batch.extend(create_postings(dataset_id, item["_id"], item["tokens"]))
+        if len(batch) >= INDEX_BATCH_SIZE:
+            count += await insert_postings(db=db, postings=batch)
+            batch = []
+    if batch:
+        count += await insert_postings(db=db, postings=batch)
+
+    if dataset_item_ids is None:
+        await mark_dataset_indexed(db=db, dataset_id=dataset_id)
+
+    logger.info(f"Indexed {count} postings for dataset: {dataset_id}")
+    return count
+
+
+async def insert_postings(
+    db: AsyncIOMotorDatabase, postings: List[Dict[str, Any]]
+) -> int:
+    """Inserts postings, skipping those already written for their item and token.
+
+    Returns:
+        The number of postings inserted.
+    """
+    count = 0
+    for i in range(0, len(postings), INDEX_BATCH_SIZE):
+        batch = postings[i : i + INDEX_BATCH_SIZE]
+        try:
+            await db[TOKEN_INDEX_COLLECTION].insert_many(batch, ordered=False)
+            count += len(batch)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if e.details.get("writeConcernErrors") or any(
+                error["code"] != DUPLICATE_KEY_ERROR for error in errors
+            ):
+                raise
+            count += e.details.get("nInserted", len(batch) - len(errors))
+    return count
+
+
+async def mark_dataset_indexed(db: AsyncIOMotorDatabase, dataset_id: ObjectId) -> None:
+    """Records that every item of a dataset is in the token index and releases the
+    claim on its build."""
+    await db["datasets"].update_one(
+        {"_id": dataset_id},
+        {
+            "$set": {"token_index_version": TOKEN_INDEX_VERSION},
+            "$unset": {TOKEN_INDEX_BUILD_FIELD: ""},
+        },
+    )
+
+
+async def claim_dataset_index_build(
+    db: AsyncIOMotorDatabase, dataset_id: ObjectId
+) -> bool:
+    """Claims the build of a dataset's token index on the dataset document.
+
+    Returns:
+        False if the dataset is missing, already indexed or being built elsewhere.
+    """
+    now = datetime.utcnow()
+    claimed = await db["datasets"].find_one_and_update(
+        {
+            "_id": dataset_id,
+            "token_index_version": {"$ne": TOKEN_INDEX_VERSION},
+            "$or": [
+                {TOKEN_INDEX_BUILD_FIELD: {"$exists": False}},
+                {
+                    TOKEN_INDEX_BUILD_FIELD: {
+                        "$lt": now - timedelta(seconds=TOKEN_INDEX_BUILD_TIMEOUT)
+                    }
+                },
+            ],
+        },
+        {"$set": {TOKEN_INDEX_BUILD_FIELD: now}},
+        projection={"_id": 1},
+    )
+    return claimed is not None
+
+
+async def build_claimed_dataset_index(
+    db: AsyncIOMotorDatabase, dataset_id: ObjectId
+) -> None:
+    """Builds the token index of a dataset whose build has been claimed, releasing the
+    claim if the build fails."""
+    try:
+        await index_dataset_items(db=db, dataset_id=dataset_id)
+    except BaseException:
+        await db["datasets"].update_one(
+            {"_id": dataset_id}, {"$unset": {TOKEN_INDEX_BUILD_FIELD: ""}}
+        )
+        raise
+
+
+async def add_dataset_items_to_index(
+    db: AsyncIOMotorDatabase, dataset_id: ObjectId, dataset_items: List[Dict[str, Any]]
+) -> int:
+    """Adds newly inserted dataset items to the token index from their documents.
+
+    Unlike `index_dataset_items` the items are not read back. Returns the number of
+    postings written.
+    """
+    postings = [
+        p
+        for di in dataset_items
+        for p in create_postings(dataset_id, di["_id"], di["tokens"])
+    ]
+    return await insert_postings(db=db, postings=postings)
+
+
+async def remove_dataset_items_from_index(
+    db: AsyncIOMotorDatabase, dataset_item_ids: List[ObjectId]
+) -> None:
+    """Removes dataset items from the token index."""
+    await db[TOKEN_INDEX_COLLECTION].delete_many(
+        {"dataset_item_id": {"$in": dataset_item_ids}}
+    )
+
+
+async def remove_dataset_from_index(
+    db: AsyncIOMotorDatabase, dataset_id: ObjectId
+) -> None:
+    """Removes all postings of a dataset from the token index."""
+    await db[TOKEN_INDEX_COLLECTION].delete_many({"dataset_id": dataset_id})
+
+
+async def ensure_dataset_indexed(
+    db: AsyncIOMotorDatabase, dataset_id: ObjectId
+) -> None:
+    """Builds the token index of a dataset if it was not built with the current version.
+
+    Postings written for items added to a dataset do not mark it as indexed, so datasets
+    created before the token index are built in full before they are searched. A build
+    is claimed on the dataset document so one dataset is never built twice at once;
+    while another build holds the claim, this waits for it to finish.
+    """
+    while True:
+        dataset = await db["datasets"].find_one(
+            {"_id": dataset_id}, {"token_index_version": 1}
+        )
+        if dataset is None or dataset.get("token_index_version") == TOKEN_INDEX_VERSION:
+            return
+        if await claim_dataset_index_build(db=db, dataset_id=dataset_id):
+            break
+        await asyncio.sleep(TOKEN_INDEX_POLL_INTERVAL)
+
+    logger.info(f"Token index missing or outdated for dataset: {dataset_id}; building")
+    await build_claimed_dataset_index(db=db, dataset_id=dataset_id)
+
+
+async def build_missing_token_indexes(db: AsyncIOMotorDatabase) -> int:
+    """Builds the token index of every dataset not indexed with the current version.
+
+    Datasets being built elsewhere are skipped. The token index indexes are ensured
+    afterwards, as a unique index cannot be built over duplicates left by older builds.
+
+    Returns:
+        The number of datasets indexed.
+    """
+    count = 0
+    async for dataset in db["datasets"].find(
+        {"token_index_version": {"$ne": TOKEN_INDEX_VERSION}}, {"_id": 1}
+    ):
+        if not await claim_dataset_index_build(db=db, dataset_id=dataset["_id"]):
+            continue
+        await build_claimed_dataset_index(db=db, dataset_id=dataset["_id"])
+        count += 1
+    if count:
+        logger.info(f"Built the token index of {count} datasets")
+        try:
+            await db[TOKEN_INDEX_COLLECTION].create_indexes(TOKEN_INDEX_INDEXES)
+        except OperationFailure as e:
+            logger.error(f"Failed to create indexes on '{TOKEN_INDEX_COLLECTION}': {e}")
+    return count
+
+
+def match_phrase(
+    phrase: List[str], positions: Dict[str, Iterable[int]]
+) -> List[Tuple[int, int]]:
+    """Finds the (start, end) token spans of a phrase given its tokens' positions.
+
+    Spans are inclusive of the end token, consistent with `find_sub_lists`.
+    """
+    position_sets = {token: set(p) for token, p in positions.items()}
+    return [
+        (start, start + len(phrase) - 1)
+        for start in sorted(position_sets[phrase[0]])
+        if all(start + i in position_sets[t] for i, t in enumerate(phrase[1:], 1))
+    ]
+
+
+async def find_phrase_postings(
+    db: AsyncIOMotorDatabase,
+    dataset_id: ObjectId,
+    phrases: List[List[str]],
+) -> Dict[ObjectId, Dict[str, List[int]]]:
+    """Intersects the posting lists of the tokens of one or more phrases.
+
+    Returns `{dataset_item_id: {token: positions}}` for items that contain every
+    token of every phrase.
+    """
+    tokens = list({t for phrase in phrases for t in phrase})
+    if len(tokens) == 0:
+        return {}
+
+    await ensure_dataset_indexed(db=db, dataset_id=dataset_id)
+
+    pipeline = [
+        {"$match": {"dataset_id": dataset_id, "token": {"$in": tokens}}},
+        {
+            "$group": {
+                "_id": "$dataset_item_id",
+                "postings": {"$push": {"token": "$token", "positions": "$positions"}},
+            }
+        },
+        # Items must contain every distinct token.
+        {"$match": {f"postings.{len(tokens) - 1}": {"$exists": True}}},
+    ]
+
+    return {
+        r["_id"]: {p["token"]: p["positions"] for p in r["postings"]}
+        async for r in db[TOKEN_INDEX_COLLECTION].aggregate(pipeline)
+    }
+
+
+async def find_phrase_spans(
+    db: AsyncIOMotorDatabase, dataset_id: ObjectId, phrase: List[str]
+) -> Dict[ObjectId, List[Tuple[int, int]]]:
+    """Finds every occurrence of a token phrase in a dataset.
+
+    Returns `{dataset_item_id: [(start, end), ...]}` with inclusive token offsets.
+    """
+    postings = await find_phrase_postings(
+        db=db, dataset_id=dataset_id, phrases=[phrase]
+    )
+
+    spans = {}
+    for dataset_item_id, positions in postings.items():
+        item_spans = match_phrase(phrase, positions)
+        if item_spans:
+            spans[dataset_item_id] = item_spans
+    return spans
+
+
+def match_phrase_pairs(
+    source_spans: List[Tuple[int, int]],
+    target_spans: List[Tuple[int, int]],
+    offset: int,
+    lr_direction: bool,
+) -> List[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """Pairs source/target spans separated by `offset` tokens in the given direction.
+
+    The offset is measured as in `get_entity_offset` and `lr_direction` is True when
+    the source precedes the target.
+    """
+    targets_by_start = defaultdict(list)
+    for span in target_spans:
+        targets_by_start[span[0]].append(span)
+
+    pairs = []
+    for src_span in source_spans:
+        tgt_start = (
+            src_span[1] + offset + 1 if lr_direction else src_span[1] - offset - 1
+        )
+        for tgt_span in targets_by_start.get(tgt_start, []):
+            if (src_span[1] <= tgt_span[0]) == lr_direction:
+                pairs.append((src_span, tgt_span))
+    return pairs
+
+
+async def find_phrase_pair_spans(
+    db: AsyncIOMotorDatabase,
+    dataset_id: ObjectId,
+    source_phrase: List[str],
+    target_phrase: List[str],
+    offset: int,
+    lr_direction: bool,
+) -> Dict[ObjectId, List[Tuple[Tuple[int, int], Tuple[int, int]]]]:
+    """Finds source/target phrase occurrences at a fixed offset and direction.
+
+    Returns `{dataset_item_id: [(source_span, target_span), ...]}`.
+    """
+    postings = await find_phrase_postings(
+        db=db, dataset_id=dataset_id, phrases=[source_phrase, target_phrase]
+    )
+
+    pairs = {}
+    for dataset_item_id, positions in postings.items():
+        item_pairs = match_phrase_pairs(
+            source_spans=match_phrase(source_phrase, positions),
+            target_spans=match_phrase(target_phrase, positions),
+            offset=offset,
+            lr_direction=lr_direction,
+        )
+        if item_pairs:
+            pairs[dataset_item_id] = item_pairs
+    return pairs
@@ -1,22 +1,31 @@
 """Dataset router."""
 
 import logging
-from collections import defaultdict
 from typing import Any, Dict, List, Union
 
 from bson import ObjectId
 from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from ..dashboard.stats import mark_project_stats_stale
 from ..dependencies import (
     get_active_project_user,
     get_db,
     get_user,
     valid_dataset,
+    valid_dataset_manager,
     valid_user_for_dataset,
 )
+from ..jobs.schemas import JobKind
+from ..jobs.services import JobContext, submit_job
 from ..users.schemas import UserDocumentModel
+from .clustering import (
+    assign_dataset_items_to_clusters,
+    cluster_dataset,
+    find_dataset_clusters,
+)
 from .schemas import (
     CreateDatasetBody,
     CreateDataType,
@@ -35,14 +44,13 @@ from .schemas import (
     SaveStateFilter,
 )
 from .services import (
-    create_annotated_dataset_items,
     create_dataset,
-    create_rich_dataset_items,
-    create_standard_dataset_items,
     delete_dataset_items,
+    delete_dataset_items_contents,
     delete_one_dataset,
     filter_dataset,
     find_one_dataset,
+    ingest_dataset_items,
     list_datasets,
 )
 from ..settings import settings
@@ -107,9 +115,35 @@ async def get_dataset_endpoint(
 @router.post("", response_description="Create dataset", response_model=Dataset)
 async def create_dataset_endpoint(
     dataset: CreateDatasetBody,
+    background: bool = False,
     user: UserDocumentModel = Depends(get_user),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
+    """Create a dataset.
+
+    Preprocessing and clustering of large datasets can be slow; if `background` is set
+    the dataset is created by a background job and the job is returned.
+    """
+    if background:
+
+        async def _create_dataset(job: JobContext):
+            created_dataset = await create_dataset(
+                db=db, dataset=dataset, username=user.username, job=job
+            )
+            if created_dataset is None:
+                raise ValueError("Unable to create dataset")
+            return jsonable_encoder(created_dataset, custom_encoder={ObjectId: str})
+
+        job = await submit_job(
+            db=db,
+            kind=JobKind.create_dataset,
+            username=user.username,
+            fn=_create_dataset,
+        )
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(job)
+        )
+
     new_dataset = await create_dataset(db=db, dataset=dataset, username=user.username)
     if new_dataset is None:
         raise HTTPException(
@@ -169,12 +203,22 @@ async def filter_dataset_endpoint(
     flag: int = Query(default=FlagFilter.everything),
     skip: int = Query(default=0, ge=0),
     limit: int = Query(default=10, ge=1, le=20),
+    after: Union[None, str] = Query(default=None),
     dataset_item_ids: Union[None, str] = Query(default=None),
     cluster_id: int | None = Query(default=None, ge=-1),
     user: UserDocumentModel = Depends(get_active_project_user),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    """Filter dataset items."""
+    """Filter dataset items.
+
+    Pages are ordered by dataset item id. Pass the `next_cursor` of a page as `after` to
+    fetch the page that follows it; `skip` selects a page by number.
+    """
+    if after is not None and not ObjectId.is_valid(after):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Invalid cursor",
+        )
     filters = DatasetFilters(
         project_id=project_id,
         search_term=search_term,
@@ -184,6 +228,7 @@ async def filter_dataset_endpoint(
         flag=flag,
         skip=skip,
         limit=limit,
+        after=after,
         dataset_item_ids=dataset_item_ids,
         cluster_id=cluster_id,
     )
@@ -254,69 +299,54 @@ async def add_many_dataset_items(
     )
     logger.info(f"is_project_dataset: {is_project_dataset}")
 
-    if data_type == "text":
-        # User uploading standard newline separated dataset items
-        try:
-            # The client will have the datasets preprocessing options preset or defaults will be sent through.
-            logger.info(f"Preprocessing: {preprocessing}")
-            enriched_items = create_standard_dataset_items(
-                dataset_items=dataset_items,
-                preprocessing=preprocessing,
-                is_blueprint=dataset["is_blueprint"],
-                dataset_id=dataset["_id"],
-                project_id=dataset.get("project_id"),
-            )
-
-            result = await db["data"].insert_many([ei.dict() for ei in enriched_items])
+    # Standard newline separated, rich or annotated dataset items. For "text" items the
+    # client will have the datasets preprocessing options preset or defaults will be sent through.
+    # A failed upload is rolled back by `ingest_dataset_items`.
+    try:
+        inserted_di_ids = await ingest_dataset_items(
+            db=db,
+            dataset_items=dataset_items,
+            dataset=dataset,
+            dataset_id=dataset["_id"],
+            data_type=data_type,
+            is_annotated=is_annotated,
+            username=user.username,
+            project_id=dataset.get("project_id"),
+            preprocessing=preprocessing,
+        )
+    except ValueError as e:
+        logger.error(f"Invalid {data_type} dataset items: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e),
+        )
+    except Exception as e:
+        logger.error(f"Failed to insert {data_type} dataset items: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Unable to add dataset items",
+        )
 
-            new_dataset_items = (
-                await db["data"]
-                .find({"_id": {"$in": result.inserted_ids}})
-                .to_list(None)
-            )
+    try:
+        await assign_dataset_items_to_clusters(
+            db=db, dataset_id=dataset["_id"], dataset_item_ids=inserted_di_ids
+        )
+    except Exception as e:
+        logger.error(f"Failed to cluster {data_type} dataset items: {e}")
+        await delete_dataset_items_contents(db=db, dataset_item_ids=inserted_di_ids)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Unable to add dataset items",
+        )
 
-            return [DatasetItem(**di) for di in new_dataset_items]
-        except Exception as e:
-            logger.error(f"Failed to new standard dataset items: {e}")
-    if data_type == "json":
-        # Annotated or rich dataset
-        if is_annotated:
-            try:
-                inserted_di_ids = await create_annotated_dataset_items(
-                    db,
-                    dataset_items,
-                    dataset,
-                    dataset_id=dataset["_id"],
-                    username=user.username,
-                    project_id=dataset.get("project_id"),
-                )
-
-                new_dataset_items = (
-                    await db["data"]
-                    .find({"_id": {"$in": inserted_di_ids}})
-                    .to_list(None)
-                )
-
-                return [DatasetItem(**di) for di in new_dataset_items]
-            except Exception as e:
-                logger.error(f"Failed to insert annotated data items: {e}")
-        else:
-            # Rich "standard" dataset
-            enriched_items = create_rich_dataset_items(
-                dataset_items=dataset_items,
-                is_blueprint=dataset["is_blueprint"],
-                dataset_id=dataset["_id"],
-                project_id=dataset.get("project_id"),
-            )
-            result = await db["data"].insert_many([ei.dict() for ei in enriched_items])
+    if is_project_dataset:
+        await mark_project_stats_stale(db=db, project_id=dataset["project_id"])
 
-            new_dataset_items = (
-                await db["data"]
-                .find({"_id": {"$in": result.inserted_ids}})
-                .to_list(None)
-            )
+    new_dataset_items = (
+        await db["data"].find({"_id": {"$in": inserted_di_ids}}).to_list(None)
+    )
 
-            return [DatasetItem(**di) for di in new_dataset_items]
+    return [DatasetItem(**di) for di in new_dataset_items]
 
 
 # @router.delete("/item/{item_id}")
@@ -340,14 +370,40 @@ async def get_dataset_clusters_endpoint(
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
     """Get clusters for a dataset."""
-    items = await db.data.find({"dataset_id": ObjectId(dataset_id)}).to_list(None)
+    return await find_dataset_clusters(db=db, dataset_id=ObjectId(dataset_id))
 
-    clusters = defaultdict()
-    for item in items:
-        if item["cluster_id"] not in clusters:
-            clusters[item["cluster_id"]] = item["cluster_keywords"]
 
-    return sorted(
-        [{"value": k, "keywords": v} for k, v in clusters.items()],
-        key=lambda x: x["value"],
-    )
+@router.post("/{dataset_id}/clusters")
+async def cluster_dataset_endpoint(
+    dataset_id: str,
+    background: bool = False,
+    user: UserDocumentModel = Depends(valid_dataset_manager),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """Recluster a dataset.
+
+    Items added after a dataset is created are assigned to its existing clusters; this
+    refits the clusters over every item. If `background` is set the dataset is
+    reclustered by a background job and the job is returned.
+    """
+    dataset_id = ObjectId(dataset_id)
+
+    if background:
+
+        async def _cluster_dataset(job: JobContext):
+            return {
+                "clusters": await cluster_dataset(db=db, dataset_id=dataset_id, job=job)
+            }
+
+        job = await submit_job(
+            db=db,
+            kind=JobKind.cluster_dataset,
+            username=user.username,
+            fn=_cluster_dataset,
+        )
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(job)
+        )
+
+    await cluster_dataset(db=db, dataset_id=dataset_id)
+    return await find_dataset_clusters(db=db, dataset_id=dataset_id)
@@ -292,6 +292,10 @@ class DatasetFilters(BaseModel):
     flag: FlagFilter = Field(default=FlagFilter.everything)
     skip: int = Field(default=1, ge=0)
     limit: int = Field(default=10, ge=1, le=20)
+    after: Optional[str] = Field(
+        default=None,
+        description="Id of the last dataset item of the previous page; takes precedence over `skip`",
+    )
     dataset_item_ids: Optional[str] = Field(default=None)
     cluster_id: Optional[int] = Field(default=None, ge=-1)
 
@@ -305,6 +309,9 @@ class FilteredDataset(BaseModel):
     total_dataset_items: int = Field(default=0, ge=0)
     total_pages: int = Field(default=0, ge=0)
     social: Dict[str, List[Comment]] = Field(default={})
+    next_cursor: Optional[str] = Field(
+        default=None, description="Value of `after` that fetches the next page"
+    )
     # flags: Dict[str, Union[list, List[Flag]]] = Field(default={})
 
     model_config = ConfigDict(arbitrary_types_allowed=True, populate_by_name=True)
@@ -1,26 +1,48 @@
 """Dataset services."""
 
+import asyncio
 import json
 import logging
 import math
 import re
-from collections import defaultdict
 from datetime import datetime
+from functools import partial
 from typing import Any, Dict, List, Optional, Tuple, Union
 
-import hdbscan
-import numpy as np
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from sentence_transformers import SentenceTransformer
-from sklearn.feature_extraction.text import TfidfVectorizer
 
+from ..dashboard.stats import mark_project_stats_stale
+from ..graph.projection import update_project_graph
+from ..jobs.services import JobCancelledError, JobContext
 from ..markup.schemas import RichCreateEntity, RichCreateRelation
+from ..markup.snapshots import create_endpoint_snapshot
+from ..project.assignments import (
+    find_assigned_dataset_item_ids,
+    remove_dataset_items_from_assignments,
+)
 from ..project.schemas import FlagState, OntologyItem
+from ..resources.services import get_project_compiled_ontologies
+from ..search.services import count_search_matches, search_dataset_items
 from ..settings import settings
 from ..social.schemas import Comment
+from ..utils.cache import DocumentCache, find_project
 from ..utils.misc import flatten_hierarchical_ontology
 from ..utils.services import soft_delete_document
+from ..utils.workers import get_process_pool, get_worker_count
+from .clustering import (
+    CLUSTERS_COLLECTION,
+    assign_dataset_items_to_clusters,
+    cluster_dataset,
+)
+from .index import (
+    TOKEN_INDEX_BUILD_FIELD,
+    add_dataset_items_to_index,
+    index_dataset_items,
+    mark_dataset_indexed,
+    remove_dataset_from_index,
+    remove_dataset_items_from_index,
+)
 from .schemas import (
     BaseItem,
     CreateDataset,
@@ -49,6 +71,14 @@ logger = logging.getLogger(__name__)
 DATASETS_COLLECTION = "datasets"
 DATA_COLLECTION = "data"
 
+# Dataset item ids per markup `$in` when a partially created dataset is removed
+DELETE_BATCH_SIZE = 10000
+
+# Totals of filtered annotation views, keyed by user and filter.
+_filter_counts = DocumentCache(
+    maxsize=settings.cache.max_entries, ttl=settings.cache.count_ttl
+)
+
 
 def push_keys_to_extra_fields(data: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -378,113 +408,6 @@ async def find_one_dataset(
         return None
 
 
-def embed_and_cluster_texts(
-    texts: List[str],
-    min_cluster_size: int = 2,
-    min_samples: int = 1,
-    top_n_keywords: int = 5,
-) -> Tuple[np.ndarray, Dict[int, List[str]]]:
-    """
-    Embed and cluster texts with error handling.
-
-    Args:
-        texts: List of strings to cluster
-        min_cluster_size: Minimum size for a cluster (default: 2)
-        min_samples: Minimum samples for HDBSCAN (default: 1)
-        top_n_keywords: Number of keywords to extract per cluster (default: 5)
-
-    Returns:
-        Tuple of cluster assignments and cluster keywords
-    """
-    if not texts:
-        raise ValueError("Input texts list cannot be empty")
-
-    # Adjust min_cluster_size based on dataset size
-    adjusted_min_cluster_size = min(min_cluster_size, len(texts))
-    if adjusted_min_cluster_size != min_cluster_size:
-        logger.warning(
-            f"Adjusted min_cluster_size from {min_cluster_size} to {adjusted_min_cluster_size} "
-            f"due to small dataset size"
-        )
-
-    try:
-        # Load embedding model
-        model = SentenceTransformer("all-distilroberta-v1")
-
-        # Embed dataset items
-        embeddings = model.encode(texts)
-
-        # Handle single document case
-        if len(texts) == 1:
-            logger.info("Single document detected, assigning to cluster 0")
-            clusters = np.array([0])
-            cluster_keywords = {0: extract_keywords([texts[0]], top_n_keywords)}
-            return clusters, cluster_keywords
-
-        # Cluster items
-        clusterer = hdbscan.HDBSCAN(
-            min_cluster_size=adjusted_min_cluster_size,
-            min_samples=min_samples,
-            metric="euclidean",
-        )
-        clusters = clusterer.fit_predict(embeddings)
-
-        logger.info(
-            f"Found {len(set(clusters)) - (1 if -1 in clusters else 0)} clusters"
-        )
-
-        # Check if all points are noise
-        if all(cluster_id == -1 for cluster_id in clusters):
-            logger.warning("No valid clusters found; all points marked as noise")
-            # Fallback: treat all documents as one cluster
-            clusters = np.zeros(len(texts), dtype=int)
-
-        # Group texts by cluster
-        cluster_texts = defaultdict(list)
-        for text, cluster_id in zip(texts, clusters):
-            cluster_texts[cluster_id].append(text)
-
-        # Extract keywords for each cluster
-        cluster_keywords = {}
-        for cluster_id, cluster_texts_list in cluster_texts.items():
-            if cluster_id == -1:  # Skip noise cluster
-                continue
-            cluster_keywords[cluster_id] = extract_keywords(
-                cluster_texts_list, top_n_keywords
-            )
-
-        return clusters, cluster_keywords
-
-    except Exception as e:
-        logger.error(f"Error in clustering: {str(e)}")
-        raise
-
-
-def whitespace_tokenizer(text):
-    """Tokenize text using whitespace."""
-    return text.split()
-
-
-def extract_keywords(texts: List[str], top_n: int) -> List[str]:
-    """Extract top keywords from a list of texts using TF-IDF."""
-    if not texts:
-        return []
-
-    vectorizer = TfidfVectorizer(
-        stop_words="english",
-        tokenizer=whitespace_tokenizer,
-        token_pattern=None,
-    )
-    try:
-        tfidf_matrix = vectorizer.fit_transform(texts)
-        indices = np.argsort(vectorizer.idf_)[::-1]
-        features = vectorizer.get_feature_names_out()
-        return [features[i] for i in indices[:top_n]]
-    except Exception as e:
-        logger.error(f"Error extracting keywords: {str(e)}")
-        return []
-
-
 def create_standard_dataset_items(
     dataset_items: List[str],
     preprocessing: Preprocessing,
@@ -495,10 +418,9 @@ def create_standard_dataset_items(
     """Create standard (new line separated) dataset items.
 
     This function preprocesses, tokenizes and assigns a "dataset_id" to dataset items in a standard dataset.
+    Items are unclustered until the dataset is (re)clustered or they are assigned to its clusters.
     """
 
-    clusters, cluster_keywords = embed_and_cluster_texts(texts=dataset_items)
-
     return [
         EnrichedItem(
             original=di_text,
@@ -509,10 +431,8 @@ def create_standard_dataset_items(
             ),
             is_blueprint=is_blueprint,
             project_id=project_id,
-            cluster_id=clusters[idx],
-            cluster_keywords=cluster_keywords.get(clusters[idx], []),
         )
-        for idx, di_text in enumerate(dataset_items)
+        for di_text in dataset_items
     ]
 
 
@@ -527,9 +447,6 @@ def create_rich_dataset_items(
     This function assigns a "dataset_id" to rich dataset items. Rich datasets can have additional fields in contrast to standard "text" datasets.
     """
     logger.info(f"Creating rich dataset items for {len(dataset_items)} items")
-    clusters, cluster_keywords = embed_and_cluster_texts(
-        texts=[d["original"] for d in dataset_items]
-    )
 
     return [
         EnrichedItem(
@@ -541,10 +458,8 @@ def create_rich_dataset_items(
             is_blueprint=is_blueprint,
             extra_fields=di.get("extra_fields"),
             project_id=project_id,
-            cluster_id=clusters[idx],
-            cluster_keywords=cluster_keywords.get(clusters[idx], []),
         )
-        for idx, di in enumerate(dataset_items)
+        for di in dataset_items
     ]
 
 
@@ -570,162 +485,280 @@ def convert_ontology_to_id_mapping(ontology, flatten_fn):
     }
 
 
-async def insert_dataset_item(
-    db, item, dataset, dataset_id, project_id: ObjectId = None
-):
-    dataset_item_doc = EnrichedItem(
-        original=item["original"],
-        dataset_id=dataset_id,
-        tokens=item["tokens"],
-        text=" ".join(item["tokens"]),
-        external_id=item.get("external_id"),
-        is_blueprint=dataset["is_blueprint"],
-        extra_fields=item.get("extra_fields"),
-        project_id=project_id,
-    )
+def create_annotated_markup(
+    dataset_items: List[Dict[str, Any]],
+    dataset_item_ids: List[ObjectId],
+    dataset: Dict[str, Any],
+    entity_fullname2id: Dict[str, str],
+    relation_fullname2id: Optional[Dict[str, str]],
+    username: str,
+    project_id: ObjectId = None,
+) -> List[Dict[str, Any]]:
+    """Creates the entity and relation markup documents of annotated dataset items.
 
-    dataset_item = await db["data"].insert_one(dataset_item_doc.dict())
-    return dataset_item.inserted_id
+    Entity ids are allocated here so that relations can reference the entities of their
+    item before either is written.
+    """
+    markup = []
+    for item, dataset_item_id in zip(dataset_items, dataset_item_ids):
+        entity_ids = {}
+        entity_snapshots = {}
+        for entity in item["entities"] or []:
+            if entity["label"] not in entity_fullname2id:
+                raise ValueError(f'Unknown entity label "{entity["label"]}"')
+            entity_id = ObjectId()
+            markup.append(
+                {
+                    "_id": entity_id,
+                    **RichCreateEntity(
+                        ontology_item_id=entity_fullname2id[entity["label"]],
+                        start=entity["start"],
+                        end=entity["end"],
+                        surface_form=" ".join(
+                            item["tokens"][entity["start"] : (entity["end"] + 1)]
+                        ),
+                        project_id=project_id,
+                        dataset_item_id=dataset_item_id,
+                        created_by=username,
+                        suggested=dataset["is_suggested"],
+                        classification="entity",
+                        is_blueprint=dataset["is_blueprint"],
+                    ).model_dump(),
+                }
+            )
+            entity_ids[entity["id"]] = entity_id
+            entity_snapshots[entity["id"]] = create_endpoint_snapshot(markup[-1])
+
+        if relation_fullname2id is None:
+            continue
+
+        for relation in item["relations"] or []:
+            if relation["label"] not in relation_fullname2id:
+                raise ValueError(f'Unknown relation label "{relation["label"]}"')
+            if (
+                relation["source_id"] not in entity_ids
+                or relation["target_id"] not in entity_ids
+            ):
+                raise ValueError("Relation references an unknown entity")
+            markup.append(
+                RichCreateRelation(
+                    ontology_item_id=relation_fullname2id[relation["label"]],
+                    source_id=entity_ids[relation["source_id"]],
+                    target_id=entity_ids[relation["target_id"]],
+                    source=entity_snapshots[relation["source_id"]],
+                    target=entity_snapshots[relation["target_id"]],
+                    project_id=project_id,
+                    dataset_item_id=dataset_item_id,
+                    created_by=username,
+                    suggested=dataset["is_suggested"],
+                    classification="relation",
+                    is_blueprint=dataset["is_blueprint"],
+                ).model_dump()
+            )
+    return markup
 
 
-async def insert_entity(
-    db,
-    item,
-    entity,
-    dataset,
-    dataset_item_id,
-    fullname2id,
-    username,
-    project_id: ObjectId = None,
-):
-    new_entity = RichCreateEntity(
-        ontology_item_id=fullname2id[entity["label"]],
-        start=entity["start"],
-        end=entity["end"],
-        surface_form=" ".join(item["tokens"][entity["start"] : (entity["end"] + 1)]),
-        project_id=project_id,
-        dataset_item_id=dataset_item_id,
-        created_by=username,
-        suggested=dataset["is_suggested"],
-        classification="entity",
-        is_blueprint=dataset["is_blueprint"],
-    ).dict()
-
-    return await db["markup"].insert_one(new_entity)
-
-
-async def insert_relation(
-    db,
-    item,
-    relation,
-    dataset,
-    dataset_item_id,
-    fullname2id,
-    inserted_entities,
-    username,
+def prepare_dataset_chunk(
+    dataset_items: List[Any],
+    dataset_item_ids: List[ObjectId],
+    dataset: Dict[str, Any],
+    dataset_id: ObjectId,
+    data_type: str,
+    username: str,
     project_id: ObjectId = None,
-):
-    new_relation = RichCreateRelation(
-        ontology_item_id=fullname2id[relation["label"]],
-        source_id=inserted_entities[relation["source_id"]],
-        target_id=inserted_entities[relation["target_id"]],
-        project_id=project_id,
-        dataset_item_id=dataset_item_id,
-        created_by=username,
-        suggested=dataset["is_suggested"],
-        classification="relation",
-        is_blueprint=dataset["is_blueprint"],
-    ).dict()
+    preprocessing: Optional[Preprocessing] = None,
+    entity_fullname2id: Optional[Dict[str, str]] = None,
+    relation_fullname2id: Optional[Dict[str, str]] = None,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Preprocesses and validates a chunk of uploaded dataset items.
+
+    Runs on the process pool. Returns the dataset item documents, with the given ids, and
+    the markup documents of annotated items.
+    """
+    if data_type == "text":
+        enriched_items = create_standard_dataset_items(
+            dataset_items=dataset_items,
+            preprocessing=preprocessing,
+            is_blueprint=dataset["is_blueprint"],
+            dataset_id=dataset_id,
+            project_id=project_id,
+        )
+    else:
+        enriched_items = create_rich_dataset_items(
+            dataset_items=dataset_items,
+            is_blueprint=dataset["is_blueprint"],
+            dataset_id=dataset_id,
+            project_id=project_id,
+        )
+    documents = [
+        {"_id": dataset_item_id, **ei.model_dump()}
+        for dataset_item_id, ei in zip(dataset_item_ids, enriched_items)
+    ]
 
-    return await db["markup"].insert_one(new_relation)
+    markup = []
+    if entity_fullname2id is not None:
+        markup = create_annotated_markup(
+            dataset_items=dataset_items,
+            dataset_item_ids=dataset_item_ids,
+            dataset=dataset,
+            entity_fullname2id=entity_fullname2id,
+            relation_fullname2id=relation_fullname2id,
+            username=username,
+            project_id=project_id,
+        )
+    return documents, markup
 
 
-async def create_annotated_dataset_items(
-    db, dataset_items, dataset, dataset_id, username, project_id: ObjectId = None
+async def ingest_dataset_items(
+    db: AsyncIOMotorDatabase,
+    dataset_items: List[Any],
+    dataset: Dict[str, Any],
+    dataset_id: ObjectId,
+    data_type: str,
+    is_annotated: bool,
+    username: str,
+    project_id: ObjectId = None,
+    preprocessing: Optional[Preprocessing] = None,
+    job: Optional[JobContext] = None,
 ) -> List[ObjectId]:
-    """
-    Create annotated dataset items.
+    """Preprocesses, validates and inserts uploaded dataset items in chunks.
+
+    Chunks are prepared on the process pool and written, with their markup and token
+    index postings, by unordered bulk inserts as they complete; the number of chunks in
+    flight is bounded to keep memory flat. Dataset item ids are allocated up front so
+    items keep their upload order. Progress is reported to `job` after each chunk.
+
+    If any chunk fails, e.g. on an unknown label, the chunks already written are
+    removed before the error is raised so no partial upload is left behind.
 
-    This function assigns a "dataset_id" to dataset items and creates blueprint entity/relation markup.
+    Returns:
+        The ids of the inserted dataset items in upload order.
     """
-    entity_ontology = await get_entity_ontology(db, dataset)
+    entity_fullname2id = None
+    relation_fullname2id = None
+    if data_type == "json" and is_annotated:
+        entity_fullname2id = convert_ontology_to_id_mapping(
+            await get_entity_ontology(db, dataset), flatten_hierarchical_ontology
+        )
+        if dataset["dataset_type"] == DatasetType.relation_annotation:
+            relation_fullname2id = convert_ontology_to_id_mapping(
+                await get_relation_ontology(db, dataset), flatten_hierarchical_ontology
+            )
 
-    entity_fullname2id = convert_ontology_to_id_mapping(
-        entity_ontology, flatten_hierarchical_ontology
+    prepare_chunk = partial(
+        prepare_dataset_chunk,
+        dataset={
+            "is_blueprint": dataset["is_blueprint"],
+            "is_suggested": dataset.get("is_suggested"),
+        },
+        dataset_id=dataset_id,
+        data_type=data_type,
+        username=username,
+        project_id=project_id,
+        preprocessing=preprocessing,
+        entity_fullname2id=entity_fullname2id,
+        relation_fullname2id=relation_fullname2id,
     )
 
-    inserted_di_ids = []
-    for item in dataset_items:
-        dataset_item_id = await insert_dataset_item(
-            db, item, dataset, dataset_id, project_id
+    dataset_item_ids = [ObjectId() for _ in dataset_items]
+    written = 0
+
+    async def write_chunk(
+        documents: List[Dict[str, Any]], markup: List[Dict[str, Any]]
+    ) -> None:
+        nonlocal written
+        await db[DATA_COLLECTION].insert_many(documents, ordered=False)
+        if markup:
+            await db["markup"].insert_many(markup, ordered=False)
+        await add_dataset_items_to_index(
+            db=db, dataset_id=dataset_id, dataset_items=documents
         )
-        inserted_di_ids.append(dataset_item_id)
-
-        inserted_entities = {}
-        for entity in item["entities"]:
-            result = await insert_entity(
-                db,
-                item,
-                entity,
-                dataset,
-                dataset_item_id,
-                entity_fullname2id,
-                username,
-                project_id,
+        written += len(documents)
+        logger.info(f"Ingested {written} of {len(dataset_items)} dataset items")
+        if job:
+            await job.update_progress(
+                0.8 * written / len(dataset_items),
+                f"Ingested {written} of {len(dataset_items)} dataset items",
             )
-            if dataset["dataset_type"] == DatasetType.relation_annotation:
-                inserted_entities[entity["id"]] = result.inserted_id
 
-        if dataset["dataset_type"] == DatasetType.relation_annotation:
-            relation_ontology = await get_relation_ontology(db, dataset)
-            relation_fullname2id = convert_ontology_to_id_mapping(
-                relation_ontology, flatten_hierarchical_ontology
-            )
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    max_pending = get_worker_count() * 2
+    chunk_size = settings.workers.ingestion_chunk_size
 
-            for relation in item["relations"]:
-                await insert_relation(
-                    db,
-                    item,
-                    relation,
-                    dataset,
-                    dataset_item_id,
-                    relation_fullname2id,
-                    inserted_entities,
-                    username,
-                    project_id,
+    pending = set()
+    try:
+        for i in range(0, len(dataset_items), chunk_size):
+            pending.add(
+                loop.run_in_executor(
+                    pool,
+                    partial(
+                        prepare_chunk,
+                        dataset_items[i : i + chunk_size],
+                        dataset_item_ids[i : i + chunk_size],
+                    ),
+                )
+            )
+            if len(pending) >= max_pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
                 )
-    return inserted_di_ids
+                for future in done:
+                    await write_chunk(*future.result())
+        for future in asyncio.as_completed(pending):
+            await write_chunk(*await future)
+    except Exception:
+        logger.info(f"Ingestion failed after {written} dataset items: Rolling back...")
+        await delete_dataset_items_contents(db=db, dataset_item_ids=dataset_item_ids)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
 
+    return dataset_item_ids
 
-async def process_dataset_items(
-    db: AsyncIOMotorDatabase,
-    dataset_items: List[Dict[str, Any]],
-    dataset,
-    dataset_id: ObjectId,
-    username: str,
-    project_id: ObjectId = None,
-):
-    if dataset["is_annotated"]:
-        await create_annotated_dataset_items(
-            db, dataset_items, dataset, dataset_id, username, project_id
-        )
-    else:
-        enriched_items = create_rich_dataset_items(
-            dataset_items=dataset_items,
-            is_blueprint=dataset["is_blueprint"],
-            dataset_id=dataset_id,
-        )
-        await db[DATA_COLLECTION].insert_many(
-            [ei.model_dump() for ei in enriched_items]
-        )
+
+async def delete_dataset_items_contents(
+    db: AsyncIOMotorDatabase, dataset_item_ids: List[ObjectId]
+) -> None:
+    """Removes dataset items, their markup and their postings."""
+    for i in range(0, len(dataset_item_ids), DELETE_BATCH_SIZE):
+        batch = dataset_item_ids[i : i + DELETE_BATCH_SIZE]
+        await db["markup"].delete_many({"dataset_item_id": {"$in": batch}})
+        await remove_dataset_items_from_index(db=db, dataset_item_ids=batch)
+        await db[DATA_COLLECTION].delete_many({"_id": {"$in": batch}})
+
+
+async def delete_dataset_contents(
+    db: AsyncIOMotorDatabase, dataset_id: ObjectId
+) -> None:
+    """Removes a dataset, its items, their markup, their postings and its clusters."""
+    dataset_item_ids = []
+    async for di in db[DATA_COLLECTION].find({"dataset_id": dataset_id}, {"_id": 1}):
+        dataset_item_ids.append(di["_id"])
+        if len(dataset_item_ids) == DELETE_BATCH_SIZE:
+            await db["markup"].delete_many(
+                {"dataset_item_id": {"$in": dataset_item_ids}}
+            )
+            dataset_item_ids = []
+    if dataset_item_ids:
+        await db["markup"].delete_many({"dataset_item_id": {"$in": dataset_item_ids}})
+    await db[DATA_COLLECTION].delete_many({"dataset_id": dataset_id})
+    await remove_dataset_from_index(db=db, dataset_id=dataset_id)
+    await db[CLUSTERS_COLLECTION].delete_many({"dataset_id": dataset_id})
+    await db[DATASETS_COLLECTION].delete_one({"_id": dataset_id})
 
 
 async def create_dataset(
-    db: AsyncIOMotorDatabase, dataset: CreateDatasetBody, username: str
+    db: AsyncIOMotorDatabase,
+    dataset: CreateDatasetBody,
+    username: str,
+    job: Optional[JobContext] = None,
 ) -> Optional[Dataset]:
     """Create a new dataset.
 
-    Creation includes preprocessing operations.
+    Creation includes preprocessing operations. When run as a background job, progress
+    is reported to `job`; a failed or cancelled creation removes the partial dataset.
     """
     try:
         logger.info(f"dataset: {dataset}")
@@ -746,48 +779,40 @@ async def create_dataset(
             else None
         )
 
+        # The token index build is claimed until every item has been ingested.
         created_dataset = await db[DATASETS_COLLECTION].insert_one(
             {
                 **dataset,
                 "created_by": username,
                 "created_at": datetime.utcnow(),
                 "updated_at": datetime.utcnow(),
+                TOKEN_INDEX_BUILD_FIELD: datetime.utcnow(),
             }
         )
+    except Exception as e:
+        logger.info(f"Error creating dataset: {e}")
+        return None
 
+    try:
         # Create dataset items - this is dependent on the supplied data_type (either txt or json)
-        if dataset["data_type"] == "text":
-            try:
-                logger.info("Creating dataset items")
-                enriched_items = create_standard_dataset_items(
-                    dataset_items=dataset_items,
-                    preprocessing=Preprocessing(**dataset["preprocessing"]),
-                    is_blueprint=dataset["is_blueprint"],
-                    dataset_id=created_dataset.inserted_id,
-                )
+        logger.info("Creating dataset items")
+        await ingest_dataset_items(
+            db=db,
+            dataset_items=dataset_items,
+            dataset=dataset,
+            dataset_id=created_dataset.inserted_id,
+            data_type=dataset["data_type"],
+            is_annotated=dataset["is_annotated"],
+            username=username,
+            preprocessing=Preprocessing(**dataset["preprocessing"]),
+            job=job,
+        )
 
-                # Create dataset items
-                logger.info("Inserting dataset items")
-                await db[DATA_COLLECTION].insert_many(
-                    [ei.model_dump() for ei in enriched_items]
-                )
+        if job:
+            await job.update_progress(0.8, "Clustering dataset")
+        await cluster_dataset(db=db, dataset_id=created_dataset.inserted_id)
 
-            except Exception as e:
-                logger.info(f'Error creating "text" dataset: {e}')
-                return None
-
-        if dataset["data_type"] == "json":
-            try:
-                await process_dataset_items(
-                    db,
-                    dataset_items,
-                    dataset,
-                    dataset_id=created_dataset.inserted_id,
-                    username=username,
-                )
-            except Exception as e:
-                logger.info(f'Error creating "JSON" dataset: {e}')
-                return None
+        await mark_dataset_indexed(db=db, dataset_id=created_dataset.inserted_id)
 
         # Find new dataset and return
         new_dataset = await find_one_dataset(
@@ -796,7 +821,12 @@ async def create_dataset(
 
         return new_dataset
     except Exception as e:
-        logger.info(f"Error creating dataset: {e}")
+        logger.info(
+            f'Error creating "{dataset["data_type"]}" dataset ({e}): Destroying...'
+        )
+        await delete_dataset_contents(db=db, dataset_id=created_dataset.inserted_id)
+        if isinstance(e, JobCancelledError):
+            raise
         return None
 
 
@@ -839,6 +869,13 @@ async def add_one_dataset_item(
         {**enriched_item.dict(), "created_by": username}
     )
 
+    await index_dataset_items(
+        db=db, dataset_id=dataset_id, dataset_item_ids=[created_item.inserted_id]
+    )
+    await assign_dataset_items_to_clusters(
+        db=db, dataset_id=dataset_id, dataset_item_ids=[created_item.inserted_id]
+    )
+
     new_item = await db[DATA_COLLECTION].find_one({"_id": created_item.inserted_id})
 
     return DatasetItem(**new_item)
@@ -847,6 +884,7 @@ async def add_one_dataset_item(
 async def delete_one_dataset_item(db: AsyncIOMotorDatabase, item_id: ObjectId) -> None:
     # TODO: Mark as `is_deleted`
     await db[DATA_COLLECTION].delete_one({"_id": item_id})
+    await remove_dataset_items_from_index(db=db, dataset_item_ids=[item_id])
 
 
 async def find_many_dataset_items(
@@ -869,37 +907,41 @@ async def find_many_dataset_items(
 #     pass
 
 
-def create_search_regex(search_terms: str) -> re.Pattern:
-    """
-    Create a regular expression pattern that matches all of the given search terms.
-
-    Args:
-        search_terms (str): A comma-separated string of search terms to match.
-
-    Returns:
-        re.Pattern: A compiled regular expression pattern that matches all of the search terms, or a
-        regex pattern that matches anything if the input string is empty.
+async def count_filtered_dataset_items(
+    db: AsyncIOMotorDatabase,
+    filters: DatasetFilters,
+    username: str,
+    match: Dict[str, Any],
+    dataset_id: ObjectId,
+) -> int:
+    """Counts the dataset items matching a filter and its search.
 
-    Example:
-        >>> create_search_regex("apple, banana, cherry")
-        re.compile('(?=.*\\bapple\\b)(?=.*\\bbanana\\b)(?=.*\\bcherry\\b)', re.IGNORECASE)
+    Counts are cached briefly per user and filter so that paging does not recount them;
+    totals may lag recent saves and flags by up to `settings.cache.count_ttl` seconds.
     """
-
-    if search_terms == None:
-        # Defaults to match anything regular expression
-        return re.compile(".*")
-
-    search_terms_list = search_terms.split(",")
-    search_term_regex_list = []
-    for term in search_terms_list:
-        search_term_regex_list.append(rf"(?=.*\b{re.escape(term.strip())}\b)")
-    search_term_regex = "".join(search_term_regex_list)
-    return (
-        re.compile(search_term_regex, re.IGNORECASE)
-        if search_terms
-        else re.compile(".*")
+    key = (
+        username,
+        len(match["_id"]["$in"]),
+        filters.model_dump_json(exclude={"skip", "limit", "after"}),
     )
 
+    async def load():
+        if filters.search_term:
+            count = await count_search_matches(
+                db=db,
+                dataset_id=dataset_id,
+                search_term=filters.search_term,
+                match=match,
+            )
+            if count is not None:
+                return count, []
+        return await db["data"].count_documents(match), []
+
+    if not settings.cache.enabled:
+        count, _ = await load()
+        return count
+    return await _filter_counts.get_or_load(key, load)
+
 
 async def filter_dataset(
     db: AsyncIOMotorDatabase,
@@ -909,70 +951,28 @@ async def filter_dataset(
     """Filter a dataset."""
     project_id = ObjectId(filters.project_id)
 
-    project = await db["projects"].find_one(
-        {"_id": project_id},
-        {
-            "entity_ontology_id": 1,
-            "relation_ontology_id": 1,
-            "dataset_id": 1,
-            "annotators": 1,
-            "settings": 1,
-        },
-    )
+    project = await find_project(db=db, project_id=project_id)
     logger.info("Loaded project...")
 
-    scope = [
-        di["dataset_item_id"]
-        for di in [a for a in project["annotators"] if a["username"] == username][0][
-            "scope"
-        ]
-        if di["visible"]
-    ]
+    scope = await find_assigned_dataset_item_ids(
+        db=db, project_id=project_id, username=username
+    )
 
     if filters.dataset_item_ids:
         logging.info(f"filters.dataset_item_ids :: {filters.dataset_item_ids}")
         di_ids = [ObjectId(di_id) for di_id in filters.dataset_item_ids.split(",")]
         # Limit scope to dataset item(s)
-        scope = [di_id for di_id in di_ids if di_id in scope]
-
-    # Fetch ontologies
-    ontologies = await db.resources.find(
-        {
-            "_id": {
-                "$in": [project["entity_ontology_id"], project["relation_ontology_id"]]
-            },
-            "classification": "ontology",
-        },
-        {"sub_classification": 1, "content": 1},
-    ).to_list(None)
-
-    # logger.info(f"ontologies: {ontologies}")
-
-    ontology = {
-        ontology["sub_classification"]: ontology["content"] for ontology in ontologies
-    }
+        assigned_ids = set(scope)
+        scope = [di_id for di_id in di_ids if di_id in assigned_ids]
 
     # Convert ontologies to ontology_item_id:detail key:value pairs
     ontology = {
-        ontology_type: {
-            i.id: {
-                "name": i.name,
-                "fullname": i.fullname,
-                "color": i.color,
-                "active": i.active,
-            }
-            for i in flatten_hierarchical_ontology(
-                [OntologyItem(**i) for i in ontology_items]
-            )
-        }
-        for ontology_type, ontology_items in ontology.items()
+        ontology_type: compiled.details
+        for ontology_type, compiled in (
+            await get_project_compiled_ontologies(db=db, project_id=project_id)
+        ).items()
     }
 
-    try:
-        search_term_regx = create_search_regex(search_terms=filters.search_term)
-    except Exception as e:
-        logger.info(f"Error with search term reg: {e}")
-
     if filters.saved != SaveStateFilter.everything.value:
         # unsaved = 0, saved = 1, everything = 2
 
@@ -988,50 +988,54 @@ async def filter_dataset(
                 "$match": {"save_states": {"$elemMatch": {"created_by": username}}}
             }
 
-    quality_filter = []
+    # Markup filters are resolved against the markup collection so that a page can be
+    # selected before markup and comments are joined.
+    id_filters = []
     if filters.quality != QualityFilter.everything.value:
-        quality_filter = [
+        user_markup_item_ids = await db["markup"].distinct(
+            "dataset_item_id",
             {
-                "$match": {
-                    "markup.created_by": username,
-                    "markup.suggested": filters.quality
-                    == QualityFilter.suggested.value,
+                "project_id": project_id,
+                "created_by": username,
+                "dataset_item_id": {"$in": scope},
+            },
+        )
+        quality_markup_item_ids = await db["markup"].distinct(
+            "dataset_item_id",
+            {
+                "project_id": project_id,
+                "suggested": filters.quality == QualityFilter.suggested.value,
+                "dataset_item_id": {"$in": scope},
+            },
+        )
+        id_filters.append(
+            {
+                "_id": {
+                    "$in": list(
+                        set(user_markup_item_ids) & set(quality_markup_item_ids)
+                    )
                 }
             }
-        ]
+        )
 
-    relations_filter = []
     if filters.relations != RelationsFilter.everything.value:
-        # TODO: fix - seems to return documents with no annotations as part of the 'has_relations' filter... which is not supposed to happen.
-        relations_filter = [
+        relation_item_ids = await db["markup"].distinct(
+            "dataset_item_id",
             {
-                "$addFields": {
-                    "relation_count": {
-                        "$size": {
-                            "$filter": {
-                                "input": "$markup",
-                                "as": "markup",
-                                "cond": {
-                                    "$eq": [
-                                        "$$markup.classification",
-                                        "relation",
-                                    ],
-                                },
-                            },
-                        },
-                    },
-                }
+                "project_id": project_id,
+                "classification": "relation",
+                "dataset_item_id": {"$in": scope},
             },
+        )
+        id_filters.append(
             {
-                "$match": {
-                    "relation_count": (
-                        {"$gt": 0}
-                        if filters.relations == RelationsFilter.has_relations.value
-                        else {"$eq": 0}
-                    )
-                }
-            },
-        ]
+                "_id": (
+                    {"$in": relation_item_ids}
+                    if filters.relations == RelationsFilter.has_relations.value
+                    else {"$nin": relation_item_ids}
+                )
+            }
+        )
 
     if filters.flag != FlagFilter.everything.value:
         # TODO: make handling flags less problematic;
@@ -1061,7 +1065,6 @@ async def filter_dataset(
     match_filter = {
         "$match": {
             "_id": {"$in": scope},
-            "text": {"$regex": search_term_regx},
         }
     }
 
@@ -1069,42 +1072,6 @@ async def filter_dataset(
         logger.info(f"Handling cluster_id filter: {filters.cluster_id}")
         match_filter["$match"]["cluster_id"] = filters.cluster_id
 
-    filter_pipeline = (
-        [
-            {
-                "$lookup": {
-                    "from": "markup",
-                    "localField": "_id",
-                    "foreignField": "dataset_item_id",
-                    "as": "markup",
-                }
-            },
-        ]
-        + relations_filter
-        + quality_filter
-        + [
-            {
-                "$lookup": {
-                    "from": "social",
-                    "localField": "_id",
-                    "foreignField": "dataset_item_id",
-                    "as": "social",
-                }
-            },
-            {
-                "$addFields": {
-                    "social": {
-                        "$filter": {
-                            "input": "$social",
-                            "as": "s",
-                            "cond": {"$eq": ["$$s.context", "annotation"]},
-                        }
-                    }
-                }
-            },
-        ]
-    )
-
     # Add Flag filter if condition met; insert this after first $match.
     if "flag_filter" in locals():
         match_filter = {"$match": {**match_filter["$match"], **flag_filter["$match"]}}
@@ -1114,21 +1081,71 @@ async def filter_dataset(
             "$match": {**match_filter["$match"], **save_states_filter["$match"]}
         }
 
-    pipeline = (
-        [match_filter]
-        + filter_pipeline
-        + [{"$skip": (filters.skip) * filters.limit}, {"$limit": filters.limit}]
-    )
+    if id_filters:
+        match_filter["$match"]["$and"] = id_filters
+
+    # Pages are selected in `_id` order; a cursor continues after the last item of the
+    # previous page, otherwise pages are skipped.
+    search_result = None
+    if filters.search_term:
+        # Searches find the page themselves, stopping once it is full.
+        search_result = await search_dataset_items(
+            db=db,
+            dataset_id=ObjectId(project["dataset_id"]),
+            search_term=filters.search_term,
+            match=match_filter["$match"],
+            after=ObjectId(filters.after) if filters.after else None,
+            skip=0 if filters.after else filters.skip * filters.limit,
+            limit=filters.limit,
+        )
+    if search_result is not None:
+        page_pipeline = [
+            {"$match": {"_id": {"$in": search_result.dataset_item_ids}}},
+            {"$sort": {"_id": 1}},
+        ]
+    else:
+        page_filter = {**match_filter["$match"]}
+        if filters.after:
+            page_filter["_id"] = {**page_filter["_id"], "$gt": ObjectId(filters.after)}
+        page_pipeline = [{"$match": page_filter}, {"$sort": {"_id": 1}}]
+        if not filters.after:
+            page_pipeline.append({"$skip": filters.skip * filters.limit})
+        page_pipeline.append({"$limit": filters.limit})
+
+    pipeline = page_pipeline + [
+        {
+            "$lookup": {
+                "from": "social",
+                "localField": "_id",
+                "foreignField": "dataset_item_id",
+                "as": "social",
+            }
+        },
+        {
+            "$addFields": {
+                "social": {
+                    "$filter": {
+                        "input": "$social",
+                        "as": "s",
+                        "cond": {"$eq": ["$$s.context", "annotation"]},
+                    }
+                }
+            }
+        },
+    ]
     dataset_items = await db["data"].aggregate(pipeline).to_list(None)
     dataset_item_ids = [di["_id"] for di in dataset_items]
 
     if len(dataset_items) == 0:
         return None
 
-    # Get total count of dataset items (do not skip/limit)
-    count_pipeline = [match_filter] + filter_pipeline + [{"$count": "count"}]
-    count_result = await db["data"].aggregate(count_pipeline).next()
-    total_dataset_items = count_result["count"]
+    total_dataset_items = await count_filtered_dataset_items(
+        db=db,
+        filters=filters,
+        username=username,
+        match=match_filter["$match"],
+        dataset_id=ObjectId(project["dataset_id"]),
+    )
 
     # Convert dataset_items into hierarchical object
     modified_dataset_items = {
@@ -1247,6 +1264,11 @@ async def filter_dataset(
         relations=relations,
         total_dataset_items=total_dataset_items,
         total_pages=math.ceil(total_dataset_items / filters.limit),
+        next_cursor=(
+            str(dataset_item_ids[-1])
+            if len(dataset_item_ids) == filters.limit
+            else None
+        ),
         social={
             str(d["_id"]): [
                 Comment(**comment, read_only=username != comment["created_by"])
@@ -1312,19 +1334,23 @@ async def delete_dataset_items(
 
     # Delete dataset items
     response = await db["data"].delete_many({"_id": {"$in": dataset_item_ids}})
+    await remove_dataset_items_from_index(db=db, dataset_item_ids=dataset_item_ids)
     if response.deleted_count > 0:
         is_project_dataset = dataset["project_id"]
         if is_project_dataset:
             # Remove assignments for annotators (if they exist)
-            await db["projects"].update_many(
-                {"_id": ObjectId(dataset["project_id"])},
-                {
-                    "$pull": {
-                        "annotators.$[].scope": {
-                            "dataset_item_id": {"$in": dataset_item_ids}
-                        }
-                    }
-                },
+            await remove_dataset_items_from_assignments(
+                db=db,
+                project_id=ObjectId(dataset["project_id"]),
+                dataset_item_ids=dataset_item_ids,
+            )
+            await update_project_graph(
+                db=db,
+                project_id=ObjectId(dataset["project_id"]),
+                dataset_item_ids=dataset_item_ids,
+            )
+            await mark_project_stats_stale(
+                db=db, project_id=ObjectId(dataset["project_id"])
             )
         return {"dataset_item_ids": body.dataset_item_ids, "deleted": True}
     return {"dataset_item_ids": body.dataset_item_ids, "deleted": False}
@@ -2,18 +2,34 @@
 
 import asyncio
 import datetime
+import itertools
 import logging
 import os
+import random
+import re
 import shutil
 import subprocess
 import tarfile
+import time
 
 import motor.motor_asyncio
 import typer
-
+from bson import ObjectId
+
+from server.src.quickgraph.dataset.index import (
+    TOKEN_INDEX_INDEXES,
+    build_missing_token_indexes,
+    find_phrase_pair_spans,
+    index_dataset_items,
+)
 from server.src.quickgraph.dataset.services import create_system_datasets
+from server.src.quickgraph.graph.projection import rebuild_project_graph
+from server.src.quickgraph.markup.snapshots import backfill_endpoint_snapshots
+from server.src.quickgraph.markup.utils import find_sub_lists, get_entity_offset
+from server.src.quickgraph.project.assignments import migrate_embedded_scopes
 from server.src.quickgraph.resources.services import create_system_resources
 from server.src.quickgraph.settings import settings
+from server.src.quickgraph.utils.system import check_indexes, create_indexes
 
 logger = logging.getLogger(__name__)
 
@@ -123,6 +139,146 @@ async def drop_all_collections():
     )
 
 
+async def report_index_drift():
+    """Reports catalog indexes that are missing and existing indexes that are unused."""
+    client = motor.motor_asyncio.AsyncIOMotorClient(settings.mongodb.uri)
+    db = client[settings.mongodb.database_name]
+    report = await check_indexes(db=db)
+    for collection_name, result in report.items():
+        typer.echo(f"{collection_name}:")
+        typer.echo(f"  missing: {', '.join(result['missing']) or '-'}")
+        typer.echo(f"  unused: {', '.join(result['unused']) or '-'}")
+
+
+async def build_indexes():
+    """Builds the index catalog."""
+    client = motor.motor_asyncio.AsyncIOMotorClient(settings.mongodb.uri)
+    db = client[settings.mongodb.database_name]
+    await create_indexes(db=db)
+    typer.echo("Index catalog built")
+
+
+async def migrate_assignments():
+    """Moves annotator scopes embedded in projects to the assignments collection."""
+    client = motor.motor_asyncio.AsyncIOMotorClient(settings.mongodb.uri)
+    db = client[settings.mongodb.database_name]
+    await create_indexes(db=db)
+    migrated = await migrate_embedded_scopes(db=db)
+    typer.echo(f"Migrated annotator assignments of {migrated} projects")
+
+
+async def build_token_indexes():
+    """Builds the token index of datasets indexed before it existed or changed."""
+    client = motor.motor_asyncio.AsyncIOMotorClient(settings.mongodb.uri)
+    db = client[settings.mongodb.database_name]
+    await create_indexes(db=db)
+    count = await build_missing_token_indexes(db=db)
+    typer.echo(f"Built token indexes of {count} datasets")
+
+
+async def rebuild_graph_projections():
+    """Rebuilds the graph projection of every project."""
+    client = motor.motor_asyncio.AsyncIOMotorClient(settings.mongodb.uri)
+    db = client[settings.mongodb.database_name]
+    await create_indexes(db=db)
+    count = 0
+    async for project in db["projects"].find({}, {"_id": 1}):
+        await rebuild_project_graph(db=db, project_id=project["_id"])
+        count += 1
+    typer.echo(f"Rebuilt graph projections of {count} projects")
+
+
+async def backfill_relation_endpoints():
+    """Adds endpoint snapshots to relations written before relations embedded them."""
+    client = motor.motor_asyncio.AsyncIOMotorClient(settings.mongodb.uri)
+    db = client[settings.mongodb.database_name]
+    backfilled = await backfill_endpoint_snapshots(db=db)
+    typer.echo(f"Backfilled endpoint snapshots of {backfilled} relations")
+
+
+async def run_relation_propagation_benchmark(size: int, seed: int):
+    """Compares regex and token index candidate search for relation propagation.
+
+    A synthetic corpus is written to a scratch database which is dropped afterwards.
+    """
+    client = motor.motor_asyncio.AsyncIOMotorClient(settings.mongodb.uri)
+    db = client[f"{settings.mongodb.database_name}_benchmark"]
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(5000)]
+    source, target = ["pump", "seal"], ["leaking"]
+    dataset_id = ObjectId()
+
+    try:
+        typer.echo(f"Seeding {size} dataset items")
+        batch = []
+        for i in range(size):
+            tokens = rng.choices(vocabulary, k=rng.randint(8, 30))
+            if i % 50 == 0:
+                # Plant the source/target phrases at random relative positions.
+                tokens[1:1] = source
+                pos = rng.randint(3, len(tokens))
+                tokens[pos:pos] = target
+            batch.append(
+                {"dataset_id": dataset_id, "tokens": tokens, "text": " ".join(tokens)}
+            )
+            if len(batch) == 10000:
+                await db["data"].insert_many(batch)
+                batch = []
+        if batch:
+            await db["data"].insert_many(batch)
+        await db["data"].create_index("dataset_id")
+        await db["token_index"].create_indexes(TOKEN_INDEX_INDEXES)
+
+        # Building the index marks the dataset indexed, so the timed index path does
+        # not rebuild it.
+        await db["datasets"].insert_one({"_id": dataset_id})
+        start = time.perf_counter()
+        await index_dataset_items(db=db, dataset_id=dataset_id)
+        typer.echo(f"Index build: {time.perf_counter() - start:.2f}s")
+
+        source_entity = {"start": 1, "end": 2}
+        target_entity = {"start": 4, "end": 4}
+        offset = get_entity_offset(source_entity, target_entity)
+
+        # Regex candidate search followed by a Python token re-scan.
+        start = time.perf_counter()
+        regx = re.compile(
+            rf"^(?=.*\b{re.escape(' '.join(source))}\b)(?=.*\b{re.escape(' '.join(target))}\b)",
+        )
+        regex_pairs = {}
+        async for item in db["data"].find(
+            {"dataset_id": dataset_id, "text": {"$regex": regx}}
+        ):
+            pairs = [
+                p
+                for p in itertools.product(
+                    find_sub_lists(source, item["tokens"]),
+                    find_sub_lists(target, item["tokens"]),
+                )
+                if abs(p[1][0] - p[0][1]) - 1 == offset and p[0][1] <= p[1][0]
+            ]
+            if pairs:
+                regex_pairs[item["_id"]] = pairs
+        regex_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index_pairs = await find_phrase_pair_spans(
+            db=db,
+            dataset_id=dataset_id,
+            source_phrase=source,
+            target_phrase=target,
+            offset=offset,
+            lr_direction=True,
+        )
+        index_duration = time.perf_counter() - start
+
+        typer.echo(f"Regex path: {regex_duration:.3f}s ({len(regex_pairs)} items)")
+        typer.echo(f"Index path: {index_duration:.3f}s ({len(index_pairs)} items)")
+        typer.echo(f"Results match: {regex_pairs == index_pairs}")
+    finally:
+        await client.drop_database(db.name)
+
+
 @app.command()
 def add_system_resources():
     asyncio.run(add_system_resources_to_db())
@@ -138,6 +294,41 @@ def drop_database():
     asyncio.run(drop_all_collections())
 
 
+@app.command()
+def check_db_indexes():
+    asyncio.run(report_index_drift())
+
+
+@app.command()
+def create_db_indexes():
+    asyncio.run(build_indexes())
+
+
+@app.command()
+def migrate_annotator_assignments():
+    asyncio.run(migrate_assignments())
+
+
+@app.command()
+def build_dataset_token_indexes():
+    asyncio.run(build_token_indexes())
+
+
+@app.command()
+def rebuild_graphs():
+    asyncio.run(rebuild_graph_projections())
+
+
+@app.command()
+def backfill_relation_snapshots():
+    asyncio.run(backfill_relation_endpoints())
+
+
+@app.command()
+def benchmark_relation_propagation(size: int = 200000, seed: int = 0):
+    asyncio.run(run_relation_propagation_benchmark(size=size, seed=seed))
+
+
 @app.command()
 def run(drop_db: bool = False, add_resources: bool = False, add_datasets: bool = False):
     if drop_db:
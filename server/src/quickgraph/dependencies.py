@@ -14,6 +14,7 @@ from .dataset.schemas import Dataset
 from .project.schemas import Project
 from .settings import Settings, get_settings
 from .users.schemas import UserDocumentModel
+from .utils.cache import find_project, find_user
 
 logger = logging.getLogger(__name__)
 
@@ -62,7 +63,7 @@ async def get_user(
     except JWTError:
         raise credentials_exception
 
-    user = await db.users.find_one({"username": username})
+    user = await find_user(db=db, username=username)
     if user is None:
         raise credentials_exception
 
@@ -80,7 +81,7 @@ async def get_active_project_user(
     Raises HTTP 401 if unauthorized.
     """
 
-    project = await db.projects.find_one({"_id": ObjectId(project_id)})
+    project = await find_project(db=db, project_id=ObjectId(project_id))
     if not project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -119,7 +120,7 @@ async def valid_project_manager(
     Raises HTTP 404 if project not found.
     Raises HTTP 401 if user is not the project manager.
     """
-    project = await db.projects.find_one({"_id": ObjectId(project_id)})
+    project = await find_project(db=db, project_id=ObjectId(project_id))
     if not project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -153,7 +154,7 @@ async def valid_user_for_dataset(
         return user
 
     # Check if the user is an annotator of the dataset
-    project = await db.projects.find_one({"_id": ObjectId(dataset["project_id"])})
+    project = await find_project(db=db, project_id=ObjectId(dataset["project_id"]))
     if project is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -177,6 +178,36 @@ async def valid_user_for_dataset(
     return user
 
 
+async def valid_dataset_manager(
+    dataset_id: str,
+    user: UserDocumentModel = Depends(get_user),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+) -> UserDocumentModel:
+    """Validates if the user created the dataset or manages its project and returns the
+    user. Guards operations that rewrite a dataset."""
+    dataset = await db.datasets.find_one(
+        {"_id": ObjectId(dataset_id)}, {"created_by": 1, "project_id": 1}
+    )
+    if not dataset:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Dataset not found.",
+        )
+
+    if dataset["created_by"] == user.username:
+        return user
+
+    if dataset.get("project_id") is not None:
+        project = await find_project(db=db, project_id=ObjectId(dataset["project_id"]))
+        if project is not None and project["created_by"] == user.username:
+            return user
+
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Access denied. Only the dataset creator or project manager can perform this action.",
+    )
+
+
 async def valid_dataset(
     dataset_id: str,
     user: UserDocumentModel = Depends(valid_user_for_dataset),
@@ -222,7 +253,7 @@ async def valid_project(
     db: AsyncIOMotorDatabase = Depends(get_db),
 ) -> Dataset:
     """Returns the project if it exists and the user has access to it."""
-    project = await db.projects.find_one({"_id": ObjectId(project_id)})
+    project = await find_project(db=db, project_id=ObjectId(project_id))
     if project is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
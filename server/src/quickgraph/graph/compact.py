@@ -0,0 +1,100 @@
+"""Compact graph payloads.
+
+Compact graphs send the display details of each ontology item once, in a legend, and
+nodes and links as columns of values that reference legend entries and node positions.
+Unlike `GraphData`, nothing is repeated per node or link and no pydantic models are
+built, which keeps large graphs small and quick to serialize.
+"""
+
+from typing import Any, AsyncIterator, Dict, Iterable, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from ..utils.streaming import create_streaming_response, encode_json
+from .services import get_font_color
+
+
+def create_compact_graph(
+    nodes: Iterable[Dict[str, Any]],
+    links: Iterable[Dict[str, Any]],
+    ontology_id2details: dict,
+    offset: int = 0,
+    node_positions: Optional[Dict[str, int]] = None,
+) -> Dict[str, Any]:
+    """Creates a compact graph.
+
+    Nodes hold `id`, `label`, `ontology_item_id`, `suggested` and `value` and links
+    `source`, `target` (node ids), `ontology_item_id`, `suggested` and `value`. Links
+    reference nodes by position. Pages of a larger graph number their nodes from
+    `offset` and may link to the `node_positions` of nodes on earlier pages. Links whose
+    nodes are not in the graph are left out.
+    """
+    legend = []
+    legend_positions = {}
+
+    def legend_position(classification: str, ontology_item_id: str) -> int:
+        key = (classification, ontology_item_id)
+        position = legend_positions.get(key)
+        if position is None:
+            details = ontology_id2details[key]
+            position = legend_positions[key] = len(legend)
+            legend.append(
+                {
+                    "classification": classification,
+                    "ontology_item_id": ontology_item_id,
+                    "name": details["name"],
+                    "fullname": details["fullname"],
+                    "color": details["color"],
+                    "font_color": get_font_color(details["color"]),
+                }
+            )
+        return position
+
+    node_columns = {"id": [], "label": [], "legend": [], "suggested": [], "value": []}
+    node_positions = dict(node_positions or {})
+    for n in nodes:
+        node_positions[n["id"]] = offset + len(node_columns["id"])
+        node_columns["id"].append(n["id"])
+        node_columns["label"].append(n["label"])
+        node_columns["legend"].append(legend_position("entity", n["ontology_item_id"]))
+        node_columns["suggested"].append(n["suggested"])
+        node_columns["value"].append(n["value"])
+
+    link_columns = {
+        "source": [],
+        "target": [],
+        "legend": [],
+        "suggested": [],
+        "value": [],
+    }
+    for link in links:
+        source = node_positions.get(link["source"])
+        target = node_positions.get(link["target"])
+        if source is None or target is None:
+            continue
+        link_columns["source"].append(source)
+        link_columns["target"].append(target)
+        link_columns["legend"].append(
+            legend_position("relation", link["ontology_item_id"])
+        )
+        link_columns["suggested"].append(link["suggested"])
+        link_columns["value"].append(link["value"])
+
+    return {
+        "offset": offset,
+        "legend": legend,
+        "nodes": node_columns,
+        "links": link_columns,
+    }
+
+
+def create_compact_response(request: Request, payload: Any) -> StreamingResponse:
+    """Encodes a compact payload, gzip compressed if the client accepts it."""
+
+    async def chunks() -> AsyncIterator[str]:
+        yield encode_json(payload)
+
+    return create_streaming_response(
+        request=request, chunks=chunks(), media_type="application/json"
+    )
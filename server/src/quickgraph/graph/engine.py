@@ -0,0 +1,291 @@
+"""Graph engine.
+
+Project graphs are read from the graph projection into a `GraphIndex`, which numbers
+nodes with integer ids and holds their undirected adjacency in compressed sparse row
+arrays. Nodes are selected by degree, either the top nodes of the whole graph or the
+k-hop neighbourhood of a focus node, and only the selected subgraph is turned into a
+response. Indexes are cached per process against the version of the projection they
+were read from.
+"""
+
+import logging
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..search.services import match_surface_forms, parse_search_terms
+from ..utils.cache import cached
+from .compact import create_compact_graph
+from .projection import AGREED, GRAPH_PROJECTIONS_COLLECTION, find_graph_documents
+from .schemas import GraphData, Relationships
+from .services import create_link, create_node
+
+logger = logging.getLogger(__name__)
+
+
+class GraphIndex:
+    """Adjacency of a graph over integer node ids.
+
+    Node ids follow the projection's descending count order. The neighbours of node `i`
+    and the edges joining them are `adjacency[offsets[i]:offsets[i + 1]]` and
+    `incidence[offsets[i]:offsets[i + 1]]`; self loops are listed once.
+    """
+
+    def __init__(self, nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]):
+        self.nodes = nodes
+        self.node_ids = {n["key"]: i for i, n in enumerate(nodes)}
+
+        # Edges whose endpoints were filtered out of the graph are dropped.
+        self.edges = []
+        sources = array("l")
+        targets = array("l")
+        for e in edges:
+            source = self.node_ids.get(e["source"])
+            target = self.node_ids.get(e["target"])
+            if source is None or target is None:
+                continue
+            self.edges.append(e)
+            sources.append(source)
+            targets.append(target)
+
+        self.degrees = array("l", bytes(array("l").itemsize * len(nodes)))
+        for source, target in zip(sources, targets):
+            self.degrees[source] += 1
+            if target != source:
+                self.degrees[target] += 1
+
+        self.offsets = array("l", [0])
+        for degree in self.degrees:
+            self.offsets.append(self.offsets[-1] + degree)
+
+        self.adjacency = array("l", bytes(array("l").itemsize * self.offsets[-1]))
+        self.incidence = array("l", bytes(array("l").itemsize * self.offsets[-1]))
+        positions = self.offsets[:-1]
+        for edge_id, (source, target) in enumerate(zip(sources, targets)):
+            for node_id, neighbour in ((source, target), (target, source)):
+                self.adjacency[positions[node_id]] = neighbour
+                self.incidence[positions[node_id]] = edge_id
+                positions[node_id] += 1
+                if source == target:
+                    break
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def neighbours(self, node_id: int) -> Iterator[Tuple[int, int]]:
+        """Yields the (neighbour id, edge id) pairs of a node."""
+        start, end = self.offsets[node_id], self.offsets[node_id + 1]
+        return zip(self.adjacency[start:end], self.incidence[start:end])
+
+    def rank(self, node_ids: Iterable[int]) -> List[int]:
+        """Orders nodes by descending degree and then count."""
+        return sorted(
+            node_ids, key=lambda i: (-self.degrees[i], -self.nodes[i]["count"])
+        )
+
+    def search(self, search_term: Optional[str]) -> Optional[List[int]]:
+        """Finds the nodes whose surface forms contain every search term.
+
+        The last search word is matched as a prefix as the graph is searched while
+        typing. Returns None if the search holds no terms.
+        """
+        terms = parse_search_terms(search_term=search_term or "", prefix_last=True)
+        if len(terms) == 0:
+            return None
+        surface_forms = set(
+            match_surface_forms(terms, {n["surface_form"] for n in self.nodes})
+        )
+        return [
+            i for i, n in enumerate(self.nodes) if n["surface_form"] in surface_forms
+        ]
+
+    def top_nodes(
+        self,
+        limit: Optional[int] = None,
+        node_ids: Optional[Iterable[int]] = None,
+        show_orphans: bool = True,
+    ) -> List[int]:
+        """Selects the nodes of highest degree.
+
+        Without orphans, only nodes joined to another selected node are kept and the
+        selection is topped up from the remaining ranked nodes that join it, so that the
+        limit is applied after orphans are removed.
+        """
+        if node_ids is None:
+            node_ids = range(len(self.nodes))
+        if show_orphans:
+            return self.rank(node_ids)[:limit]
+
+        ranked = self.rank(i for i in node_ids if self.degrees[i] > 0)
+        limit = len(ranked) if limit is None else limit
+        candidates = set(ranked[:limit])
+        selected = [
+            i
+            for i in ranked[:limit]
+            if any(neighbour in candidates for neighbour, _ in self.neighbours(i))
+        ]
+        selected_ids = set(selected)
+        for i in ranked[limit:]:
+            if len(selected) >= limit:
+                break
+            if any(neighbour in selected_ids for neighbour, _ in self.neighbours(i)):
+                selected.append(i)
+                selected_ids.add(i)
+        return selected
+
+    def expand(self, focus: int, hops: int) -> List[int]:
+        """Finds the nodes within `hops` edges of a focus node, nearest and then highest
+        degree first."""
+        ordered = [focus]
+        seen = {focus}
+        frontier = [focus]
+        for _ in range(hops):
+            reached = []
+            for node_id in frontier:
+                for neighbour, _ in self.neighbours(node_id):
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        reached.append(neighbour)
+            if len(reached) == 0:
+                break
+            frontier = self.rank(reached)
+            ordered.extend(frontier)
+        return ordered
+
+    def subgraph_edges(
+        self, node_ids: Iterable[int], other_node_ids: Optional[Set[int]] = None
+    ) -> List[int]:
+        """Finds the edges from the given nodes to other given nodes.
+
+        `other_node_ids` defaults to the given nodes themselves.
+        """
+        node_ids = list(node_ids)
+        if other_node_ids is None:
+            other_node_ids = set(node_ids)
+        edge_ids = set()
+        for node_id in node_ids:
+            for neighbour, edge_id in self.neighbours(node_id):
+                if neighbour in other_node_ids:
+                    edge_ids.add(edge_id)
+        return sorted(edge_ids)
+
+
+def create_graph_data(
+    index: GraphIndex,
+    node_ids: List[int],
+    edge_ids: List[int],
+    ontology_id2details: dict,
+) -> GraphData:
+    """Creates the response of the selected nodes and edges of a graph."""
+    nodes = {}
+    relationships = {}
+    for i in node_ids:
+        n = index.nodes[i]
+        nodes[n["key"]] = create_node(
+            id=n["key"],
+            surface_form=n["surface_form"],
+            ontology_item_id=n["ontology_item_id"],
+            suggested=n["suggested"],
+            value=n["count"],
+            ontology_id2details=ontology_id2details,
+        )
+        relationships[n["key"]] = Relationships(nodes=[], links=[])
+
+    links = {}
+    for edge_id in edge_ids:
+        e = index.edges[edge_id]
+        link_id = f"{e['source']}-{ontology_id2details[('relation', e['ontology_item_id'])]['name']}-{e['target']}"
+        links[link_id] = create_link(
+            id=link_id,
+            source=e["source"],
+            target=e["target"],
+            ontology_item_id=e["ontology_item_id"],
+            suggested=e["suggested"],
+            value=e["count"],
+            ontology_id2details=ontology_id2details,
+        )
+        # Edges of a page may join nodes of earlier pages.
+        if e["source"] in relationships:
+            relationships[e["source"]].nodes.append(e["target"])
+            relationships[e["source"]].links.append(link_id)
+        if e["target"] in relationships:
+            relationships[e["target"]].nodes.append(e["source"])
+            relationships[e["target"]].links.append(link_id)
+
+    return GraphData(nodes=nodes, links=links, relationships=relationships)
+
+
+def create_compact_graph_data(
+    index: GraphIndex,
+    node_ids: List[int],
+    edge_ids: List[int],
+    ontology_id2details: dict,
+    offset: int = 0,
+    previous_node_ids: Iterable[int] = (),
+) -> Dict[str, Any]:
+    """Creates the compact response of the selected nodes and edges of a graph.
+
+    Pages are numbered from `offset`, after the nodes of earlier pages in
+    `previous_node_ids`.
+    """
+    return create_compact_graph(
+        nodes=(
+            {
+                "id": n["key"],
+                "label": n["surface_form"],
+                "ontology_item_id": n["ontology_item_id"],
+                "suggested": n["suggested"],
+                "value": n["count"],
+            }
+            for n in (index.nodes[i] for i in node_ids)
+        ),
+        links=(
+            {
+                "source": e["source"],
+                "target": e["target"],
+                "ontology_item_id": e["ontology_item_id"],
+                "suggested": e["suggested"],
+                "value": e["count"],
+            }
+            for e in (index.edges[edge_id] for edge_id in edge_ids)
+        ),
+        ontology_id2details=ontology_id2details,
+        offset=offset,
+        node_positions={
+            index.nodes[i]["key"]: position
+            for position, i in enumerate(previous_node_ids)
+        },
+    )
+
+
+async def load_graph_index(
+    db: AsyncIOMotorDatabase,
+    project_id: ObjectId,
+    annotator: Optional[str] = AGREED,
+    suggested: Optional[bool] = None,
+    exclude_ontology_item_ids: Optional[List[str]] = None,
+) -> GraphIndex:
+    """Loads the graph of an annotator, or the agreed upon graph, from the projection."""
+    exclude_ontology_item_ids = sorted(i for i in exclude_ontology_item_ids or [] if i)
+
+    async def load():
+        state, nodes, edges = await find_graph_documents(
+            db=db,
+            project_id=project_id,
+            annotator=annotator,
+            suggested=suggested,
+            exclude_ontology_item_ids=exclude_ontology_item_ids,
+        )
+        index = GraphIndex(nodes=nodes, edges=edges)
+        logger.info(
+            f"Loaded graph of project {project_id} with {len(index)} nodes and {len(index.edges)} edges"
+        )
+        return index, [state]
+
+    return await cached(
+        GRAPH_PROJECTIONS_COLLECTION,
+        (project_id, annotator, suggested, tuple(exclude_ontology_item_ids)),
+        load,
+    )
@@ -0,0 +1,490 @@
+"""Graph projection.
+
+The aggregated knowledge graph of each project is maintained in the `graph_nodes` and
+`graph_edges` collections. Nodes are keyed by surface form, ontology item and quality and
+edges by their source and target nodes, ontology item and quality. Each holds a count per
+annotator and one over agreed upon dataset items (those saved by at least the project's
+`annotators_per_item`), stored under the annotator `AGREED`.
+
+The counts contributed by every dataset item are recorded in `graph_contributions`. An
+item is refreshed by recomputing its contribution from its markup and applying the
+difference to the projection, so refreshing is idempotent and a project is rebuilt by
+refreshing all of its items. A refresh claims its items before reading their markup and
+only swaps contributions it still holds the claim on, so a refresh that read older
+markup never overwrites the contribution of a later one. Writes to single items refresh them directly; bulk writes
+mark the projection stale and it is rebuilt in the background.
+"""
+
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+
+from ..utils.cache import find_project, invalidate_document
+from ..utils.context import detach_request_context
+
+logger = logging.getLogger(__name__)
+
+GRAPH_NODES_COLLECTION = "graph_nodes"
+GRAPH_EDGES_COLLECTION = "graph_edges"
+GRAPH_CONTRIBUTIONS_COLLECTION = "graph_contributions"
+GRAPH_PROJECTIONS_COLLECTION = "graph_projections"
+
+# Annotator of the counts over agreed upon dataset items
+AGREED = None
+
+# Dataset items refreshed per batch
+REFRESH_BATCH_SIZE = 1000
+
+MARKUP_PROJECTION = {
+    "dataset_item_id": 1,
+    "classification": 1,
+    "surface_form": 1,
+    "ontology_item_id": 1,
+    "suggested": 1,
+    "created_by": 1,
+    "source_id": 1,
+    "target_id": 1,
+}
+
+NODE_PROJECTION = {
+    "_id": 0,
+    "key": 1,
+    "surface_form": 1,
+    "ontology_item_id": 1,
+    "suggested": 1,
+    "count": 1,
+}
+
+EDGE_PROJECTION = {
+    "_id": 0,
+    "source": 1,
+    "target": 1,
+    "ontology_item_id": 1,
+    "suggested": 1,
+    "count": 1,
+}
+
+# (annotator, surface_form, ontology_item_id, suggested)
+NodeKey = Tuple[Optional[str], str, str, bool]
+# (annotator, source surface_form, source ontology_item_id, source suggested, target
+# surface_form, target ontology_item_id, target suggested, ontology_item_id, suggested)
+EdgeKey = Tuple[Optional[str], str, str, bool, str, str, bool, str, bool]
+
+# Background projection rebuilds running in this process, keyed by project.
+_rebuild_tasks: Dict[ObjectId, asyncio.Task] = {}
+
+
+def create_node_key(surface_form: str, ontology_item_id: str, suggested: bool) -> str:
+    """Creates the identifier of an aggregated graph node."""
+    return f"{surface_form}-{ontology_item_id}-{suggested}"
+
+
+def count_item_graph(
+    markup: List[Dict[str, Any]], agreed: bool
+) -> Tuple[Counter, Counter]:
+    """Counts the nodes and edges contributed by the markup of one dataset item."""
+    nodes = Counter()
+    edges = Counter()
+
+    entities = {m["_id"]: m for m in markup if m["classification"] == "entity"}
+    for m in entities.values():
+        node = (m["surface_form"], m["ontology_item_id"], m["suggested"])
+        nodes[(m["created_by"], *node)] += 1
+        if agreed:
+            nodes[(AGREED, *node)] += 1
+
+    for m in markup:
+        if m["classification"] != "relation":
+            continue
+        source = entities.get(m["source_id"])
+        target = entities.get(m["target_id"])
+        if source is None or target is None:
+            continue
+        edge = (
+            source["surface_form"],
+            source["ontology_item_id"],
+            source["suggested"],
+            target["surface_form"],
+            target["ontology_item_id"],
+            target["suggested"],
+            m["ontology_item_id"],
+            m["suggested"],
+        )
+        edges[(m["created_by"], *edge)] += 1
+        if agreed:
+            edges[(AGREED, *edge)] += 1
+
+    return nodes, edges
+
+
+async def claim_item_contributions(
+    db: AsyncIOMotorDatabase, project_id: ObjectId, dataset_item_ids: List[ObjectId]
+) -> Dict[ObjectId, ObjectId]:
+    """Claims the contributions of dataset items for a refresh.
+
+    Each claim replaces any earlier one, so only the refresh that claimed an item last,
+    and so read its markup last, can swap its contribution.
+
+    Returns:
+        The claim on each dataset item.
+    """
+    claims = {dataset_item_id: ObjectId() for dataset_item_id in dataset_item_ids}
+    await db[GRAPH_CONTRIBUTIONS_COLLECTION].bulk_write(
+        [
+            UpdateOne(
+                {"_id": dataset_item_id},
+                {
+                    "$set": {"claim": claim},
+                    # Claimed items without a contribution yet are removed by the swap.
+                    "$setOnInsert": {
+                        "project_id": project_id,
+                        "nodes": [],
+                        "edges": [],
+                    },
+                },
+                upsert=True,
+            )
+            for dataset_item_id, claim in claims.items()
+        ],
+        ordered=False,
+    )
+    return claims
+
+
+async def swap_item_contribution(
+    db: AsyncIOMotorDatabase,
+    project_id: ObjectId,
+    dataset_item_id: ObjectId,
+    claim: ObjectId,
+    nodes: Counter,
+    edges: Counter,
+) -> Tuple[Counter, Counter]:
+    """Stores the contribution of a dataset item and returns its difference to the
+    previous contribution.
+
+    The contribution is swapped atomically, and only while `claim` is the item's latest
+    claim, so that concurrent refreshes of an item apply consecutive differences and the
+    last contribution stored is computed from the latest markup. Superseded refreshes
+    leave the contribution as is and return no differences.
+    """
+    _filter = {"_id": dataset_item_id, "claim": claim}
+    if nodes or edges:
+        previous = await db[GRAPH_CONTRIBUTIONS_COLLECTION].find_one_and_replace(
+            _filter,
+            {
+                "project_id": project_id,
+                "claim": claim,
+                "nodes": [[*key, count] for key, count in nodes.items()],
+                "edges": [[*key, count] for key, count in edges.items()],
+            },
+            return_document=ReturnDocument.BEFORE,
+        )
+    else:
+        previous = await db[GRAPH_CONTRIBUTIONS_COLLECTION].find_one_and_delete(_filter)
+
+    if previous is None:
+        # A later refresh claimed the item and will store its contribution.
+        return Counter(), Counter()
+    node_deltas = Counter(nodes)
+    edge_deltas = Counter(edges)
+    node_deltas.subtract({tuple(n[:-1]): n[-1] for n in previous["nodes"]})
+    edge_deltas.subtract({tuple(e[:-1]): e[-1] for e in previous["edges"]})
+    return node_deltas, edge_deltas
+
+
+async def apply_graph_deltas(
+    db: AsyncIOMotorDatabase,
+    project_id: ObjectId,
+    node_deltas: Counter,
+    edge_deltas: Counter,
+) -> None:
+    """Applies count differences to the projection and removes emptied nodes and edges."""
+    node_operations = []
+    emptied_node_keys = []
+    for (
+        annotator,
+        surface_form,
+        ontology_item_id,
+        suggested,
+    ), delta in node_deltas.items():
+        if delta == 0:
+            continue
+        key = create_node_key(surface_form, ontology_item_id, suggested)
+        node_operations.append(
+            UpdateOne(
+                {"project_id": project_id, "annotator": annotator, "key": key},
+                {
+                    "$inc": {"count": delta},
+                    "$setOnInsert": {
+                        "surface_form": surface_form,
+                        "ontology_item_id": ontology_item_id,
+                        "suggested": suggested,
+                    },
+                },
+                upsert=True,
+            )
+        )
+        if delta < 0:
+            emptied_node_keys.append(key)
+
+    edge_operations = []
+    emptied_edge_sources = []
+    for edge, delta in edge_deltas.items():
+        if delta == 0:
+            continue
+        annotator = edge[0]
+        source = create_node_key(*edge[1:4])
+        target = create_node_key(*edge[4:7])
+        edge_operations.append(
+            UpdateOne(
+                {
+                    "project_id": project_id,
+                    "annotator": annotator,
+                    "source": source,
+                    "target": target,
+                    "ontology_item_id": edge[7],
+                    "suggested": edge[8],
+                },
+                {"$inc": {"count": delta}},
+                upsert=True,
+            )
+        )
+        if delta < 0:
+            emptied_edge_sources.append(source)
+
+    if node_operations:
+        await db[GRAPH_NODES_COLLECTION].bulk_write(node_operations, ordered=False)
+    if edge_operations:
+        await db[GRAPH_EDGES_COLLECTION].bulk_write(edge_operations, ordered=False)
+    if emptied_node_keys:
+        await db[GRAPH_NODES_COLLECTION].delete_many(
+            {
+                "project_id": project_id,
+                "key": {"$in": emptied_node_keys},
+                "count": {"$lte": 0},
+            }
+        )
+    if emptied_edge_sources:
+        await db[GRAPH_EDGES_COLLECTION].delete_many(
+            {
+                "project_id": project_id,
+                "source": {"$in": emptied_edge_sources},
+                "count": {"$lte": 0},
+            }
+        )
+    if node_operations or edge_operations:
+        # Versions the projection so graphs built from it are rebuilt.
+        await db[GRAPH_PROJECTIONS_COLLECTION].update_one(
+            {"_id": project_id}, {"$inc": {"version": 1}}
+        )
+        invalidate_document(GRAPH_PROJECTIONS_COLLECTION, project_id)
+
+
+async def refresh_dataset_items_graph(
+    db: AsyncIOMotorDatabase, project_id: ObjectId, dataset_item_ids: List[ObjectId]
+) -> None:
+    """Recomputes the graph contributions of dataset items and updates the projection.
+
+    Items that no longer exist have their contributions removed.
+    """
+    project = await find_project(db=db, project_id=project_id)
+    if project is None:
+        return
+    annotators_per_item = project["settings"]["annotators_per_item"]
+
+    for i in range(0, len(dataset_item_ids), REFRESH_BATCH_SIZE):
+        batch = dataset_item_ids[i : i + REFRESH_BATCH_SIZE]
+
+        # Items are claimed before their markup is read.
+        claims = await claim_item_contributions(
+            db=db, project_id=project_id, dataset_item_ids=batch
+        )
+        save_counts = {
+            di["_id"]: len(di.get("save_states") or [])
+            async for di in db["data"].find(
+                {"_id": {"$in": batch}, "project_id": project_id}, {"save_states": 1}
+            )
+        }
+        markup = defaultdict(list)
+        async for m in db["markup"].find(
+            {"project_id": project_id, "dataset_item_id": {"$in": batch}},
+            MARKUP_PROJECTION,
+        ):
+            markup[m["dataset_item_id"]].append(m)
+
+        async def refresh(dataset_item_id: ObjectId) -> Tuple[Counter, Counter]:
+            save_count = save_counts.get(dataset_item_id, 0)
+            nodes, edges = count_item_graph(
+                markup[dataset_item_id],
+                agreed=save_count > 0 and save_count >= annotators_per_item,
+            )
+            return await swap_item_contribution(
+                db=db,
+                project_id=project_id,
+                dataset_item_id=dataset_item_id,
+                claim=claims[dataset_item_id],
+                nodes=nodes,
+                edges=edges,
+            )
+
+        node_deltas = Counter()
+        edge_deltas = Counter()
+        for item_node_deltas, item_edge_deltas in await asyncio.gather(
+            *(refresh(dataset_item_id) for dataset_item_id in batch)
+        ):
+            node_deltas.update(item_node_deltas)
+            edge_deltas.update(item_edge_deltas)
+
+        await apply_graph_deltas(
+            db=db,
+            project_id=project_id,
+            node_deltas=node_deltas,
+            edge_deltas=edge_deltas,
+        )
+
+
+async def rebuild_project_graph(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> Dict[str, Any]:
+    """Refreshes every dataset item of a project, including removed items that still
+    have contributions, and records when the projection was computed."""
+    computed_at = datetime.utcnow()
+
+    dataset_item_ids = set(
+        await db[GRAPH_CONTRIBUTIONS_COLLECTION].distinct(
+            "_id", {"project_id": project_id}
+        )
+    )
+    async for di in db["data"].find({"project_id": project_id}, {"_id": 1}):
+        dataset_item_ids.add(di["_id"])
+
+    await refresh_dataset_items_graph(
+        db=db, project_id=project_id, dataset_item_ids=sorted(dataset_item_ids)
+    )
+    logger.info(
+        f"Rebuilt graph of project {project_id} from {len(dataset_item_ids)} dataset items"
+    )
+
+    state = await db[GRAPH_PROJECTIONS_COLLECTION].find_one_and_update(
+        {"_id": project_id},
+        {
+            "$set": {"computed_at": computed_at},
+            "$setOnInsert": {"changed_at": computed_at, "version": 0},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    invalidate_document(GRAPH_PROJECTIONS_COLLECTION, project_id)
+    return state
+
+
+def is_stale(state: Dict[str, Any]) -> bool:
+    return state["changed_at"] > state["computed_at"]
+
+
+async def rebuild_project_graph_in_background(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> None:
+    """Schedules a projection rebuild unless one is already running for the project."""
+    if project_id in _rebuild_tasks:
+        return
+
+    async def _rebuild():
+        detach_request_context()
+        try:
+            await rebuild_project_graph(db=db, project_id=project_id)
+        except Exception as e:
+            logger.error(f"Error rebuilding graph of project {project_id}: {e}")
+        finally:
+            _rebuild_tasks.pop(project_id, None)
+
+    _rebuild_tasks[project_id] = asyncio.create_task(_rebuild())
+
+
+async def ensure_project_graph(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> Dict[str, Any]:
+    """Builds the projection of a project on first use and rebuilds it when stale.
+
+    Stale projections are read as is while they are rebuilt in the background. Returns
+    the projection state.
+    """
+    state = await db[GRAPH_PROJECTIONS_COLLECTION].find_one({"_id": project_id})
+    if state is None:
+        state = await rebuild_project_graph(db=db, project_id=project_id)
+    elif is_stale(state):
+        await rebuild_project_graph_in_background(db=db, project_id=project_id)
+    return state
+
+
+async def mark_project_graph_stale(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> None:
+    """Records that markup changed in bulk so the projection is rebuilt on next read."""
+    await db[GRAPH_PROJECTIONS_COLLECTION].update_one(
+        {"_id": project_id}, {"$set": {"changed_at": datetime.utcnow()}}
+    )
+    invalidate_document(GRAPH_PROJECTIONS_COLLECTION, project_id)
+
+
+async def update_project_graph(
+    db: AsyncIOMotorDatabase,
+    project_id: ObjectId,
+    dataset_item_ids: Optional[List[ObjectId]] = None,
+) -> None:
+    """Updates the projection after markup or save states of a project change.
+
+    Changed dataset items are refreshed directly; if they are not known, or too many to
+    refresh within a request, the projection is marked stale.
+    """
+    if dataset_item_ids is None or len(dataset_item_ids) > REFRESH_BATCH_SIZE:
+        await mark_project_graph_stale(db=db, project_id=project_id)
+    else:
+        await refresh_dataset_items_graph(
+            db=db, project_id=project_id, dataset_item_ids=dataset_item_ids
+        )
+
+
+async def find_graph_documents(
+    db: AsyncIOMotorDatabase,
+    project_id: ObjectId,
+    annotator: Optional[str] = AGREED,
+    suggested: Optional[bool] = None,
+    exclude_ontology_item_ids: Optional[List[str]] = None,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Finds the projection state and the nodes and edges of an annotator's graph, or of
+    the agreed upon graph, filtered by quality and ontology item."""
+    state = await ensure_project_graph(db=db, project_id=project_id)
+
+    _filter = {"project_id": project_id, "annotator": annotator}
+    if suggested is not None:
+        _filter["suggested"] = suggested
+    if exclude_ontology_item_ids:
+        _filter["ontology_item_id"] = {"$nin": exclude_ontology_item_ids}
+
+    nodes = (
+        await db[GRAPH_NODES_COLLECTION]
+        .find(_filter, NODE_PROJECTION)
+        .sort("count", -1)
+        .to_list(None)
+    )
+    edges = (
+        await db[GRAPH_EDGES_COLLECTION].find(_filter, EDGE_PROJECTION).to_list(None)
+    )
+    return state, nodes, edges
+
+
+async def delete_project_graph(db: AsyncIOMotorDatabase, project_id: ObjectId) -> None:
+    for collection_name in (
+        GRAPH_NODES_COLLECTION,
+        GRAPH_EDGES_COLLECTION,
+        GRAPH_CONTRIBUTIONS_COLLECTION,
+    ):
+        await db[collection_name].delete_many({"project_id": project_id})
+    await db[GRAPH_PROJECTIONS_COLLECTION].delete_one({"_id": project_id})
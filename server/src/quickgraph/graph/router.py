@@ -5,33 +5,34 @@ from collections import Counter, defaultdict
 from typing import Dict, List, Optional, Union
 
 from bson import ObjectId
-from fastapi import APIRouter, Body, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, status
 from fastapi.responses import JSONResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from ..dataset.schemas import QualityFilter
 from ..dependencies import get_db, get_user
 from ..project.schemas import OntologyItem
-from ..resources.services import get_project_ontology_items
+from ..resources.services import get_project_compiled_ontologies
+from ..search.services import search_surface_forms
 from ..users.schemas import UserDocumentModel
-from ..utils.misc import flatten_hierarchical_ontology
+from ..utils.cache import find_project
 from .schemas import (
     Graph,
     GraphData,
     GraphFilters,
-    Link,
+    GraphFormat,
     LinkNode,
     Metrics,
-    Node,
-    NodeColor,
-    NodeFont,
     Ontologies,
+    SubgraphPage,
 )
+from .compact import create_compact_graph, create_compact_response
+from .engine import create_compact_graph_data, create_graph_data, load_graph_index
 from .services import (
-    aggregate_graph,
+    create_link,
+    create_node,
     create_relationships,
     filter_ontology_by_ids,
-    get_font_color,
     get_graph_data,
     get_node_neighbors,
     lighten_hex_color,
@@ -47,6 +48,7 @@ router = APIRouter(prefix=f"{settings.api.prefix}/graph", tags=["Graph"])
     "/{project_id}", response_description="Get single graph"
 )  # , response_model=Graph
 async def get_graph(
+    request: Request,
     project_id: str,
     username: Optional[str] = Query(default=None),
     search_term: Optional[str] = Query(default=None),
@@ -64,6 +66,11 @@ async def get_graph(
     node_limit: int = Query(
         gt=0, default=5000, description="The number of nodes to return."
     ),
+    graph_format: GraphFormat = Query(
+        default=GraphFormat.full,
+        alias="format",
+        description="Format of the graph; compact graphs hold an ontology legend and columnar nodes and links",
+    ),
     # filters: GraphFilters,
     user: UserDocumentModel = Depends(get_user),
     db: AsyncIOMotorDatabase = Depends(get_db),
@@ -71,6 +78,7 @@ async def get_graph(
     """Creates a project graph dataset.
 
     This function aggregates project markup into a graph dataset. The default graph is built on only agreed upon annotations on dataset items with minimum annotator saves.
+    Aggregated graphs are read from the project's graph projection; the unaggregated graph is built from markup.
     """
 
     if username == "":
@@ -78,9 +86,7 @@ async def get_graph(
 
     project_id = ObjectId(project_id)
 
-    project = await db["projects"].find_one(
-        {"_id": project_id}, {"ontology": 1, "settings": 1, "annotators": 1}
-    )
+    project = await find_project(db=db, project_id=project_id)
 
     # Project does not exist
     if project is None:
@@ -88,24 +94,47 @@ async def get_graph(
             status_code=status.HTTP_404_NOT_FOUND, content={"detail": "Graph not found"}
         )
 
-    entity_ontology, relation_ontology, _ = await get_project_ontology_items(
-        db=db, project_id=project_id
-    )
+    ontologies = await get_project_compiled_ontologies(db=db, project_id=project_id)
+    ontology_id2details = {
+        (ontology_type, item_id): details
+        for ontology_type, ontology in ontologies.items()
+        for item_id, details in ontology.details.items()
+    }
+    exclude_ontology_item_ids = exclude_ontology_item_ids.split(",")
+    suggested = None if quality == QualityFilter.everything else quality == 0
 
-    ontology_id2details = {}
-    for ontology_type, ontology_items in [
-        ("entity", entity_ontology),
-        ("relation", relation_ontology),
-    ]:
-        flat_ontology = flatten_hierarchical_ontology(ontology=ontology_items)
-
-        # Default to purple color if none exists (relations do not have this attribute)
-        for item in flat_ontology:
-            ontology_id2details[(ontology_type, item.id)] = {
-                "fullname": item.fullname,
-                "color": (item.color if item and hasattr(item, "color") else "#7b1fa2"),
-                "name": item.name,
-            }
+    if aggregate:
+        # The group graph holds agreed upon markup on dataset items with minimum saves.
+        index = await load_graph_index(
+            db=db,
+            project_id=project_id,
+            annotator=username,
+            suggested=suggested,
+            exclude_ontology_item_ids=exclude_ontology_item_ids,
+        )
+        node_ids = index.top_nodes(
+            limit=node_limit,
+            node_ids=index.search(search_term),
+            show_orphans=show_orphans,
+        )
+        if graph_format == GraphFormat.compact:
+            return create_compact_response(
+                request=request,
+                payload=create_compact_graph_data(
+                    index=index,
+                    node_ids=node_ids,
+                    edge_ids=index.subgraph_edges(node_ids),
+                    ontology_id2details=ontology_id2details,
+                ),
+            )
+        return Graph(
+            data=create_graph_data(
+                index=index,
+                node_ids=node_ids,
+                edge_ids=index.subgraph_edges(node_ids),
+                ontology_id2details=ontology_id2details,
+            )
+        )
 
     # Fetch dataset items that have minimum saves if "group" graph otherwise filter for "created_by"
     if username is None:
@@ -141,7 +170,7 @@ async def get_graph(
     # Fetch markup associated
     markup_query = {
         "project_id": project_id,
-        "ontology_item_id": {"$nin": exclude_ontology_item_ids.split(",")},
+        "ontology_item_id": {"$nin": exclude_ontology_item_ids},
     }
 
     if username is None:
@@ -149,8 +178,8 @@ async def get_graph(
     else:
         markup_query["created_by"] = username
 
-    if quality != 2:
-        markup_query["suggested"] = True if quality == 0 else False
+    if suggested is not None:
+        markup_query["suggested"] = suggested
 
     # if show_orphans == False:
     #     pass
@@ -158,10 +187,18 @@ async def get_graph(
     # Fetch entities
     entity_match_query = {**markup_query, "classification": "entity"}
     if search_term is not None and search_term != "":
-        entity_match_query = {
-            **entity_match_query,
-            "surface_form": {"$regex": search_term, "$options": "i"},
-        }
+        # The last word is matched as a prefix as the graph is searched while typing.
+        surface_forms = await search_surface_forms(
+            db=db,
+            search_term=search_term,
+            markup_filter=markup_query,
+            prefix_last=True,
+        )
+        if surface_forms is not None:
+            entity_match_query = {
+                **entity_match_query,
+                "surface_form": {"$in": surface_forms},
+            }
 
     entity_markup_pipeline = [
         {"$match": entity_match_query},
@@ -186,24 +223,6 @@ async def get_graph(
                 "target_id": {"$in": entity_markup_ids},
             }
         },
-        {
-            "$lookup": {
-                "from": "markup",
-                "let": {"source_id": "$source_id"},
-                "pipeline": [{"$match": {"$expr": {"$eq": ["$_id", "$$source_id"]}}}],
-                "as": "source",
-            }
-        },
-        {
-            "$lookup": {
-                "from": "markup",
-                "let": {"target_id": "$target_id"},
-                "pipeline": [{"$match": {"$expr": {"$eq": ["$_id", "$$target_id"]}}}],
-                "as": "target",
-            }
-        },
-        {"$unwind": {"path": "$source", "preserveNullAndEmptyArrays": True}},
-        {"$unwind": {"path": "$target", "preserveNullAndEmptyArrays": True}},
     ]  # This is dependent on entity_markup_pipeline
     relation_markup = (
         await db["markup"].aggregate(relation_markup_pipeline).to_list(None)
@@ -256,54 +275,175 @@ async def get_graph(
         }  # This should be done when fetching entity markup otherwise less than the node limit can be returned.
         nodes = [n for n in nodes if n["_id"] in connected_node_ids]
 
-    nodes = {
-        str(i["_id"]): Node(
-            classification=ontology_id2details[("entity", i["ontology_item_id"])][
-                "name"
-            ],
-            color=NodeColor(
-                border=ontology_id2details[("entity", i["ontology_item_id"])]["color"],
-                background=ontology_id2details[("entity", i["ontology_item_id"])][
-                    "color"
-                ],
-            ),
-            font=NodeFont(
-                color=get_font_color(
-                    ontology_id2details[("entity", i["ontology_item_id"])]["color"],
-                )
+    if graph_format == GraphFormat.compact:
+        return create_compact_response(
+            request=request,
+            payload=create_compact_graph(
+                nodes=(
+                    {
+                        "id": str(i["_id"]),
+                        "label": i["surface_form"],
+                        "ontology_item_id": i["ontology_item_id"],
+                        "suggested": i["suggested"],
+                        "value": 1,
+                    }
+                    for i in nodes
+                ),
+                links=(
+                    {
+                        "source": str(i["source_id"]),
+                        "target": str(i["target_id"]),
+                        "ontology_item_id": i["ontology_item_id"],
+                        "suggested": i["suggested"],
+                        "value": 1,
+                    }
+                    for i in links
+                ),
+                ontology_id2details=ontology_id2details,
             ),
+        )
+
+    nodes = {
+        str(i["_id"]): create_node(
             id=str(i["_id"]),
-            label=i["surface_form"],
-            title=ontology_id2details[("entity", i["ontology_item_id"])]["fullname"],
-            value=1,
-            suggested=i["suggested"],
+            surface_form=i["surface_form"],
             ontology_item_id=i["ontology_item_id"],
+            suggested=i["suggested"],
+            value=1,
+            ontology_id2details=ontology_id2details,
         ).model_dump()
         for i in nodes
     }
 
     links = {
-        str(i["_id"]): Link(
+        str(i["_id"]): create_link(
             id=str(i["_id"]),
-            label=ontology_id2details[("relation", i["ontology_item_id"])]["name"],
-            source=str(i["source"]["_id"]),
-            target=str(i["target"]["_id"]),
-            title=ontology_id2details[("relation", i["ontology_item_id"])]["fullname"],
-            value=1,
-            suggested=i["suggested"],
-            color=ontology_id2details[("relation", i["ontology_item_id"])]["color"],
+            source=str(i["source_id"]),
+            target=str(i["target_id"]),
             ontology_item_id=i["ontology_item_id"],
+            suggested=i["suggested"],
+            value=1,
+            ontology_id2details=ontology_id2details,
         ).model_dump()
         for i in links
     }
 
-    if aggregate:
-        return Graph(
-            data=GraphData(**aggregate_graph(data={"nodes": nodes, "links": links}))
+    # Create relations between node and links
+    relationships = get_node_neighbors(nodes=nodes, links=links)
+    return Graph(data=GraphData(nodes=nodes, links=links, relationships=relationships))
+
+
+@router.get(
+    "/{project_id}/subgraph",
+    response_description="Get a page of a graph or of a node neighbourhood",
+    response_model=SubgraphPage,
+)
+async def get_subgraph(
+    request: Request,
+    project_id: str,
+    username: Optional[str] = Query(default=None),
+    search_term: Optional[str] = Query(default=None),
+    quality: int = Query(default=QualityFilter.everything),
+    show_orphans: bool = Query(
+        default=True, description="Flag to toggle visibility of orphaned entities"
+    ),
+    exclude_ontology_item_ids: str = Query(
+        default="",
+        description="A comma separated string of ontology item ids to exclude from the graph",
+    ),
+    focus: Optional[str] = Query(
+        default=None, description="Key of the node to expand the subgraph around"
+    ),
+    hops: int = Query(
+        default=1, ge=1, le=3, description="Number of edges to expand from the focus"
+    ),
+    offset: int = Query(default=0, ge=0, description="Number of nodes to skip"),
+    limit: int = Query(
+        default=500, gt=0, le=5000, description="The number of nodes to return."
+    ),
+    graph_format: GraphFormat = Query(
+        default=GraphFormat.full,
+        alias="format",
+        description="Format of the page; compact pages hold an ontology legend and columnar nodes and links",
+    ),
+    user: UserDocumentModel = Depends(get_user),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """Pages through the aggregated graph, or the neighbourhood of a focus node, highest
+    degree nodes first.
+
+    Each page holds the links from its nodes to the nodes of the page and earlier pages,
+    so a client accumulating pages holds the full subgraph of the nodes it has loaded.
+    """
+    if username == "":
+        username = None
+
+    project_id = ObjectId(project_id)
+
+    project = await find_project(db=db, project_id=project_id)
+    if project is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Graph not found"
+        )
+
+    ontologies = await get_project_compiled_ontologies(db=db, project_id=project_id)
+    ontology_id2details = {
+        (ontology_type, item_id): details
+        for ontology_type, ontology in ontologies.items()
+        for item_id, details in ontology.details.items()
+    }
+
+    index = await load_graph_index(
+        db=db,
+        project_id=project_id,
+        annotator=username,
+        suggested=None if quality == QualityFilter.everything else quality == 0,
+        exclude_ontology_item_ids=exclude_ontology_item_ids.split(","),
+    )
+
+    if focus is None:
+        node_ids = index.top_nodes(
+            node_ids=index.search(search_term), show_orphans=show_orphans
         )
     else:
-        # Create relations between node and links
-        relationships = get_node_neighbors(nodes=nodes, links=links)
-        return Graph(
-            data=GraphData(nodes=nodes, links=links, relationships=relationships)
+        if focus not in index.node_ids:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Node not found"
+            )
+        node_ids = index.expand(focus=index.node_ids[focus], hops=hops)
+
+    page_node_ids = node_ids[offset : offset + limit]
+    page_edge_ids = index.subgraph_edges(
+        page_node_ids, other_node_ids=set(node_ids[: offset + limit])
+    )
+    if graph_format == GraphFormat.compact:
+        # Compact links reference nodes of earlier pages by their position.
+        return create_compact_response(
+            request=request,
+            payload={
+                "data": create_compact_graph_data(
+                    index=index,
+                    node_ids=page_node_ids,
+                    edge_ids=page_edge_ids,
+                    ontology_id2details=ontology_id2details,
+                    offset=offset,
+                    previous_node_ids=node_ids[:offset],
+                ),
+                "focus": focus,
+                "offset": offset,
+                "limit": limit,
+                "total": len(node_ids),
+            },
         )
+    return SubgraphPage(
+        data=create_graph_data(
+            index=index,
+            node_ids=page_node_ids,
+            edge_ids=page_edge_ids,
+            ontology_id2details=ontology_id2details,
+        ),
+        focus=focus,
+        offset=offset,
+        limit=limit,
+        total=len(node_ids),
+    )
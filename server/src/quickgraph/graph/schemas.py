@@ -1,13 +1,19 @@
 """Graph schemas."""
 
 from enum import Enum
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
 from ..resources.schemas import OntologyItem
 
 
+class GraphFormat(str, Enum):
+    full = "full"
+    # Ontology legend with columnar nodes and links, see `graph.compact`
+    compact = "compact"
+
+
 class NodeFont(BaseModel):
     color: str = "#000000"
 
@@ -94,3 +100,13 @@ class GraphFilters(BaseModel):
         default="", description="Search term used to filter project documents"
     )
     label_ids: List[str] = Field(default=[], description="List of ontology label ids")
+
+
+class SubgraphPage(BaseModel):
+    data: GraphData
+    focus: Optional[str] = Field(
+        default=None, description="Key of the node the subgraph was expanded around"
+    )
+    offset: int = Field(ge=0, description="Number of nodes on previous pages")
+    limit: int = Field(gt=0, description="Maximum number of nodes on the page")
+    total: int = Field(ge=0, description="Number of nodes in the subgraph")
@@ -1,8 +1,6 @@
 """Graph services."""
 
 from collections import defaultdict
-from itertools import groupby
-from operator import itemgetter
 from typing import Dict, List, Union
 
 from ..project.schemas import OntologyItem
@@ -108,6 +106,51 @@ async def get_graph_data(db, project_id: str):
     project = await db["projects"].find_one({"_id": project_id})
 
 
+def create_node(
+    id: str,
+    surface_form: str,
+    ontology_item_id: str,
+    suggested: bool,
+    value: int,
+    ontology_id2details: dict,
+) -> Node:
+    details = ontology_id2details[("entity", ontology_item_id)]
+    return Node(
+        classification=details["name"],
+        color=NodeColor(border=details["color"], background=details["color"]),
+        font=NodeFont(color=get_font_color(details["color"])),
+        id=id,
+        label=surface_form,
+        title=details["fullname"],
+        value=value,
+        suggested=suggested,
+        ontology_item_id=ontology_item_id,
+    )
+
+
+def create_link(
+    id: str,
+    source: str,
+    target: str,
+    ontology_item_id: str,
+    suggested: bool,
+    value: int,
+    ontology_id2details: dict,
+) -> Link:
+    details = ontology_id2details[("relation", ontology_item_id)]
+    return Link(
+        id=id,
+        label=details["name"],
+        source=source,
+        target=target,
+        title=details["fullname"],
+        value=value,
+        suggested=suggested,
+        color=details["color"],
+        ontology_item_id=ontology_item_id,
+    )
+
+
 def get_node_neighbors(nodes, links):
     # Check if nodes and links are defined
     if not nodes or not links:
@@ -136,95 +179,6 @@ def get_node_neighbors(nodes, links):
     return neighbors
 
 
-def aggregate_graph(data):
-    nodes = data.get("nodes", {})
-    links = data.get("links", {})
-
-    if not nodes:
-        return {"nodes": {}, "links": {}, "relationships": {}}
-
-    # Aggregate nodes
-    sorted_nodes = sorted(
-        nodes.values(),
-        key=lambda node: (node["label"], node["ontology_item_id"], node["suggested"]),
-    )
-    aggregated_nodes = {}
-    for index, (key, group) in enumerate(
-        groupby(sorted_nodes, key=itemgetter("label", "ontology_item_id", "suggested"))
-    ):
-        group = list(group)
-        new_node = group[0].copy()
-        new_node[
-            "id"
-        ] = f"{new_node['label']}-{new_node['ontology_item_id']}-{new_node['suggested']}"
-        new_node["value"] = len(group)
-        aggregated_nodes[new_node["id"]] = new_node
-
-    # Populate links with src/tgt information
-    enriched_links = [
-        {
-            **link,
-            "source": nodes.get(link.get("source", link["source"])),
-            "target": nodes.get(link.get("target", link["target"])),
-        }
-        for link in links.values()
-    ]
-
-    # Aggregate links
-    sorted_links = sorted(
-        enriched_links,
-        key=lambda link: (
-            link["source"]["label"],
-            link["source"]["ontology_item_id"],
-            link["target"]["label"],
-            link["target"]["ontology_item_id"],
-            link["ontology_item_id"],
-            link["suggested"],
-        ),
-    )
-
-    def get_nested_keys(d, keys):
-        for key in keys.split("."):
-            d = d[key]
-        return d
-
-    aggregated_links = {}
-    for index, (key, group) in enumerate(
-        groupby(
-            sorted_links,
-            key=lambda x: (
-                get_nested_keys(x, "source.label"),
-                get_nested_keys(x, "source.ontology_item_id"),
-                get_nested_keys(x, "target.label"),
-                get_nested_keys(x, "target.ontology_item_id"),
-                x["ontology_item_id"],
-                x["suggested"],
-            ),
-        )
-    ):
-        group = list(group)
-        new_link = group[0].copy()
-        new_link["value"] = len(group)
-        new_link[
-            "source"
-        ] = f"{new_link['source']['label']}-{new_link['source']['ontology_item_id']}-{new_link['source']['suggested']}"
-
-        new_link[
-            "target"
-        ] = f"{new_link['target']['label']}-{new_link['target']['ontology_item_id']}-{new_link['target']['suggested']}"
-        new_link[
-            "id"
-        ] = f"{new_link['source']}-{new_link['label']}-{new_link['target']}"
-
-        aggregated_links[new_link["id"]] = new_link
-
-    return {
-        "nodes": aggregated_nodes,
-        "links": aggregated_links,
-        "relationships": get_node_neighbors(aggregated_nodes, aggregated_links),
-    }
-
-
 def add_details_and_create_objects(
     items: dict, ontology_id2details: dict, is_node: bool
 ):  #  Dict[str, Union[Node, Link]]
@@ -0,0 +1,58 @@
+"""Jobs router."""
+
+import logging
+from typing import List
+
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..dependencies import get_db, get_user
+from ..settings import settings
+from ..users.schemas import UserDocumentModel
+from .schemas import Job
+from .services import cancel_job, find_many_jobs, find_one_job
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix=f"{settings.api.prefix}/jobs", tags=["Jobs"])
+
+
+@router.get("", response_description="List jobs", response_model=List[Job])
+async def list_jobs_endpoint(
+    user: UserDocumentModel = Depends(get_user),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """Lists the most recent jobs submitted by the user."""
+    return await find_many_jobs(db=db, username=user.username)
+
+
+@router.get("/{job_id}", response_description="Get job", response_model=Job)
+async def get_job_endpoint(
+    job_id: str,
+    user: UserDocumentModel = Depends(get_user),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """Gets the status, progress and result of a job."""
+    job = await find_one_job(db=db, job_id=ObjectId(job_id), username=user.username)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Job not found"
+        )
+    return job
+
+
+@router.post("/{job_id}/cancel", response_description="Cancel job", response_model=Job)
+async def cancel_job_endpoint(
+    job_id: str,
+    user: UserDocumentModel = Depends(get_user),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """Requests cancellation of a queued or running job."""
+    job = await cancel_job(db=db, job_id=ObjectId(job_id), username=user.username)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found or already finished",
+        )
+    return job
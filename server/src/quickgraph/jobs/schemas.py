@@ -0,0 +1,67 @@
+"""Jobs schemas."""
+
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, Optional
+
+from bson import ObjectId
+from pydantic import BaseModel, ConfigDict, Field
+
+from ..utils.schemas import PydanticObjectIdAnnotated
+
+
+class JobKind(str, Enum):
+    create_project = "create_project"
+    create_dataset = "create_dataset"
+    assign_annotator = "assign_annotator"
+    invite_users = "invite_users"
+    cluster_dataset = "cluster_dataset"
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+class CreateJob(BaseModel):
+    kind: JobKind = Field(description="The operation performed by the job")
+    created_by: str = Field(
+        description="The username of the user who submitted the job"
+    )
+    status: JobStatus = Field(default=JobStatus.queued, description="Job status")
+    progress: float = Field(
+        default=0, ge=0, le=1, description="Fraction of the job completed"
+    )
+    message: Optional[str] = Field(
+        default=None, description="Description of the current job stage"
+    )
+    result: Optional[Dict[str, Any]] = Field(
+        default=None, description="Result payload of a completed job"
+    )
+    error: Optional[str] = Field(default=None, description="Error of a failed job")
+    cancel_requested: bool = Field(
+        default=False, description="Whether cancellation of the job was requested"
+    )
+    created_at: datetime = Field(
+        default_factory=datetime.utcnow, description="Date/Time job was submitted"
+    )
+    updated_at: datetime = Field(
+        default_factory=datetime.utcnow, description="Date/Time job was last updated"
+    )
+    started_at: Optional[datetime] = Field(
+        default=None, description="Date/Time job started running"
+    )
+    finished_at: Optional[datetime] = Field(
+        default=None, description="Date/Time job finished"
+    )
+
+    model_config = ConfigDict(use_enum_values=True)
+
+
+class Job(CreateJob):
+    id: PydanticObjectIdAnnotated = Field(default_factory=ObjectId, alias="_id")
+
+    model_config = ConfigDict(populate_by_name=True)
@@ -0,0 +1,259 @@
+"""Jobs services.
+
+Long-running operations are submitted as jobs. Each job is recorded in the `jobs`
+collection and executed by a local worker pool of asyncio tasks whose concurrency is
+bounded by `settings.workers.jobs`. Job functions receive a `JobContext` they use to
+report progress; cancellation is cooperative and observed when progress is reported.
+
+Jobs record the worker process that owns them. Workers send heartbeats to the
+`job_workers` collection, and queued or running jobs whose worker stopped sending them,
+e.g. after a crash, are marked as failed.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+from ..settings import settings
+from ..utils.context import detach_request_context
+from .schemas import CreateJob, Job, JobKind, JobStatus
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = "jobs"
+JOB_WORKERS_COLLECTION = "job_workers"
+
+# Identifies this process as the owner of the jobs it runs.
+WORKER_ID = ObjectId()
+
+# Heartbeats missed before a worker is considered dead
+MISSED_HEARTBEATS = 3
+
+# Jobs running (or waiting for a worker) in this process.
+_tasks: Dict[ObjectId, asyncio.Task] = {}
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+class JobCancelledError(Exception):
+    """Raised inside a job when its cancellation has been requested."""
+
+
+class JobContext:
+    """Handle passed to job functions for reporting progress."""
+
+    def __init__(self, db: AsyncIOMotorDatabase, job_id: ObjectId):
+        self.db = db
+        self.job_id = job_id
+
+    async def update_progress(
+        self, progress: float, message: Optional[str] = None
+    ) -> None:
+        """Records job progress and raises `JobCancelledError` if cancellation was requested."""
+        job = await self.db[JOBS_COLLECTION].find_one_and_update(
+            {"_id": self.job_id},
+            {
+                "$set": {
+                    "progress": min(max(progress, 0), 1),
+                    "message": message,
+                    "updated_at": datetime.utcnow(),
+                }
+            },
+            projection={"cancel_requested": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None or job["cancel_requested"]:
+            raise JobCancelledError()
+
+
+JobFunction = Callable[[JobContext], Awaitable[Optional[Dict[str, Any]]]]
+
+
+def get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(settings.workers.jobs)
+    return _semaphore
+
+
+async def set_job_state(
+    db: AsyncIOMotorDatabase, job_id: ObjectId, status: JobStatus, **fields: Any
+) -> None:
+    await db[JOBS_COLLECTION].update_one(
+        {"_id": job_id},
+        {"$set": {"status": status.value, "updated_at": datetime.utcnow(), **fields}},
+    )
+
+
+async def run_job(db: AsyncIOMotorDatabase, job_id: ObjectId, fn: JobFunction) -> None:
+    """Runs a job function once a worker slot is available and records its outcome."""
+    detach_request_context()
+    try:
+        async with get_semaphore():
+            job = await db[JOBS_COLLECTION].find_one_and_update(
+                {"_id": job_id, "cancel_requested": False},
+                {
+                    "$set": {
+                        "status": JobStatus.running.value,
+                        "started_at": datetime.utcnow(),
+                        "updated_at": datetime.utcnow(),
+                    }
+                },
+            )
+            if job is None:
+                raise JobCancelledError()
+
+            logger.info(f"Running job: {job_id} ({job['kind']})")
+            result = await fn(JobContext(db=db, job_id=job_id))
+
+            await set_job_state(
+                db,
+                job_id,
+                JobStatus.completed,
+                progress=1,
+                result=jsonable_encoder(result, custom_encoder={ObjectId: str}),
+                finished_at=datetime.utcnow(),
+            )
+    except (JobCancelledError, asyncio.CancelledError):
+        logger.info(f"Job cancelled: {job_id}")
+        await set_job_state(
+            db, job_id, JobStatus.cancelled, finished_at=datetime.utcnow()
+        )
+    except Exception as e:
+        logger.error(f"Job failed: {job_id} ({e})")
+        await set_job_state(
+            db, job_id, JobStatus.failed, error=str(e), finished_at=datetime.utcnow()
+        )
+    finally:
+        _tasks.pop(job_id, None)
+
+
+async def submit_job(
+    db: AsyncIOMotorDatabase, kind: JobKind, username: str, fn: JobFunction
+) -> Job:
+    """Records a new job and schedules it on the local worker pool."""
+    job = {
+        **CreateJob(kind=kind, created_by=username).model_dump(),
+        "worker_id": WORKER_ID,
+    }
+    result = await db[JOBS_COLLECTION].insert_one(job)
+    _tasks[result.inserted_id] = asyncio.create_task(
+        run_job(db=db, job_id=result.inserted_id, fn=fn)
+    )
+    return Job(**job)
+
+
+async def find_one_job(
+    db: AsyncIOMotorDatabase, job_id: ObjectId, username: str
+) -> Optional[Job]:
+    job = await db[JOBS_COLLECTION].find_one({"_id": job_id, "created_by": username})
+    if job:
+        return Job(**job)
+
+
+async def find_many_jobs(
+    db: AsyncIOMotorDatabase, username: str, limit: int = 20
+) -> List[Job]:
+    jobs = (
+        await db[JOBS_COLLECTION]
+        .find({"created_by": username})
+        .sort("created_at", -1)
+        .limit(limit)
+        .to_list(None)
+    )
+    return [Job(**j) for j in jobs]
+
+
+async def cancel_job(
+    db: AsyncIOMotorDatabase, job_id: ObjectId, username: str
+) -> Optional[Job]:
+    """Requests cancellation of a queued or running job.
+
+    Queued jobs are cancelled immediately; running jobs stop the next time they report
+    progress so that they are not interrupted mid-write.
+    """
+    job = await db[JOBS_COLLECTION].find_one_and_update(
+        {
+            "_id": job_id,
+            "created_by": username,
+            "status": {"$in": [JobStatus.queued.value, JobStatus.running.value]},
+        },
+        {"$set": {"cancel_requested": True, "updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if job is None:
+        return None
+
+    task = _tasks.get(job_id)
+    if task and job["status"] == JobStatus.queued.value:
+        task.cancel()
+    return Job(**job)
+
+
+async def reap_orphaned_jobs(db: AsyncIOMotorDatabase) -> int:
+    """Marks queued and running jobs whose worker stopped sending heartbeats as failed.
+
+    Returns:
+        The number of jobs reaped.
+    """
+    cutoff = datetime.utcnow() - timedelta(
+        seconds=MISSED_HEARTBEATS * settings.workers.heartbeat_interval
+    )
+    live_worker_ids = [
+        w["_id"]
+        async for w in db[JOB_WORKERS_COLLECTION].find(
+            {"updated_at": {"$gte": cutoff}}, {"_id": 1}
+        )
+    ]
+    result = await db[JOBS_COLLECTION].update_many(
+        {
+            "status": {"$in": [JobStatus.queued.value, JobStatus.running.value]},
+            "worker_id": {"$nin": [WORKER_ID, *live_worker_ids]},
+        },
+        {
+            "$set": {
+                "status": JobStatus.failed.value,
+                "error": "The server stopped before the job finished",
+                "updated_at": datetime.utcnow(),
+                "finished_at": datetime.utcnow(),
+            }
+        },
+    )
+    await db[JOB_WORKERS_COLLECTION].delete_many({"updated_at": {"$lt": cutoff}})
+    if result.modified_count:
+        logger.info(f"Reaped {result.modified_count} jobs of stopped workers")
+    return result.modified_count
+
+
+async def run_job_heartbeat(db: AsyncIOMotorDatabase) -> None:
+    """Sends this worker's heartbeats and reaps the jobs of stopped workers."""
+    while True:
+        try:
+            await db[JOB_WORKERS_COLLECTION].update_one(
+                {"_id": WORKER_ID},
+                {
+                    "$set": {"updated_at": datetime.utcnow()},
+                    "$setOnInsert": {"host": socket.gethostname(), "pid": os.getpid()},
+                },
+                upsert=True,
+            )
+            await reap_orphaned_jobs(db)
+        except Exception as e:
+            logger.error(f"Job worker heartbeat failed: {e}")
+        await asyncio.sleep(settings.workers.heartbeat_interval)
+
+
+async def shutdown_jobs(db: AsyncIOMotorDatabase) -> None:
+    """Cancels jobs of this process on shutdown so they are not left as running."""
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await db[JOB_WORKERS_COLLECTION].delete_one({"_id": WORKER_ID})
@@ -1,5 +1,6 @@
 """Entry point of the QuickGraph server."""
 
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from typing import Dict
@@ -9,22 +10,30 @@ from fastapi.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from .dashboard.router import router as dashboard_router
-from .database import close_mongo_connection, connect_to_mongo
+from .database import close_mongo_connection, connect_to_mongo, get_client
+from .dataset.index import build_missing_token_indexes
 from .dataset.router import router as dataset_router
 from .dependencies import get_db
 from .graph.router import router as graph_router
+from .jobs.router import router as jobs_router
+from .jobs.services import run_job_heartbeat, shutdown_jobs
 from .markup.router import router as markup_router
+from .markup.snapshots import backfill_endpoint_snapshots
 from .notifications.router import router as notifications_router
 from .project.router import router as project_router
 from .resources.router import router as resources_router
+from .search.services import backfill_markup_terms
 from .settings import Settings, get_settings, settings
 from .social.router import router as social_router
 from .users.router import router as users_router
+from .utils.cache import run_cache_invalidation
+from .utils.context import DB_ROUND_TRIPS_HEADER, RequestContextMiddleware
 from .utils.system import (
     create_indexes,
     create_system_resources,
     create_system_datasets,
 )
+from .utils.workers import shutdown_process_pool
 
 logging.basicConfig(
     level=logging.INFO,
@@ -55,6 +64,26 @@ async def lifespan(app: FastAPI):  # type: ignore
     settings = get_settings()
     connect_to_mongo(uri=settings.mongodb.uri)
 
+    # Build the index catalog in the background; index builds on large collections
+    # should not delay the server from accepting requests.
+    db = get_client()[settings.mongodb.database_name]
+    index_task = asyncio.create_task(create_indexes(db))
+
+    # Build the token index of datasets created before it existed
+    token_index_task = asyncio.create_task(build_missing_token_indexes(db))
+
+    # Add endpoint snapshots to relations written before relations embedded them
+    snapshot_task = asyncio.create_task(backfill_endpoint_snapshots(db))
+
+    # Add search terms to entity markup written before entities held them
+    terms_task = asyncio.create_task(backfill_markup_terms(db))
+
+    # Keep cached projects, users and ontologies coherent with the database
+    cache_task = asyncio.create_task(run_cache_invalidation(db))
+
+    # Fail jobs left queued or running by workers that stopped, e.g. after a crash
+    heartbeat_task = asyncio.create_task(run_job_heartbeat(db))
+
     # Create system resources
     await create_system_resources()
 
@@ -64,6 +93,13 @@ async def lifespan(app: FastAPI):  # type: ignore
     try:
         yield
     finally:
+        for task in (index_task, token_index_task, snapshot_task, terms_task):
+            if not task.done():
+                task.cancel()
+        cache_task.cancel()
+        heartbeat_task.cancel()
+        await shutdown_jobs(db)
+        shutdown_process_pool()
         # Cleanup: close database connection
         close_mongo_connection()
         logger.info("Database connection closed")
@@ -82,6 +118,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[DB_ROUND_TRIPS_HEADER],
+)
+
+# Shares the project and user documents loaded by a request between its dependencies
+# and services, and counts its database round trips.
+app.add_middleware(
+    RequestContextMiddleware, report_round_trips=settings.api.debug_headers
 )
 
 
@@ -94,6 +137,7 @@ app.include_router(dashboard_router)
 app.include_router(graph_router)
 app.include_router(dataset_router)
 app.include_router(project_router)
+app.include_router(jobs_router)
 
 
 @app.get(f"{settings.api.prefix}/status")
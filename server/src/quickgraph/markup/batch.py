@@ -0,0 +1,431 @@
+"""Markup batches.
+
+A batch is an ordered list of markup operations by one annotator on one project. The
+operations are validated in order against the project's ontologies and the tokens of
+the project's dataset items, loaded once, and an in-memory copy of the annotator's
+markup on the dataset items they touch, so that each operation sees the effects of
+those before it, e.g. a relation between entities created earlier in the batch. Valid
+operations are written in one ordered `bulk_write`, inside a transaction where the
+deployment supports them; invalid operations are skipped and reported.
+
+Unlike the single markup routes, batches do not propagate markup across the dataset.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DeleteMany, DeleteOne, UpdateMany, UpdateOne
+from pymongo.errors import OperationFailure
+
+from ..resources.ontology import CompiledOntology
+from ..resources.services import get_project_compiled_ontologies
+from .schemas import (
+    AcceptOperation,
+    DeleteOperation,
+    EditOperation,
+    EntityOperation,
+    MarkupBatch,
+    OutMarkupBatch,
+    OutMarkupOperation,
+    RelationOperation,
+    RichCreateEntity,
+    RichCreateRelation,
+)
+from .snapshots import create_endpoint_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Error code of servers that do not support transactions (standalone servers)
+ILLEGAL_OPERATION = 20
+
+# Whether the server supports transactions; unknown until the first batch is written.
+_transactions_supported: Optional[bool] = None
+
+
+def parse_markup_id(markup_id: str) -> ObjectId:
+    try:
+        return ObjectId(markup_id)
+    except (InvalidId, TypeError):
+        raise ValueError(f"Invalid markup identifier: {markup_id}")
+
+
+class MarkupBatchWriter:
+    """Validates the operations of a batch and collects their writes."""
+
+    def __init__(
+        self,
+        project_id: ObjectId,
+        username: str,
+        ontologies: Dict[str, CompiledOntology],
+        markup: Dict[ObjectId, Dict[str, Any]],
+        tokens: Dict[ObjectId, List[str]],
+    ):
+        self.project_id = project_id
+        self.username = username
+        self.ontologies = ontologies
+        self.markup = markup
+        # Tokens of the project's dataset items that entity operations apply to
+        self.tokens = tokens
+        self.writes = []
+        self.dataset_item_ids: Set[ObjectId] = set()
+        # Entity ids by the index of the operation that created or matched them
+        self.references: Dict[int, ObjectId] = {}
+
+    def check_ontology_item(self, classification: str, ontology_item_id: str) -> None:
+        ontology = self.ontologies.get(classification)
+        if ontology is None or ontology_item_id not in ontology:
+            raise ValueError("Ontology item not found")
+        if not ontology.details[ontology_item_id]["active"]:
+            raise ValueError("Ontology item is not active")
+
+    def find_markup(self, markup_id: str) -> Dict[str, Any]:
+        markup = self.markup.get(parse_markup_id(markup_id))
+        if markup is None:
+            raise ValueError("Markup not found")
+        return markup
+
+    def find_entity(self, reference: str) -> Dict[str, Any]:
+        """Finds an entity by identifier or by `$<index>` reference."""
+        if reference.startswith("$"):
+            entity_id = self.references.get(
+                int(reference[1:]) if reference[1:].isdigit() else None
+            )
+            if entity_id is None:
+                raise ValueError(f"No entity was created by operation {reference[1:]}")
+            entity = self.markup.get(entity_id)
+        else:
+            entity = self.markup.get(parse_markup_id(reference))
+        if entity is None or entity["classification"] != "entity":
+            raise ValueError("Entity not found")
+        return entity
+
+    def find_relations(self, entity_id: ObjectId) -> List[Dict[str, Any]]:
+        return [
+            m
+            for m in self.markup.values()
+            if m["classification"] == "relation"
+            and entity_id in (m["source_id"], m["target_id"])
+        ]
+
+    def upsert(self, criteria: Dict[str, Any], markup: Dict[str, Any]) -> ObjectId:
+        """Writes new markup, or overwrites the markup matching `criteria` while keeping
+        its creation time."""
+        existing = next(
+            (
+                m
+                for m in self.markup.values()
+                if all(m.get(field) == value for field, value in criteria.items())
+            ),
+            None,
+        )
+        markup_id = ObjectId() if existing is None else existing["_id"]
+        fields = {k: v for k, v in markup.items() if k != "created_at"}
+        self.writes.append(
+            UpdateOne(
+                {
+                    "project_id": self.project_id,
+                    "created_by": self.username,
+                    **criteria,
+                },
+                {
+                    "$set": fields,
+                    "$setOnInsert": {
+                        "_id": markup_id,
+                        "created_at": markup["created_at"],
+                    },
+                },
+                upsert=True,
+            )
+        )
+        self.markup[markup_id] = {**markup, "_id": markup_id}
+        if existing is not None:
+            self.markup[markup_id]["created_at"] = existing.get("created_at")
+        self.dataset_item_ids.add(markup["dataset_item_id"])
+        return markup_id
+
+    def create_entity(
+        self, index: int, operation: EntityOperation
+    ) -> Tuple[List[ObjectId], List[ObjectId]]:
+        content = operation.content
+        self.check_ontology_item("entity", content.ontology_item_id)
+        dataset_item_id = parse_markup_id(operation.dataset_item_id)
+        tokens = self.tokens.get(dataset_item_id)
+        if tokens is None:
+            raise ValueError("Dataset item not found")
+        if not 0 <= content.start <= content.end < len(tokens):
+            raise ValueError("Entity span is outside of the dataset item")
+        entity = RichCreateEntity(
+            **content.model_dump(exclude={"surface_form"}),
+            surface_form=" ".join(tokens[content.start : content.end + 1]),
+            project_id=self.project_id,
+            dataset_item_id=dataset_item_id,
+            created_by=self.username,
+            suggested=operation.suggested,
+        ).model_dump()
+        entity_id = self.upsert(
+            {
+                "dataset_item_id": dataset_item_id,
+                "classification": "entity",
+                "start": content.start,
+                "end": content.end,
+                "ontology_item_id": content.ontology_item_id,
+            },
+            entity,
+        )
+        self.references[index] = entity_id
+        return [entity_id], []
+
+    def create_relation(
+        self, index: int, operation: RelationOperation
+    ) -> Tuple[List[ObjectId], List[ObjectId]]:
+        content = operation.content
+        self.check_ontology_item("relation", content.ontology_item_id)
+        source = self.find_entity(content.source_id)
+        target = self.find_entity(content.target_id)
+        if source["_id"] == target["_id"]:
+            raise ValueError("Relation source and target are the same entity")
+        if source["dataset_item_id"] != target["dataset_item_id"]:
+            raise ValueError(
+                "Relation source and target are on different dataset items"
+            )
+        relation = RichCreateRelation(
+            ontology_item_id=content.ontology_item_id,
+            source_id=source["_id"],
+            target_id=target["_id"],
+            source=create_endpoint_snapshot(source),
+            target=create_endpoint_snapshot(target),
+            project_id=self.project_id,
+            dataset_item_id=source["dataset_item_id"],
+            created_by=self.username,
+            suggested=operation.suggested,
+        ).model_dump()
+        relation_id = self.upsert(
+            {
+                "dataset_item_id": source["dataset_item_id"],
+                "source_id": source["_id"],
+                "target_id": target["_id"],
+                "ontology_item_id": content.ontology_item_id,
+            },
+            relation,
+        )
+        return [], [relation_id]
+
+    def accept(
+        self, index: int, operation: AcceptOperation
+    ) -> Tuple[List[ObjectId], List[ObjectId]]:
+        markup = self.find_markup(operation.markup_id)
+        if markup["classification"] == "relation":
+            # Relations are accepted with their entities.
+            entity_ids = [markup["source_id"], markup["target_id"]]
+            relation_ids = [markup["_id"]]
+        else:
+            entity_ids = [markup["_id"]]
+            relation_ids = []
+        accepted_ids = [i for i in entity_ids + relation_ids if i in self.markup]
+        self.writes.append(
+            UpdateMany({"_id": {"$in": accepted_ids}}, {"$set": {"suggested": False}})
+        )
+        for markup_id in accepted_ids:
+            self.markup[markup_id]["suggested"] = False
+        self.dataset_item_ids.add(markup["dataset_item_id"])
+        return entity_ids, relation_ids
+
+    def delete(
+        self, index: int, operation: DeleteOperation
+    ) -> Tuple[List[ObjectId], List[ObjectId]]:
+        markup = self.find_markup(operation.markup_id)
+        if markup["classification"] == "entity":
+            # Relations are deleted with their entities.
+            entity_ids = [markup["_id"]]
+            relation_ids = [r["_id"] for r in self.find_relations(markup["_id"])]
+            self.writes.append(DeleteMany({"_id": {"$in": entity_ids + relation_ids}}))
+        else:
+            entity_ids = []
+            relation_ids = [markup["_id"]]
+            self.writes.append(DeleteOne({"_id": markup["_id"]}))
+        for markup_id in entity_ids + relation_ids:
+            del self.markup[markup_id]
+        self.dataset_item_ids.add(markup["dataset_item_id"])
+        return entity_ids, relation_ids
+
+    def edit(
+        self, index: int, operation: EditOperation
+    ) -> Tuple[List[ObjectId], List[ObjectId]]:
+        entity = self.find_markup(operation.markup_id)
+        if entity["classification"] != "entity":
+            raise ValueError("Only entity markup can be edited")
+        self.check_ontology_item("entity", operation.ontology_item_id)
+        if any(
+            m["classification"] == "entity"
+            and m["dataset_item_id"] == entity["dataset_item_id"]
+            and m["start"] == entity["start"]
+            and m["end"] == entity["end"]
+            and m["ontology_item_id"] == operation.ontology_item_id
+            for m in self.markup.values()
+        ):
+            raise ValueError("Markup already exists")
+
+        entity["ontology_item_id"] = operation.ontology_item_id
+        self.writes.append(
+            UpdateOne(
+                {"_id": entity["_id"]},
+                {"$set": {"ontology_item_id": operation.ontology_item_id}},
+            )
+        )
+        # Refresh the endpoint snapshots of the entity's relations.
+        snapshot = create_endpoint_snapshot(entity)
+        for relation in self.find_relations(entity["_id"]):
+            for endpoint in ("source", "target"):
+                if relation[f"{endpoint}_id"] == entity["_id"]:
+                    relation[endpoint] = snapshot
+                    self.writes.append(
+                        UpdateOne(
+                            {"_id": relation["_id"]}, {"$set": {endpoint: snapshot}}
+                        )
+                    )
+        self.dataset_item_ids.add(entity["dataset_item_id"])
+        return [entity["_id"]], []
+
+    def apply(self, index: int, operation) -> OutMarkupOperation:
+        handler = {
+            "entity": self.create_entity,
+            "relation": self.create_relation,
+            "accept": self.accept,
+            "delete": self.delete,
+            "edit": self.edit,
+        }[operation.op]
+        try:
+            entity_ids, relation_ids = handler(index, operation)
+        except ValueError as e:
+            return OutMarkupOperation(
+                index=index, op=operation.op, applied=False, detail=str(e)
+            )
+        return OutMarkupOperation(
+            index=index,
+            op=operation.op,
+            applied=True,
+            entity_ids=[str(i) for i in entity_ids],
+            relation_ids=[str(i) for i in relation_ids],
+        )
+
+
+async def find_batch_markup(
+    db: AsyncIOMotorDatabase, project_id: ObjectId, username: str, batch: MarkupBatch
+) -> Tuple[Dict[ObjectId, Dict[str, Any]], Dict[ObjectId, List[str]]]:
+    """Finds a user's markup on the dataset items touched by a batch.
+
+    Returns:
+        The markup by identifier, and the tokens of the project's dataset items that
+        entity operations apply to. Items of other projects are left out, so entity
+        operations on them are rejected.
+    """
+    entity_item_ids = set()
+    markup_ids = set()
+    for operation in batch.operations:
+        try:
+            if isinstance(operation, EntityOperation):
+                entity_item_ids.add(ObjectId(operation.dataset_item_id))
+            elif isinstance(operation, RelationOperation):
+                markup_ids.update(
+                    ObjectId(i)
+                    for i in (operation.content.source_id, operation.content.target_id)
+                    if not i.startswith("$")
+                )
+            else:
+                markup_ids.add(ObjectId(operation.markup_id))
+        except (InvalidId, TypeError):
+            # Reported when the operation is applied
+            continue
+
+    tokens = {}
+    if entity_item_ids:
+        tokens = {
+            di["_id"]: di["tokens"]
+            async for di in db["data"].find(
+                {"_id": {"$in": list(entity_item_ids)}, "project_id": project_id},
+                {"tokens": 1},
+            )
+        }
+
+    _filter = {"project_id": project_id, "created_by": username}
+    dataset_item_ids = set(tokens)
+    if markup_ids:
+        dataset_item_ids.update(
+            m["dataset_item_id"]
+            async for m in db["markup"].find(
+                {**_filter, "_id": {"$in": list(markup_ids)}}, {"dataset_item_id": 1}
+            )
+        )
+    if len(dataset_item_ids) == 0:
+        return {}, tokens
+    markup = {
+        m["_id"]: m
+        async for m in db["markup"].find(
+            {**_filter, "dataset_item_id": {"$in": list(dataset_item_ids)}}
+        )
+    }
+    return markup, tokens
+
+
+async def write_markup(db: AsyncIOMotorDatabase, writes: List[Any]) -> None:
+    """Writes markup operations in order, within a transaction if supported."""
+    global _transactions_supported
+    if _transactions_supported is not False:
+        try:
+            async with await db.client.start_session() as session:
+                async with session.start_transaction():
+                    await db["markup"].bulk_write(writes, ordered=True, session=session)
+            _transactions_supported = True
+            return
+        except OperationFailure as e:
+            if e.code != ILLEGAL_OPERATION or _transactions_supported:
+                raise
+            logger.info(
+                f"Transactions unavailable ({e}); writing markup batches without"
+            )
+            _transactions_supported = False
+    await db["markup"].bulk_write(writes, ordered=True)
+
+
+async def apply_markup_batch(
+    db: AsyncIOMotorDatabase, project_id: ObjectId, batch: MarkupBatch, username: str
+) -> Tuple[OutMarkupBatch, List[ObjectId]]:
+    """Applies a batch of markup operations.
+
+    Returns:
+        The result of each operation and the dataset items whose markup changed.
+    """
+    ontologies = await get_project_compiled_ontologies(db=db, project_id=project_id)
+    markup, tokens = await find_batch_markup(
+        db=db, project_id=project_id, username=username, batch=batch
+    )
+    writer = MarkupBatchWriter(
+        project_id=project_id,
+        username=username,
+        ontologies=ontologies,
+        markup=markup,
+        tokens=tokens,
+    )
+    results = [
+        writer.apply(index, operation)
+        for index, operation in enumerate(batch.operations)
+    ]
+
+    if writer.writes:
+        try:
+            await write_markup(db=db, writes=writer.writes)
+        except OperationFailure as e:
+            logger.error(f"Failed to write markup batch of project {project_id}: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Unable to apply markup batch",
+            )
+
+    return (
+        OutMarkupBatch(count=sum(r.applied for r in results), results=results),
+        list(writer.dataset_item_ids),
+    )
@@ -6,17 +6,26 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import JSONResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
-from ..dependencies import get_db, get_user
-from ..project.schemas import Flag, FlagState, OntologyItem
-from ..resources.services import get_project_ontology_items
+from ..dashboard.stats import (
+    mark_dataset_item_project_stats_stale,
+    mark_project_stats_stale,
+)
+from ..dependencies import get_active_project_user, get_db, get_user
+from ..graph.projection import update_project_graph
+from ..project.schemas import Flag, FlagState
+from ..project.services import refresh_item_iaa
+from ..resources.services import get_project_compiled_ontologies
 from ..users.schemas import UserDocumentModel
-from ..utils.misc import flatten_hierarchical_ontology
+from .batch import apply_markup_batch
 from .schemas import (
     CreateMarkupApply,
+    MarkupBatch,
     MarkupEditBody,
     OutMarkupAccept,
+    OutMarkupBatch,
 )
 from .services import accept_annotation, apply_annotation, delete_annotation
+from .snapshots import refresh_endpoint_snapshots
 from ..settings import settings
 
 logger = logging.getLogger(__name__)
@@ -47,9 +56,61 @@ async def create_markup_endpoint(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Unable to apply markup",
         )
+    if markup.dataset_item_id:
+        await refresh_item_iaa(
+            db=db,
+            dataset_item_id=ObjectId(markup.dataset_item_id),
+            username=user.username,
+        )
+    await mark_project_stats_stale(db=db, project_id=ObjectId(markup.project_id))
+    await update_project_graph(
+        db=db,
+        project_id=ObjectId(markup.project_id),
+        dataset_item_ids=(
+            None
+            if apply_all or not markup.dataset_item_id
+            else [ObjectId(markup.dataset_item_id)]
+        ),
+    )
     return annotations.model_dump(by_alias=False)
 
 
+@router.post(
+    "/batch/{project_id}",
+    response_description="Apply a batch of markup operations",
+    response_model=OutMarkupBatch,
+)
+async def apply_markup_batch_endpoint(
+    project_id: str,
+    batch: MarkupBatch,
+    user: UserDocumentModel = Depends(get_active_project_user),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """Apply an ordered batch of markup operations to a project's dataset items.
+
+    Operations that cannot be applied are skipped and reported in their result.
+    """
+    if len(batch.operations) > settings.api.max_markup_batch:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batches are limited to {settings.api.max_markup_batch} operations",
+        )
+    project_id = ObjectId(project_id)
+    result, dataset_item_ids = await apply_markup_batch(
+        db=db, project_id=project_id, batch=batch, username=user.username
+    )
+    if dataset_item_ids:
+        for dataset_item_id in dataset_item_ids:
+            await refresh_item_iaa(
+                db=db, dataset_item_id=dataset_item_id, username=user.username
+            )
+        await mark_project_stats_stale(db=db, project_id=project_id)
+        await update_project_graph(
+            db=db, project_id=project_id, dataset_item_ids=dataset_item_ids
+        )
+    return result
+
+
 @router.patch(
     "/{markup_id}",
     response_description="Accept one or more markup",
@@ -73,6 +134,16 @@ async def update_markup(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Unable to accept markup",
         )
+    markup = await db.markup.find_one(
+        {"_id": ObjectId(markup_id)}, {"dataset_item_id": 1, "project_id": 1}
+    )
+    if markup:
+        await mark_project_stats_stale(db=db, project_id=markup["project_id"])
+        await update_project_graph(
+            db=db,
+            project_id=markup["project_id"],
+            dataset_item_ids=None if apply_all else [markup["dataset_item_id"]],
+        )
     return annotations
 
 
@@ -87,12 +158,26 @@ async def delete_markup(
     user: UserDocumentModel = Depends(get_user),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    return await delete_annotation(
+    markup = await db.markup.find_one(
+        {"_id": ObjectId(markup_id)}, {"dataset_item_id": 1, "project_id": 1}
+    )
+    annotations = await delete_annotation(
         db=db,
         markup_id=ObjectId(markup_id),
         username=user.username,
         apply_all=apply_all,
     )
+    if markup and annotations:
+        await refresh_item_iaa(
+            db=db, dataset_item_id=markup["dataset_item_id"], username=user.username
+        )
+        await mark_project_stats_stale(db=db, project_id=markup["project_id"])
+        await update_project_graph(
+            db=db,
+            project_id=markup["project_id"],
+            dataset_item_ids=None if apply_all else [markup["dataset_item_id"]],
+        )
+    return annotations
 
 
 @router.patch("/edit/{markup_id}")
@@ -130,22 +215,12 @@ async def edit_existing_markup(
             detail="Markup already exists",
         )
 
-    project = await db.projects.find_one(
-        {"_id": markup["project_id"]}, {"entity_ontology_id": 1}
-    )
-
-    entity_ontology = await db.resources.find_one(
-        {"_id": project["entity_ontology_id"]}
-    )
+    entity_ontology = (
+        await get_project_compiled_ontologies(db=db, project_id=markup["project_id"])
+    )["entity"]
 
     # Check `ontology_item_id` exists
-    flat_ontology = flatten_hierarchical_ontology(
-        [OntologyItem(**i) for i in entity_ontology["content"]]
-    )
-
-    ontology_item = [i for i in flat_ontology if i.id == body.ontology_item_id]
-
-    if len(ontology_item) == 0:
+    if body.ontology_item_id not in entity_ontology:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Ontology item not found",
@@ -156,7 +231,19 @@ async def edit_existing_markup(
     )
 
     if result.modified_count == 1:
-        ontology_item_details = ontology_item[0]
+        await refresh_endpoint_snapshots(db=db, entity_ids=[markup_id])
+        await refresh_item_iaa(
+            db=db,
+            dataset_item_id=markup["dataset_item_id"],
+            username=current_user.username,
+        )
+        await mark_project_stats_stale(db=db, project_id=markup["project_id"])
+        await update_project_graph(
+            db=db,
+            project_id=markup["project_id"],
+            dataset_item_ids=[markup["dataset_item_id"]],
+        )
+        ontology_item_details = entity_ontology.details[body.ontology_item_id]
         # logger.info("ontology_item_details", ontology_item_details)
 
         updated_markup = {
@@ -167,12 +254,12 @@ async def edit_existing_markup(
                 {
                     "id": str(markup_id),
                     "ontology_item_id": body.ontology_item_id,
-                    "name": ontology_item_details.name,
-                    "fullname": ontology_item_details.fullname,
-                    "color": ontology_item_details.color,
+                    "name": ontology_item_details["name"],
+                    "fullname": ontology_item_details["fullname"],
+                    "color": ontology_item_details["color"],
                 }
             ],
-            "label_name": ontology_item_details.name,
+            "label_name": ontology_item_details["name"],
         }
         return updated_markup
     raise HTTPException(
@@ -219,6 +306,8 @@ async def create_one_flag(
     )
 
     if result.modified_count > 0:
+        if dataset_item.get("project_id"):
+            await mark_project_stats_stale(db=db, project_id=dataset_item["project_id"])
         # TODO: update this route to use response_model
         return new_flag.model_dump()
     else:
@@ -257,6 +346,9 @@ async def delete_one_flag(
 
     # Check if the update was successful
     if result.modified_count > 0:
+        await mark_dataset_item_project_stats_stale(
+            db=db, dataset_item_id=dataset_item_id
+        )
         return "Flag item deleted from dataset item"
     else:
         raise HTTPException(
@@ -326,15 +418,16 @@ async def get_annotation_insights(
 
     result = await db.markup.aggregate(pipeline).to_list(None)
 
-    entity_ontology, _, _ = await get_project_ontology_items(
-        db=db, project_id=project_id
-    )
-
-    flat_ontology = flatten_hierarchical_ontology(ontology=entity_ontology)
-
+    entity_ontology = (
+        await get_project_compiled_ontologies(db=db, project_id=project_id)
+    )["entity"]
     ontology_meta_map = {
-        i.id: {"color": i.color, "name": i.name, "fullname": i.fullname}
-        for i in flat_ontology
+        item_id: {
+            "color": details["color"],
+            "name": details["name"],
+            "fullname": details["fullname"],
+        }
+        for item_id, details in entity_ontology.details.items()
     }
 
     destructured_result = result[0]["result"][0]
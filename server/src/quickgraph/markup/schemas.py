@@ -2,11 +2,13 @@
 
 from datetime import datetime
 from enum import Enum
-from typing import List, Optional, Union
+from typing import List, Literal, Optional, Union
 
 from bson import ObjectId
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, computed_field
+from typing_extensions import Annotated
 
+from ..dataset.index import surface_form_terms
 from ..utils.schemas import PydanticObjectIdAnnotated
 
 
@@ -55,6 +57,11 @@ class RichCreateEntity(CreateEntity):
         description="Flag indicating whether markup is a blueprint (copiable)",
     )
 
+    @computed_field(description="Normalized words of the surface form, for search")
+    @property
+    def terms(self) -> List[str]:
+        return surface_form_terms(self.surface_form)
+
     model_config = ConfigDict(arbitrary_types_allowed=True, use_enum_values=True)
 
 
@@ -114,9 +121,28 @@ class EntityMarkup(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True, populate_by_name=True)
 
 
+class RelationEndpoint(BaseModel):
+    """Snapshot of a relation's source or target entity."""
+
+    start: int = Field(description="Index of entity span token start", ge=0)
+    end: int = Field(description="Index of entity span token end", ge=0)
+    ontology_item_id: str = Field(
+        description="Identifier of entity label associated with project ontology"
+    )
+    surface_form: str = Field(
+        description="Surface form of entity e.g. its span of text"
+    )
+
+
 class Relation(BaseMarkup):
     source_id: PydanticObjectIdAnnotated = Field(default_factory=ObjectId)
     target_id: PydanticObjectIdAnnotated = Field(default_factory=ObjectId)
+    source: Optional[RelationEndpoint] = Field(
+        default=None, description="Snapshot of the source entity"
+    )
+    target: Optional[RelationEndpoint] = Field(
+        default=None, description="Snapshot of the target entity"
+    )
     suggested: bool = Field(
         description="Flag indicating whether markup is to be suggested (weak) or not (silver)"
     )
@@ -161,6 +187,8 @@ class RichCreateRelation(CreateRelation):
     target_id: PydanticObjectIdAnnotated = Field(
         description="Identifier associated with target entity"
     )
+    source: RelationEndpoint = Field(description="Snapshot of the source entity")
+    target: RelationEndpoint = Field(description="Snapshot of the target entity")
     project_id: PydanticObjectIdAnnotated | None = Field(
         description="Identifier of project associated with markup",
     )
@@ -327,6 +355,95 @@ class OutMarkupAccept(BaseModel):
     model_config = ConfigDict(use_enum_values=True)
 
 
+class EntityOperation(BaseModel):
+    """Operation creating an entity."""
+
+    op: Literal["entity"]
+    dataset_item_id: str = Field(
+        description="Identifier of dataset item markup will be applied to"
+    )
+    suggested: bool = Field(
+        default=False,
+        description="Flag indicating whether markup is to be suggested (weak) or not (silver)",
+    )
+    content: CreateEntity
+
+
+class RelationOperation(BaseModel):
+    """Operation creating a relation between two entities of a dataset item.
+
+    `source_id` and `target_id` are markup identifiers or `$<index>`, the entity created
+    or matched by an earlier entity operation of the batch.
+    """
+
+    op: Literal["relation"]
+    suggested: bool = Field(
+        default=False,
+        description="Flag indicating whether markup is to be suggested (weak) or not (silver)",
+    )
+    content: CreateRelation
+
+
+class AcceptOperation(BaseModel):
+    """Operation accepting suggested markup."""
+
+    op: Literal["accept"]
+    markup_id: str = Field(description="Identifier of markup to accept")
+
+
+class DeleteOperation(BaseModel):
+    """Operation deleting markup, and the relations of a deleted entity."""
+
+    op: Literal["delete"]
+    markup_id: str = Field(description="Identifier of markup to delete")
+
+
+class EditOperation(BaseModel):
+    """Operation changing the label of an entity."""
+
+    op: Literal["edit"]
+    markup_id: str = Field(description="Identifier of entity markup to edit")
+    ontology_item_id: str = Field(
+        description="The ID that will be assigned to the markup"
+    )
+
+
+MarkupOperation = Annotated[
+    Union[
+        EntityOperation,
+        RelationOperation,
+        AcceptOperation,
+        DeleteOperation,
+        EditOperation,
+    ],
+    Field(discriminator="op"),
+]
+
+
+class MarkupBatch(BaseModel):
+    operations: List[MarkupOperation] = Field(
+        description="Markup operations, applied in order"
+    )
+
+
+class OutMarkupOperation(BaseModel):
+    index: int = Field(description="Position of the operation in the batch")
+    op: str
+    applied: bool = Field(
+        description="Flag indicating whether the operation was applied"
+    )
+    detail: Optional[str] = Field(
+        default=None, description="Reason the operation was not applied"
+    )
+    entity_ids: List[str] = Field(default_factory=list)
+    relation_ids: List[str] = Field(default_factory=list)
+
+
+class OutMarkupBatch(BaseModel):
+    count: int = Field(description="Number of operations applied")
+    results: List[OutMarkupOperation]
+
+
 class SurfaceForm(BaseModel):
     surface_form: str
     count: int
@@ -2,7 +2,6 @@
 
 import itertools
 import logging
-import re
 import traceback
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
@@ -11,6 +10,11 @@ from bson import ObjectId
 from fastapi import HTTPException, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from ..dataset.index import (
+    find_phrase_pair_spans,
+    find_phrase_spans,
+    surface_form_terms,
+)
 from ..project.schemas import OntologyItem
 from ..project.services import find_one_project
 from .schemas import (
@@ -28,7 +32,8 @@ from .schemas import (
     RichCreateEntity,
     RichCreateRelation,
 )
-from .utils import find_ontology_item_by_id, find_sub_lists, get_entity_offset
+from .snapshots import attach_endpoint_snapshots, find_endpoint_snapshots
+from .utils import find_ontology_item_by_id, get_entity_offset
 
 logger = logging.getLogger(__name__)
 
@@ -87,6 +92,16 @@ async def apply_single_relation_annotation(
     """
     logger.info("applying single relation annotation")
 
+    try:
+        source, target = await find_endpoint_snapshots(
+            db=db,
+            source_id=ObjectId(markup.content.source_id),
+            target_id=ObjectId(markup.content.target_id),
+        )
+    except ValueError as e:
+        logger.warning(f"Unable to apply relation: {e}")
+        return None
+
     filter_criteria = {
         "project_id": ObjectId(markup.project_id),
         "dataset_item_id": ObjectId(markup.dataset_item_id),
@@ -100,6 +115,8 @@ async def apply_single_relation_annotation(
         ontology_item_id=markup.content.ontology_item_id,
         source_id=ObjectId(markup.content.source_id),
         target_id=ObjectId(markup.content.target_id),
+        source=source,
+        target=target,
         project_id=ObjectId(markup.project_id),
         dataset_item_id=ObjectId(markup.dataset_item_id),
         created_at=datetime.utcnow(),
@@ -149,137 +166,6 @@ async def apply_many_relation_annotations(
     logger.info("source_entity_surface_form", source_entity_surface_form)
     logger.info("target_entity_surface_form", target_entity_surface_form)
 
-    # src_tokens = source_entity["surface_form"].split(" ")
-    # tgt_tokens = target_entity["surface_form"].split(" ")
-
-    # logger.info("src_tokens", src_tokens)
-    # logger.info("tgt_tokens", tgt_tokens)
-
-    # # NEW CODE - AGG PIPELINE
-    # pipeline = [
-    #     {"$match": {"tokens": {"$all": [src_tokens, tgt_tokens]}}},
-    #     {
-    #         "$project": {
-    #             "_id": 1,
-    #             "matches": {
-    #                 "$reduce": {
-    #                     "input": {
-    #                         "$range": [0, {"$subtract": [{"$size": "$tokens"}, 1]}]
-    #                     },
-    #                     "initialValue": [],
-    #                     "in": {
-    #                         "$concatArrays": [
-    #                             "$$value",
-    #                             {
-    #                                 "$cond": {
-    #                                     "if": {
-    #                                         "$and": [
-    #                                             {
-    #                                                 "$eq": [
-    #                                                     {
-    #                                                         "$slice": [
-    #                                                             "$tokens",
-    #                                                             "$$this",
-    #                                                             2,
-    #                                                         ]
-    #                                                     },
-    #                                                     [src_tokens, tgt_tokens],
-    #                                                 ]
-    #                                             },
-    #                                             {
-    #                                                 "$not": {
-    #                                                     "$in": [
-    #                                                         {
-    #                                                             "$concat": [
-    #                                                                 {
-    #                                                                     "$toString": "$$this"
-    #                                                                 },
-    #                                                                 "-",
-    #                                                                 {
-    #                                                                     "$toString": {
-    #                                                                         "$add": [
-    #                                                                             "$$this",
-    #                                                                             1,
-    #                                                                         ]
-    #                                                                     }
-    #                                                                 },
-    #                                                             ]
-    #                                                         },
-    #                                                         {
-    #                                                             "$map": {
-    #                                                                 "input": "$$value",
-    #                                                                 "as": "v",
-    #                                                                 "in": {
-    #                                                                     "$concat": [
-    #                                                                         {
-    #                                                                             "$toString": "$$v.source"
-    #                                                                         },
-    #                                                                         "-",
-    #                                                                         {
-    #                                                                             "$toString": "$$v.target"
-    #                                                                         },
-    #                                                                     ]
-    #                                                                 },
-    #                                                             }
-    #                                                         },
-    #                                                     ]
-    #                                                 }
-    #                                             },
-    #                                         ]
-    #                                     },
-    #                                     "then": [
-    #                                         {
-    #                                             "source": "$$this",
-    #                                             "target": {"$add": ["$$this", 1]},
-    #                                         }
-    #                                     ],
-    #                                     "else": [],
-    #                                 }
-    #                             },
-    #                         ]
-    #                     },
-    #                 }
-    #             },
-    #         }
-    #     },
-    #     {"$match": {"matches": {"$ne": []}}},
-    #     {
-    #         "$project": {
-    #             "_id": 1,
-    #             "matches": {
-    #                 "$reduce": {
-    #                     "input": "$matches",
-    #                     "initialValue": [],
-    #                     "in": {
-    #                         "$concatArrays": [
-    #                             "$$value",
-    #                             [
-    #                                 {
-    #                                     "source": {
-    #                                         "start": "$$this.source",
-    #                                         "end": {"$add": ["$$this.source", 1]},
-    #                                     },
-    #                                     "target": {
-    #                                         "start": "$$this.target",
-    #                                         "end": {"$add": ["$$this.target", 1]},
-    #                                     },
-    #                                 }
-    #                             ],
-    #                         ]
-    #                     },
-    #                 }
-    #             },
-    #         }
-    #     },
-    # ]
-
-    # logger.info("pipeline\n", json.dumps(pipeline, indent=2, default=str))
-
-    # result = await db["data"].aggregate(pipeline).to_list(None)
-    # logger.info("aggregation result\n", json.dumps(result, indent=2, default=str))
-
-    # ----- OLD CODE ------
-
     lr_direction = source_entity["end"] <= target_entity["start"]
     logger.info(f"lr_direction: {lr_direction}")
 
@@ -287,58 +173,23 @@ async def apply_many_relation_annotations(
     # abs(target_entity["start"] - source_entity["end"]) - 1
     logger.info(f"OFFSET: {offset}")
 
-    # -- Find candidate dataset items
-    regx = re.compile(
-        rf"^(?=.*\b{re.escape(source_entity_surface_form)}\b)(?=.*\b{re.escape(target_entity_surface_form)}\b)",
-    )
-
-    # Focus dataset item id is always a candidate regardless of whether it is saved.
-    candidate_dataset_item_ids = (
-        await db["data"]
-        .find(
-            {
-                "dataset_id": dataset_id,
-                # "_id": {"$nin": saved_dataset_item_ids}, # TODO: do this in query ...
-                "text": {"$regex": regx},
-            }
-        )
-        .to_list(None)
+    # -- Find src/tgt token spans in candidate dataset items via the token index
+    #       - Offset of original markup needs to be preserved
+    #       - Direction of source and target needs to be preserved; left-right or right-left.
+    candidate_pairs = await find_phrase_pair_spans(
+        db=db,
+        dataset_id=dataset_id,
+        source_phrase=source_entity_surface_form.split(" "),
+        target_phrase=target_entity_surface_form.split(" "),
+        offset=offset,
+        lr_direction=lr_direction,
     )
 
-    logger.info(f"candidates found: {len(candidate_dataset_item_ids)}")
-
-    # -- Get src/tgt token spans in matched dataset items
-    #       - Offset of original markup needs to be preserved
-    #       - Direction of source and target needs to be preserver; left-right or right-left. TODO: Investigate this. Should this be enforced?
-    source_tokens_to_match = source_entity_surface_form.split(" ")
-    target_tokens_to_match = target_entity_surface_form.split(" ")
+    logger.info(f"candidates found: {len(candidate_pairs)}")
 
     new_markup = {"entity": [], "relation": []}
-    for dataset_item in candidate_dataset_item_ids:
-        dataset_item_id = str(dataset_item["_id"])
-
-        # Identify matching markup span(s)
-        candidate_src_token_spans = find_sub_lists(
-            source_tokens_to_match, dataset_item["tokens"]
-        )
-        # logger.info("candidate_src_token_spans", candidate_src_token_spans)
-
-        candidate_tgt_token_spans = find_sub_lists(
-            target_tokens_to_match, dataset_item["tokens"]
-        )
-        # logger.info("candidate_tgt_token_spans", candidate_tgt_token_spans)
-
-        # Create pairs between src/tgts and filter out src/tgt spans that are offset the same as the focus
-        # first tuple item is src, second is tgt
-        _pairs = [
-            p
-            for p in list(
-                itertools.product(candidate_src_token_spans, candidate_tgt_token_spans)
-            )
-            if abs(p[1][0] - p[0][1]) - 1 == offset
-        ]
-
-        # logger.info("_pairs", _pairs)
+    for _dataset_item_id, _pairs in candidate_pairs.items():
+        dataset_item_id = str(_dataset_item_id)
 
         # Create entities and relation for matched pairs
 
@@ -551,256 +402,81 @@ async def apply_many_entity_annotations(
         - Entity that apply action is applied to is set as accepted by default; others are suggested.
         - If dataset_item is `saved` then markup will not be created
     """
-    logger.info("Markup: {markup}")
-
-    # markup.dataset_item_id
+    logger.info(f"Markup: {markup}")
 
     tokens_to_match = markup.content.surface_form.split(" ")
+    focus_dataset_item_id = ObjectId(markup.dataset_item_id)
 
-    # This line of code creates a regular expression pattern for matching the "surface_form" attribute of a markup object, which represents the surface form of a piece of text. The regular expression uses a negative lookbehind assertion to ensure that the pattern is not preceded by a non-whitespace character, and a negative lookahead assertion to ensure that the pattern is not followed by a non-whitespace character. This ensures that the pattern only matches the "surface_form" attribute when it is a standalone word or phrase. The `re.escape` function is used to escape any special characters in the "surface_form" attribute, to prevent them from being interpreted as part of the regular expression syntax.
-    surface_form_escaped = (
-        r"(?<!\S)" + re.escape(markup.content.surface_form) + r"(?!\S)"
+    # Candidate spans come from intersecting the posting lists of the surface form tokens.
+    spans = await find_phrase_spans(
+        db=db, dataset_id=ObjectId(dataset_id), phrase=tokens_to_match
     )
+    if len(spans) == 0:
+        return []
 
-    pipeline = [
-        # $or doesn't protect the focus dataset item the action originated from.
-        {
-            "$match": {
-                "text": {"$regex": surface_form_escaped},
-                "dataset_id": ObjectId(dataset_id),
-                "$or": [
-                    {
-                        "save_states": {
-                            "$not": {"$elemMatch": {"created_by": {"$eq": username}}}
-                        }
-                    },
-                    {"_id": ObjectId(markup.dataset_item_id)},
-                ],
-                # "$or": [
-                #     {
-                #         "dataset_item_id": ObjectId(markup.dataset_item_id),
-                #         "text": {"$regex": surface_form_escaped},
-                #         "dataset_id": ObjectId(dataset_id),
-                #     },
-                #     {
-                #         "dataset_item_id": {"$ne": id},
-                #         "text": {"$regex": surface_form_escaped},
-                #         "dataset_id": ObjectId(dataset_id),
-                #         "save_states.created_by": {"$ne": username},
-                #     },
-                # ]
-            },
-        },
-        {
-            "$project": {
-                "_id": 1,
-                "tokens": 1,
-                "dataset_item_id": 1,
-            },
-        },
-        {
-            "$addFields": {
-                "spans": {
-                    "$reduce": {
-                        "input": {
-                            "$range": [
-                                0,
-                                {
-                                    "$size": "$tokens",
-                                },
-                            ],
-                        },
-                        "initialValue": [],
-                        "in": {
-                            "$cond": {
-                                "if": {
-                                    "$eq": [
-                                        {
-                                            "$slice": [
-                                                "$tokens",
-                                                "$$this",
-                                                len(tokens_to_match),
-                                            ],
-                                        },
-                                        tokens_to_match,
-                                    ],
-                                },
-                                "then": {
-                                    "$concatArrays": [
-                                        "$$value",
-                                        [
-                                            {
-                                                "start": "$$this",
-                                                "end": {
-                                                    "$add": [
-                                                        "$$this",
-                                                        (
-                                                            0
-                                                            if len(tokens_to_match) == 1
-                                                            else len(tokens_to_match)
-                                                            - 1
-                                                        ),
-                                                    ]
-                                                },
-                                            },
-                                        ],
-                                    ],
-                                },
-                                "else": "$$value",
-                            },
-                        },
-                    },
-                },
+    # Items saved by the user are excluded, apart from the focus item the action originated from.
+    saved_dataset_item_ids = {
+        di["_id"]
+        async for di in db.data.find(
+            {
+                "_id": {"$in": list(spans.keys()), "$ne": focus_dataset_item_id},
+                "save_states.created_by": username,
             },
-        },
-        # Add 'suggested' field - this should be True for the span that initiated the propagation.
-        {
-            "$addFields": {
-                "spans": {
-                    "$map": {
-                        "input": "$spans",
-                        "in": {
-                            "$cond": [
-                                {
-                                    "$and": [
-                                        {
-                                            "$eq": [
-                                                "$$this.start",
-                                                markup.content.start,
-                                            ],
-                                        },
-                                        {"$eq": ["$$this.end", markup.content.end]},
-                                        {
-                                            "$eq": [
-                                                "$_id",
-                                                ObjectId(markup.dataset_item_id),
-                                            ]
-                                        },
-                                    ],
-                                },
-                                {
-                                    "start": "$$this.start",
-                                    "end": "$$this.end",
-                                    "suggested": False,
-                                },
-                                {
-                                    "start": "$$this.start",
-                                    "end": "$$this.end",
-                                    "suggested": True,
-                                },
-                            ],
-                        },
-                    },
+            {"_id": 1},
+        )
+    }
+
+    # Spans that already carry the same label are not duplicated.
+    existing_spans = {
+        (m["dataset_item_id"], m["start"], m["end"])
+        async for m in db.markup.find(
+            {
+                "dataset_item_id": {
+                    "$in": [i for i in spans if i not in saved_dataset_item_ids]
                 },
-            },
-        },
-        {
-            "$lookup": {
-                "from": "markup",
-                "localField": "_id",
-                "foreignField": "dataset_item_id",
-                "as": "markups",
-            },
-        },
-        {
-            "$project": {
-                "markups._id": 0,
-                "markups.dataset_item_id": 0,
-                "markups.project_id": 0,
-                "markups.created_at": 0,
-                "markups.surface_form": 0,
-                "markups.updated_at": 0,
-            },
-        },
-        {
-            "$addFields": {
-                "markups": {
-                    "$map": {
-                        "input": {
-                            "$filter": {
-                                "input": "$markups",
-                                "as": "markup",
-                                "cond": {
-                                    "$and": [
-                                        {
-                                            "$eq": [
-                                                "$$markup.ontology_item_id",
-                                                markup.content.ontology_item_id,
-                                            ]
-                                        },
-                                        {"$eq": ["$$markup.created_by", username]},
-                                    ]
-                                },
-                            }
-                        },
-                        "as": "markup",
-                        "in": {"start": "$$markup.start", "end": "$$markup.end"},
-                    }
-                }
-            }
-        },
-        {
-            "$addFields": {
-                "candidateSpans": {
-                    "$filter": {
-                        "input": "$spans",
-                        "as": "span",
-                        "cond": {
-                            "$not": {
-                                "$in": [
-                                    {"start": "$$span.start", "end": "$$span.end"},
-                                    "$markups",
-                                ]
-                            }
-                        },
-                    }
-                }
-            }
-        },
-        # Create new markup objects before $merge (upsert) into Markup collection
-        {
-            "$unwind": "$candidateSpans",
-        },
-        {
-            "$addFields": {
                 "created_by": username,
-                "dataset_item_id": "$_id",
-                "end": "$candidateSpans.end",
                 "ontology_item_id": markup.content.ontology_item_id,
-                "project_id": ObjectId(markup.project_id),  # TODO: handle this.
-                "start": "$candidateSpans.start",
-                "classification": "entity",
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow(),
-                "surface_form": " ".join(tokens_to_match),
-                "suggested": "$candidateSpans.suggested",
             },
-        },
-        {
-            "$project": {"_id": 0}
-        },  # Remove `dataset_id` otherwise it will be the markup id which is not unique for multiple markups on the same dataset item.
-        {
-            "$project": {
-                "tokens": 0,
-                "spans": 0,
-                "markups": 0,
-                "candidateSpans": 0,
-            }
-        },
-    ]
-    results = await db.data.aggregate(pipeline).to_list(None)
+            {"dataset_item_id": 1, "start": 1, "end": 1},
+        )
+    }
 
-    if len(results) == 0:
+    # Create new markup - the span that initiated the propagation is accepted, others are suggested.
+    new_markup = []
+    for dataset_item_id, item_spans in spans.items():
+        if dataset_item_id in saved_dataset_item_ids:
+            continue
+        for start, end in item_spans:
+            if (dataset_item_id, start, end) in existing_spans:
+                continue
+            new_markup.append(
+                {
+                    "_id": ObjectId(),
+                    "created_by": username,
+                    "dataset_item_id": dataset_item_id,
+                    "end": end,
+                    "ontology_item_id": markup.content.ontology_item_id,
+                    "project_id": ObjectId(markup.project_id),
+                    "start": start,
+                    "classification": "entity",
+                    "created_at": datetime.utcnow(),
+                    "updated_at": datetime.utcnow(),
+                    "surface_form": " ".join(tokens_to_match),
+                    "terms": surface_form_terms(" ".join(tokens_to_match)),
+                    "suggested": not (
+                        dataset_item_id == focus_dataset_item_id
+                        and start == markup.content.start
+                        and end == markup.content.end
+                    ),
+                }
+            )
+
+    if len(new_markup) == 0:
         return []
 
-    # Create entities from results of aggregation - In the future this will be done as part of the aggregation...
-    # Each item is given a unique ObjectId.
-    inserted_result = await db["markup"].insert_many(
-        [{**r, "_id": ObjectId()} for r in results]
-    )
-    inserted_ids = inserted_result.inserted_ids
+    await db["markup"].insert_many(new_markup)
 
-    return await db["markup"].find({"_id": {"$in": inserted_ids}}).to_list(None)
+    return new_markup
 
 
 async def get_project(db: AsyncIOMotorDatabase, project_id: str, username: str):
@@ -1471,81 +1147,57 @@ async def delete_many_relation_annotations(
 
     markup_is_suggested = markup["suggested"]
 
-    markup_src_entity = await find_one_markup(
-        db=db, markup_id=markup["source_id"], username=username
-    )
-    markup_tgt_entity = await find_one_markup(
-        db=db, markup_id=markup["target_id"], username=username
-    )
-
-    if markup_src_entity is None or markup_tgt_entity is None:
-        logger.warning("Source or target entity not found")
+    if len(await attach_endpoint_snapshots(db=db, relations=[markup])) == 0:
+        logger.warning("Relation source or target entity not found")
         return 0, {}
 
+    markup_src_entity = markup["source"]
+    markup_tgt_entity = markup["target"]
+
     offset = get_entity_offset(
         source_entity=markup_src_entity, target_entity=markup_tgt_entity
     )
 
-    # Build the aggregation pipeline
-    pipeline = [
-        {
-            "$match": {
+    # Relations embed snapshots of their source and target entities; those not yet
+    # backfilled are matched once their snapshots are attached.
+    candidate_relation_markup = await attach_endpoint_snapshots(
+        db=db,
+        relations=await db.markup.find(
+            {
                 "ontology_item_id": markup["ontology_item_id"],
                 "project_id": markup["project_id"],
                 "created_by": username,
                 "classification": markup["classification"],
                 "suggested": True if markup_is_suggested else {"$in": [True, False]},
                 "dataset_item_id": {"$nin": blocked_dataset_item_ids},
-            }
-        },
-        {
-            "$lookup": {
-                "from": "markup",
-                "localField": "source_id",
-                "foreignField": "_id",
-                "as": "source",
-            }
-        },
-        {
-            "$lookup": {
-                "from": "markup",
-                "localField": "target_id",
-                "foreignField": "_id",
-                "as": "target",
-            }
-        },
-        {"$unwind": {"path": "$source"}},
-        {"$unwind": {"path": "$target"}},
-        {
-            "$match": {
-                "source.surface_form": markup_src_entity["surface_form"],
-                "source.ontology_item_id": markup_src_entity["ontology_item_id"],
-                "target.surface_form": markup_tgt_entity["surface_form"],
-                "target.ontology_item_id": markup_tgt_entity["ontology_item_id"],
-            }
-        },
-        {
-            "$addFields": {
-                "offset": {
-                    "$abs": {
-                        "$subtract": [
-                            {
-                                "$subtract": [
-                                    "$target.start",
-                                    "$source.end",
-                                ],
-                            },
-                            1,
+                "$or": [
+                    {
+                        "source.surface_form": markup_src_entity["surface_form"],
+                        "source.ontology_item_id": markup_src_entity[
+                            "ontology_item_id"
+                        ],
+                        "target.surface_form": markup_tgt_entity["surface_form"],
+                        "target.ontology_item_id": markup_tgt_entity[
+                            "ontology_item_id"
                         ],
                     },
-                },
-            }
-        },
-        {"$match": {"offset": {"$eq": offset}}},
-    ]
+                    {"source": {"$exists": False}},
+                ],
+            },
+            {"source_id": 1, "target_id": 1, "source": 1, "target": 1},
+        ).to_list(None),
+    )
 
     # Get matching relations
-    matched_relation_markup = await db.markup.aggregate(pipeline).to_list(None)
+    matched_relation_markup = [
+        r
+        for r in candidate_relation_markup
+        if r["source"]["surface_form"] == markup_src_entity["surface_form"]
+        and r["source"]["ontology_item_id"] == markup_src_entity["ontology_item_id"]
+        and r["target"]["surface_form"] == markup_tgt_entity["surface_form"]
+        and r["target"]["ontology_item_id"] == markup_tgt_entity["ontology_item_id"]
+        and abs(r["target"]["start"] - r["source"]["end"] - 1) == offset
+    ]
 
     if len(matched_relation_markup) == 0:
         logger.info("No matching relations found")
@@ -1606,9 +1258,12 @@ async def delete_annotation(
     }
 
     # Get saved dataset item ids, these cannot be modified and are considered 'blocked'.
-    blocked_dataset_item_ids = await db.data.find(
-        {"save_states": {"$elemMatch": {"created_by": username}}}
-    ).to_list(None)
+    blocked_dataset_item_ids = [
+        di["_id"]
+        for di in await db.data.find(
+            {"save_states": {"$elemMatch": {"created_by": username}}}, {"_id": 1}
+        ).to_list(None)
+    ]
 
     try:
         annotation_type = AnnotationType(markup["classification"])
@@ -0,0 +1,164 @@
+"""Relation endpoint snapshots.
+
+Relations embed a snapshot of their source and target entities, as `source` and
+`target` documents holding the entity's `start`, `end`, `ontology_item_id` and
+`surface_form`, so that relations can be matched and compared without joining `markup`
+to itself. Snapshots are written with the relation and refreshed when an entity is
+edited; relations are deleted with their entities. Relations written before snapshots
+existed are backfilled on startup; until then readers attach their snapshots in memory.
+"""
+
+import logging
+from typing import Any, Dict, List, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateMany, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT_FIELDS = ("start", "end", "ontology_item_id", "surface_form")
+
+# Relations backfilled per `bulk_write`
+BACKFILL_BATCH_SIZE = 1000
+
+
+def create_endpoint_snapshot(entity: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: entity[field] for field in ENDPOINT_FIELDS}
+
+
+async def find_endpoint_snapshots(
+    db: AsyncIOMotorDatabase, source_id: ObjectId, target_id: ObjectId
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Finds the snapshots of a relation's source and target entities.
+
+    Raises:
+        ValueError: If either entity does not exist.
+    """
+    entities = {
+        e["_id"]: e
+        async for e in db["markup"].find(
+            {"_id": {"$in": [source_id, target_id]}},
+            {field: 1 for field in ENDPOINT_FIELDS},
+        )
+    }
+    if source_id not in entities or target_id not in entities:
+        raise ValueError("Relation references an unknown entity")
+    return (
+        create_endpoint_snapshot(entities[source_id]),
+        create_endpoint_snapshot(entities[target_id]),
+    )
+
+
+async def attach_endpoint_snapshots(
+    db: AsyncIOMotorDatabase, relations: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """Adds snapshots to relations that were not yet backfilled, in memory.
+
+    Returns:
+        The relations, less those whose entities no longer exist.
+    """
+    missing = [r for r in relations if "source" not in r or "target" not in r]
+    if len(missing) == 0:
+        return relations
+
+    entities = {
+        e["_id"]: e
+        async for e in db["markup"].find(
+            {
+                "_id": {
+                    "$in": list(
+                        {r["source_id"] for r in missing}
+                        | {r["target_id"] for r in missing}
+                    )
+                }
+            },
+            {field: 1 for field in ENDPOINT_FIELDS},
+        )
+    }
+    for r in missing:
+        if r["source_id"] in entities and r["target_id"] in entities:
+            r["source"] = create_endpoint_snapshot(entities[r["source_id"]])
+            r["target"] = create_endpoint_snapshot(entities[r["target_id"]])
+    return [r for r in relations if "source" in r and "target" in r]
+
+
+async def refresh_endpoint_snapshots(
+    db: AsyncIOMotorDatabase, entity_ids: List[ObjectId]
+) -> None:
+    """Rewrites the snapshots of edited entities on the relations that reference them."""
+    operations = []
+    async for e in db["markup"].find(
+        {"_id": {"$in": entity_ids}}, {field: 1 for field in ENDPOINT_FIELDS}
+    ):
+        snapshot = create_endpoint_snapshot(e)
+        operations.append(
+            UpdateMany({"source_id": e["_id"]}, {"$set": {"source": snapshot}})
+        )
+        operations.append(
+            UpdateMany({"target_id": e["_id"]}, {"$set": {"target": snapshot}})
+        )
+    if operations:
+        await db["markup"].bulk_write(operations, ordered=False)
+
+
+async def backfill_endpoint_snapshots(db: AsyncIOMotorDatabase) -> int:
+    """Adds endpoint snapshots to relations written before they existed.
+
+    Relations are backfilled in batches, so the backfill can be resumed if it is
+    interrupted. Relations whose entities no longer exist are left without snapshots.
+
+    Returns:
+        The number of backfilled relations.
+    """
+    _filter = {"classification": "relation", "source": {"$exists": False}}
+    backfilled = 0
+    last_id = None
+    while True:
+        relations = (
+            await db["markup"]
+            .find(
+                _filter if last_id is None else {**_filter, "_id": {"$gt": last_id}},
+                {"source_id": 1, "target_id": 1},
+            )
+            .sort("_id", 1)
+            .limit(BACKFILL_BATCH_SIZE)
+            .to_list(None)
+        )
+        if len(relations) == 0:
+            break
+        last_id = relations[-1]["_id"]
+
+        entities = {
+            e["_id"]: e
+            async for e in db["markup"].find(
+                {
+                    "_id": {
+                        "$in": list(
+                            {r["source_id"] for r in relations}
+                            | {r["target_id"] for r in relations}
+                        )
+                    }
+                },
+                {field: 1 for field in ENDPOINT_FIELDS},
+            )
+        }
+        operations = [
+            UpdateOne(
+                {"_id": r["_id"]},
+                {
+                    "$set": {
+                        "source": create_endpoint_snapshot(entities[r["source_id"]]),
+                        "target": create_endpoint_snapshot(entities[r["target_id"]]),
+                    }
+                },
+            )
+            for r in relations
+            if r["source_id"] in entities and r["target_id"] in entities
+        ]
+        if operations:
+            await db["markup"].bulk_write(operations, ordered=False)
+        backfilled += len(operations)
+
+    logger.info(f"Backfilled endpoint snapshots of {backfilled} relations")
+    return backfilled
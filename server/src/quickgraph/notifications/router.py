@@ -12,6 +12,7 @@ from ..notifications.schemas import Notification, NotificationStates
 from ..users.schemas import UserDocumentModel
 from .services import find_many_notifications
 from ..settings import settings
+from ..utils.cache import invalidate_document
 
 router = APIRouter(
     prefix=f"{settings.api.prefix}/notifications", tags=["Notifications"]
@@ -104,4 +105,5 @@ async def invite_notification(
             },
             {"$set": {"annotators.$.state": NotificationStates.declined.value}},
         )  # Content id is the project_id if notification is an invitation.
+    invalidate_document("projects", notification["content_id"])
     return {"message": "Notification updated successfully."}
@@ -0,0 +1,215 @@
+"""Annotator assignments.
+
+The scope of an annotator, the dataset items assigned to them, is held in the
+`assignments` collection with one document per project, annotator and dataset item.
+Unassigned items are hidden rather than removed so that reassigning them does not copy
+their blueprint markup again.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+ASSIGNMENTS_COLLECTION = "assignments"
+
+# Assignments written per bulk write
+WRITE_BATCH_SIZE = 10000
+
+
+async def assign_dataset_items(
+    db: AsyncIOMotorDatabase,
+    project_id: ObjectId,
+    username: str,
+    dataset_item_ids: List[ObjectId],
+    visible: bool = True,
+) -> List[ObjectId]:
+    """Upserts the assignments of dataset items to an annotator.
+
+    Returns:
+        The ids of the dataset items that were not previously assigned to the annotator.
+    """
+    created_at = datetime.utcnow()
+    new_dataset_item_ids = []
+    for i in range(0, len(dataset_item_ids), WRITE_BATCH_SIZE):
+        batch = dataset_item_ids[i : i + WRITE_BATCH_SIZE]
+        result = await db[ASSIGNMENTS_COLLECTION].bulk_write(
+            [
+                UpdateOne(
+                    {
+                        "project_id": project_id,
+                        "username": username,
+                        "dataset_item_id": dataset_item_id,
+                    },
+                    {
+                        "$set": {"visible": visible, "updated_at": created_at},
+                        "$setOnInsert": {"created_at": created_at},
+                    },
+                    upsert=True,
+                )
+                for dataset_item_id in batch
+            ],
+            ordered=False,
+        )
+        new_dataset_item_ids += [batch[index] for index in result.upserted_ids]
+    return new_dataset_item_ids
+
+
+async def set_visible_dataset_items(
+    db: AsyncIOMotorDatabase,
+    project_id: ObjectId,
+    username: str,
+    dataset_item_ids: List[ObjectId],
+) -> Tuple[int, List[ObjectId]]:
+    """Makes exactly the given dataset items visible to an annotator.
+
+    Items that are assigned but not given are hidden. Only assignments whose visibility
+    changes are written.
+
+    Returns:
+        The number of changed assignments and the ids of newly assigned dataset items.
+    """
+    current = {
+        a["dataset_item_id"]: a["visible"]
+        async for a in db[ASSIGNMENTS_COLLECTION].find(
+            {"project_id": project_id, "username": username},
+            {"_id": 0, "dataset_item_id": 1, "visible": 1},
+        )
+    }
+    visible_ids = set(dataset_item_ids)
+
+    shown_ids = [di for di in dict.fromkeys(dataset_item_ids) if not current.get(di)]
+    hidden_ids = [
+        di for di, visible in current.items() if visible and di not in visible_ids
+    ]
+
+    new_dataset_item_ids = await assign_dataset_items(
+        db=db, project_id=project_id, username=username, dataset_item_ids=shown_ids
+    )
+
+    for i in range(0, len(hidden_ids), WRITE_BATCH_SIZE):
+        await db[ASSIGNMENTS_COLLECTION].update_many(
+            {
+                "project_id": project_id,
+                "username": username,
+                "dataset_item_id": {"$in": hidden_ids[i : i + WRITE_BATCH_SIZE]},
+            },
+            {"$set": {"visible": False, "updated_at": datetime.utcnow()}},
+        )
+
+    return len(shown_ids) + len(hidden_ids), new_dataset_item_ids
+
+
+async def find_assigned_dataset_item_ids(
+    db: AsyncIOMotorDatabase, project_id: ObjectId, username: str
+) -> List[ObjectId]:
+    """Finds the ids of the dataset items visible to an annotator in id order."""
+    return [
+        a["dataset_item_id"]
+        async for a in db[ASSIGNMENTS_COLLECTION]
+        .find(
+            {"project_id": project_id, "username": username, "visible": True},
+            {"_id": 0, "dataset_item_id": 1},
+        )
+        .sort("dataset_item_id", 1)
+    ]
+
+
+async def count_assigned_dataset_items(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> Dict[str, int]:
+    """Counts the dataset items visible to each annotator of a project."""
+    pipeline = [
+        {"$match": {"project_id": project_id, "visible": True}},
+        {"$group": {"_id": "$username", "count": {"$sum": 1}}},
+    ]
+    return {
+        r["_id"]: r["count"]
+        async for r in db[ASSIGNMENTS_COLLECTION].aggregate(pipeline)
+    }
+
+
+async def find_project_assignments(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> Dict[str, List[ObjectId]]:
+    """Maps each annotator of a project to the ids of the dataset items visible to them."""
+    assignments = defaultdict(list)
+    async for a in db[ASSIGNMENTS_COLLECTION].find(
+        {"project_id": project_id, "visible": True},
+        {"_id": 0, "username": 1, "dataset_item_id": 1},
+    ):
+        assignments[a["username"]].append(a["dataset_item_id"])
+    return assignments
+
+
+async def remove_dataset_items_from_assignments(
+    db: AsyncIOMotorDatabase, project_id: ObjectId, dataset_item_ids: List[ObjectId]
+) -> None:
+    await db[ASSIGNMENTS_COLLECTION].delete_many(
+        {"project_id": project_id, "dataset_item_id": {"$in": dataset_item_ids}}
+    )
+
+
+async def delete_annotator_assignments(
+    db: AsyncIOMotorDatabase, project_id: ObjectId, username: str
+) -> None:
+    await db[ASSIGNMENTS_COLLECTION].delete_many(
+        {"project_id": project_id, "username": username}
+    )
+
+
+async def delete_project_assignments(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> None:
+    await db[ASSIGNMENTS_COLLECTION].delete_many({"project_id": project_id})
+
+
+async def migrate_embedded_scopes(db: AsyncIOMotorDatabase) -> int:
+    """Moves annotator scopes embedded in project documents to the assignments collection.
+
+    Projects are migrated one at a time and their embedded scopes are removed once
+    written, so the migration can be resumed if it is interrupted.
+
+    Returns:
+        The number of migrated projects.
+    """
+    migrated = 0
+    async for project in db["projects"].find(
+        {"annotators.scope": {"$exists": True}}, {"annotators": 1}
+    ):
+        created_at = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {
+                    "project_id": project["_id"],
+                    "username": annotator["username"],
+                    "dataset_item_id": item["dataset_item_id"],
+                },
+                {
+                    "$set": {"visible": item["visible"], "updated_at": created_at},
+                    "$setOnInsert": {"created_at": created_at},
+                },
+                upsert=True,
+            )
+            for annotator in project["annotators"]
+            for item in annotator.get("scope", [])
+        ]
+        for i in range(0, len(operations), WRITE_BATCH_SIZE):
+            await db[ASSIGNMENTS_COLLECTION].bulk_write(
+                operations[i : i + WRITE_BATCH_SIZE], ordered=False
+            )
+
+        await db["projects"].update_one(
+            {"_id": project["_id"]}, {"$unset": {"annotators.$[].scope": ""}}
+        )
+        logger.info(
+            f"Migrated {len(operations)} assignments of project {project['_id']}"
+        )
+        migrated += 1
+    return migrated
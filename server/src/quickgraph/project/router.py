@@ -2,11 +2,10 @@
 
 import datetime
 import logging
-from collections import defaultdict
 from typing import List
 
 from bson import ObjectId
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
@@ -17,7 +16,15 @@ from ..dependencies import (
     get_user,
     valid_project_manager,
 )
+from ..dashboard.stats import mark_project_stats_stale
+from ..dataset.clustering import find_dataset_clusters
+from ..graph.projection import update_project_graph
+from ..jobs.schemas import JobKind
+from ..jobs.services import JobContext, submit_job
 from ..users.schemas import UserDocumentModel
+from ..utils.cache import invalidate_document
+from ..utils.streaming import NDJSON_MEDIA_TYPE, create_streaming_response
+from .assignments import find_project_assignments
 from .schemas import (
     CreateProject,
     Project,
@@ -45,6 +52,7 @@ from .services import (
     invite_users_to_project,
     remove_user_from_project,
     save_many_dataset_items,
+    update_annotator_assignment,
 )
 from ..settings import settings
 
@@ -57,15 +65,39 @@ router = APIRouter(prefix=f"{settings.api.prefix}/project", tags=["Project"])
 @router.post("", response_description="Create project", response_model=Project)
 async def create_new_project_endpoint(
     project: CreateProject,
+    background: bool = False,
     user: UserDocumentModel = Depends(get_user),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
     """Creates new project including optional preprocessing and preannotation.
 
+    If `background` is set, the project is created by a background job and the job is
+    returned with a 202 status; its progress is available via `/jobs/{job_id}`.
+
     TODO
     ----
     - Adapt for datasets that are preannotated and/or have external ids.
     """
+    if background:
+
+        async def _create_project(job: JobContext):
+            created_project = await create_project(
+                db=db, username=user.username, project=project, job=job
+            )
+            if created_project is None:
+                raise ValueError("Unable to create project")
+            return created_project.model_dump(mode="json", by_alias=True)
+
+        job = await submit_job(
+            db=db,
+            kind=JobKind.create_project,
+            username=user.username,
+            fn=_create_project,
+        )
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(job)
+        )
+
     project = await create_project(db=db, username=user.username, project=project)
     if project is None:
         raise HTTPException(
@@ -111,6 +143,12 @@ async def save_project_dataset_items_endpoint(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Unable to save dataset items",
         )
+    await mark_project_stats_stale(db=db, project_id=ObjectId(body.project_id))
+    await update_project_graph(
+        db=db,
+        project_id=ObjectId(body.project_id),
+        dataset_item_ids=[ObjectId(di) for di in body.dataset_item_ids],
+    )
     return result
 
 
@@ -130,16 +168,29 @@ async def update_project_endpoint(
     # Convert from pydantic model to json/dict obj
     body = flatten_dict(jsonable_encoder(body))
 
+    previous_project = await db["projects"].find_one(
+        {"_id": ObjectId(project_id)}, {"settings.annotators_per_item": 1}
+    )
     response = await db["projects"].update_one(
         {"_id": ObjectId(project_id), "created_by": user.username},
         {"$set": {**body, "updated_at": datetime.datetime.utcnow()}},
         upsert=True,
     )
+    invalidate_document("projects", ObjectId(project_id))
 
     if response.matched_count == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
         )
+    if (
+        previous_project is not None
+        and previous_project["settings"]["annotators_per_item"]
+        != body["settings.annotators_per_item"]
+    ):
+        # Agreed upon dataset items, progress and agreement depend on the number of
+        # annotators per item.
+        await update_project_graph(db=db, project_id=ObjectId(project_id))
+        await mark_project_stats_stale(db=db, project_id=ObjectId(project_id))
     updated_project = await db["projects"].find_one({"_id": ObjectId(project_id)})
     return updated_project
 
@@ -165,6 +216,7 @@ async def update_project_guidelines_endpoint(
         },
         upsert=True,
     )
+    invalidate_document("projects", ObjectId(project_id))
     if response.matched_count == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
@@ -187,6 +239,7 @@ async def get_projects_summary_endpoint(
 async def update_annotator_assignments_endpoint(
     project_id: str,
     body: dict,
+    background: bool = False,
     user: UserDocumentModel = Depends(valid_project_manager),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
@@ -200,6 +253,8 @@ async def update_annotator_assignments_endpoint(
         The UUID of the project
     body : dict
         {"dataset_item_ids": [str], "username": str}
+    background : bool
+        Run the assignment as a background job and return the job
     user : User
         The current user making the request
     db : AsyncIOMotorDatabase
@@ -223,172 +278,38 @@ async def update_annotator_assignments_endpoint(
     """
 
     try:
-        dataset_item_ids = [ObjectId(di) for di in body["dataset_item_ids"]]
-        # Dataset item ids are those that should be set to "true" all others, false.
-
         project_id = ObjectId(project_id)
-        project = await db["projects"].find_one(
-            {"_id": project_id},
-            {"annotators": 1, "settings": 1, "dataset_id": 1, "tasks": 1},
-        )
-
-        annotator_scope = [
-            a for a in project["annotators"] if a["username"] == body["username"]
-        ][0]["scope"]
-
-        annotator_scope_dataset_item_ids = [
-            item["dataset_item_id"] for item in annotator_scope
-        ]  # This includes items of any visibility.
-
-        # Create a set of existing dataset_item_ids in annotator_scope
-        existing_dataset_item_ids = set(annotator_scope_dataset_item_ids)
+        dataset_item_ids = [ObjectId(di) for di in body["dataset_item_ids"]]
 
-        # "out_of_scope" dataset item ids are those that are not in the "scope" array. These will be assigned markup (if applicable).
-        out_of_scope_dataset_item_ids = set()
+        if background:
 
-        # Loop through the new dataset_item_ids and add any new ones to the existing set
-        for dataset_item_id in dataset_item_ids:
-            if dataset_item_id not in existing_dataset_item_ids:
-                annotator_scope.append(
-                    {"dataset_item_id": ObjectId(dataset_item_id), "visible": True}
+            async def _assign(job: JobContext):
+                modified_count = await update_annotator_assignment(
+                    db=db,
+                    project_id=project_id,
+                    annotator_username=body["username"],
+                    dataset_item_ids=dataset_item_ids,
+                    project_manager=user.username,
+                    job=job,
                 )
-                existing_dataset_item_ids.add(dataset_item_id)
-                out_of_scope_dataset_item_ids.add(dataset_item_id)
-
-        logger.info(f'"out_of_scope_dataset_item_ids": {out_of_scope_dataset_item_ids}')
-
-        # Update the visibility of existing items
-        annotator_scope_updated = [
-            {**item, "visible": item["dataset_item_id"] in dataset_item_ids}
-            for item in annotator_scope
-        ]
-
-        # Update project
-        result = await db["projects"].update_one(
-            {
-                "_id": project_id,
-                "created_by": user.username,
-                "annotators.username": body["username"],
-            },
-            {"$set": {"annotators.$[annotator].scope": annotator_scope_updated}},
-            array_filters=[{"annotator.username": body["username"]}],
-            upsert=True,
+                return {"update_count": modified_count}
+
+            job = await submit_job(
+                db=db, kind=JobKind.assign_annotator, username=user.username, fn=_assign
+            )
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(job)
+            )
+
+        modified_count = await update_annotator_assignment(
+            db=db,
+            project_id=project_id,
+            annotator_username=body["username"],
+            dataset_item_ids=dataset_item_ids,
+            project_manager=user.username,
         )
-
-        if len(out_of_scope_dataset_item_ids) > 0:
-            # Assign preannotations (if applicable)
-            dataset = await db["datasets"].find_one({"_id": project["dataset_id"]})
-
-            # Check if project dataset is "annotated"
-            if dataset["is_annotated"]:
-                # Get dataset items that are "out of scope"
-                oos_dataset_items = (
-                    await db["data"]
-                    .find(
-                        {
-                            "project_id": project_id,
-                            "_id": {"$in": list(out_of_scope_dataset_item_ids)},
-                        }
-                    )
-                    .to_list(None)
-                )
-
-                logger.info(
-                    f"Found {len(oos_dataset_items)} out of scope dataset items"
-                )
-
-                # Create mapping between blueprint and project dataset item ids
-                dataset_item_id_map_bp2project = {
-                    di["blueprint_dataset_item_id"]: di["_id"]
-                    for di in oos_dataset_items
-                }
-
-                logger.info(
-                    f'"dataset_item_id_map_bp2project": {dataset_item_id_map_bp2project}'
-                )
-
-                # Get blueprint "_id" of dataset items - these are used to find blueprint markup
-                oos_bp_dataset_item_ids = [
-                    di["blueprint_dataset_item_id"] for di in oos_dataset_items
-                ]
-
-                logger.info(f'"oos_bp_dataset_item_ids": {oos_bp_dataset_item_ids}')
-
-                bp_markup = (
-                    await db["markup"]
-                    .find(
-                        {
-                            "dataset_item_id": {
-                                "$in": oos_bp_dataset_item_ids,
-                            },
-                            "is_blueprint": True,
-                        }
-                    )
-                    .to_list(None)
-                )
-
-                logger.info(
-                    f"Found {len(bp_markup)} blueprint markups that will be associated with this annotator"
-                )
-
-                # Assign markups to user for all newly assigned scope items
-                # This object holds a mapping between the original bp markup and the created markup; specifically so relation markup can be connected properly.
-                bp_entity_markup_id_map = {}
-
-                async def _copy_bp_markup(classification: str, markup):
-                    try:
-                        copy_markup = dict(markup)
-                        copy_markup.pop("_id")
-
-                        # Modify the markup
-                        copy_markup["is_blueprint"] = False
-                        copy_markup["dataset_item_id"] = dataset_item_id_map_bp2project[
-                            copy_markup["dataset_item_id"]
-                        ]
-                        copy_markup["project_id"] = project_id
-                        copy_markup["created_by"] = body["username"]
-                        copy_markup["suggested"] = project["settings"][
-                            "suggested_preannotations"
-                        ]
-
-                        if classification == "relation":
-                            copy_markup["source_id"] = bp_entity_markup_id_map[
-                                copy_markup["source_id"]
-                            ]
-                            copy_markup["target_id"] = bp_entity_markup_id_map[
-                                copy_markup["target_id"]
-                            ]
-
-                        # Insert the modified markup into the database
-                        new_markup = await db["markup"].insert_one({**copy_markup})
-                        return new_markup.inserted_id
-                    except Exception as e:
-                        logger.info(f"Failed to copy bp markup: {e}")
-
-                # Process entity markup first
-                logger.info("Copying entity markup(s)")
-                for markup in [m for m in bp_markup if m["classification"] == "entity"]:
-                    old_markup_id = markup["_id"]  # This is the blueprints _id
-                    new_markup_id = await _copy_bp_markup(
-                        classification="entity", markup=markup
-                    )
-                    bp_entity_markup_id_map[old_markup_id] = new_markup_id
-
-                logger.info("bp_entity_markup_id_map", bp_entity_markup_id_map)
-
-                # Process relation markup if project requests it
-                if project["tasks"]["relation"]:
-                    logger.info("Copying relation markup(s)")
-                    for markup in [
-                        m for m in bp_markup if m["classification"] == "relation"
-                    ]:
-                        await _copy_bp_markup(classification="relation", markup=markup)
-
-                # Output the completion of the addition of annotated data markup copies
-                logger.info("Annotated data markup copies have been added.")
-
         return JSONResponse(
-            status_code=200, content={"detail": {"update_count": result.modified_count}}
+            status_code=200, content={"detail": {"update_count": modified_count}}
         )
     except Exception as e:
         logger.info(e)
@@ -400,35 +321,10 @@ async def get_project_annotators_endpoint(
     user: UserDocumentModel = Depends(get_active_project_user),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
+    project_id = ObjectId(project_id)
     pipeline = [
-        {"$match": {"_id": ObjectId(project_id)}},
+        {"$match": {"_id": project_id}},
         {"$project": {"annotators": 1, "dataset_id": 1}},
-        {
-            "$addFields": {
-                "annotators": {
-                    "$map": {
-                        "input": "$annotators",
-                        "in": {
-                            "$mergeObjects": [
-                                "$$this",
-                                {
-                                    "scope_size": {
-                                        "$size": {
-                                            "$filter": {
-                                                "input": "$$this.scope",
-                                                "cond": {
-                                                    "$eq": ["$$this.visible", True]
-                                                },
-                                            }
-                                        }
-                                    }
-                                },
-                            ]
-                        },
-                    }
-                }
-            }
-        },
         {
             "$lookup": {
                 "from": "data",
@@ -456,13 +352,14 @@ async def get_project_annotators_endpoint(
     result = await db["projects"].aggregate(pipeline).to_list(None)
     result = result[0]
 
+    assignments = await find_project_assignments(db=db, project_id=project_id)
+
     return {
         "annotators": [
             {
                 **a,
-                "scope": [
-                    str(di["dataset_item_id"]) for di in a["scope"] if di["visible"]
-                ],
+                "scope_size": len(assignments.get(a["username"], [])),
+                "scope": [str(di) for di in assignments.get(a["username"], [])],
             }
             for a in result["annotators"]
         ],
@@ -557,10 +454,30 @@ async def get_project_progress_endpoint(
 async def invite_users_endpoint(
     project_id: str,
     body: UserInviteBody,
+    background: bool = False,
     db: AsyncIOMotorDatabase = Depends(get_db),
     user: UserDocumentModel = Depends(valid_project_manager),
 ):
     """Invite users to a project."""
+    if background:
+
+        async def _invite_users(job: JobContext):
+            response = await invite_users_to_project(
+                db=db,
+                sender_username=user.username,
+                project_id=ObjectId(project_id),
+                body=body,
+                job=job,
+            )
+            return response.model_dump(mode="json")
+
+        job = await submit_job(
+            db=db, kind=JobKind.invite_users, username=user.username, fn=_invite_users
+        )
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(job)
+        )
+
     return await invite_users_to_project(
         db=db, sender_username=user.username, project_id=ObjectId(project_id), body=body
     )
@@ -568,12 +485,19 @@ async def invite_users_endpoint(
 
 @router.get("/download/{project_id}")
 async def download_project_endpoint(
+    request: Request,
     project_id: str,
     user: UserDocumentModel = Depends(valid_project_manager),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    """Creates a payload for entire project download."""
-    return await download_project(db=db, project_id=ObjectId(project_id))
+    """Streams an entire project download as NDJSON, gzip compressed if accepted."""
+    records = await download_project(db=db, project_id=ObjectId(project_id))
+    return create_streaming_response(
+        request=request,
+        chunks=records,
+        media_type=NDJSON_MEDIA_TYPE,
+        filename=f"project_download-{project_id}.jsonl",
+    )
 
 
 @router.get("/suggested-entities/{project_id}/{surface_form}")
@@ -608,16 +532,6 @@ async def get_project_dataset_clusters_endpoint(
             detail="Project not found",
         )
 
-    dataset_id = ObjectId(project["dataset_id"])
-
-    items = await db.data.find({"dataset_id": ObjectId(dataset_id)}).to_list(None)
-
-    clusters = defaultdict()
-    for item in items:
-        if item["cluster_id"] not in clusters:
-            clusters[item["cluster_id"]] = item["cluster_keywords"]
-
-    return sorted(
-        [{"value": k, "keywords": v} for k, v in clusters.items()],
-        key=lambda x: x["value"],
+    return await find_dataset_clusters(
+        db=db, dataset_id=ObjectId(project["dataset_id"])
     )
@@ -100,22 +100,11 @@ class AnnotatorStates(Enum):
     removed = "removed"
 
 
-class ScopeItem(BaseModel):
-    dataset_item_id: PydanticObjectIdAnnotated = Field(
-        ...,
-        description="Scope of documents assigned assigned to annotator (item identifiers)",
-    )
-    visible: bool
-
-    model_config = ConfigDict(arbitrary_types_allowed=True)
-
-
 class Annotator(BaseModel):
     username: str = Field(description="Username associated with annotator")
     role: AnnotatorRoles = Field(description="Role assigned to annotator")
     disabled: bool = Field(default=False, description="Disable state of annotator")
     state: AnnotatorStates = Field(description="Current state of annotator")
-    scope: List[ScopeItem]
 
     model_config = ConfigDict(use_enum_values=True)
 
@@ -352,12 +341,13 @@ class ProjectSocial(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True, populate_by_name=True)
 
 
-class ProjectDownload(BaseModel):
-    project: Project = {}
-    dataset: ProjectDataset = {}
-    dataset_items: List[ProjectDatasetItem] = []
-    markup: List[Union[Entity, Relation]] = []
-    social: List[ProjectSocial] = []
+class ProjectDownloadItem(ProjectDatasetItem):
+    markup: List[Union[Entity, Relation]] = Field(
+        default=[], description="The markup of the dataset item"
+    )
+    social: List[ProjectSocial] = Field(
+        default=[], description="The social of the dataset item"
+    )
 
 
 class ProjectProgress(BaseModel):
@@ -1,26 +1,49 @@
 """Project services."""
 
+import asyncio
 import itertools
 import logging
 import traceback
-from collections import Counter
+from collections import Counter, defaultdict
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
 from bson import ObjectId
 from fastapi import HTTPException, status
 from fastapi.responses import JSONResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
 
+from ..dataset.clustering import CLUSTERS_COLLECTION, copy_dataset_clusters
+from ..dataset.index import (
+    TOKEN_INDEX_BUILD_FIELD,
+    index_dataset_items,
+    remove_dataset_from_index,
+)
 from ..dataset.schemas import DatasetItem
 from ..dataset.services import find_one_dataset
+from ..graph.projection import delete_project_graph, update_project_graph
+from ..jobs.services import JobCancelledError, JobContext
 from ..markup.schemas import Entity, Relation, RichCreateEntity
 from ..notifications.schemas import CreateNotification, NotificationContext
 from ..notifications.services import (
     create_many_project_invitations,
     create_notification,
 )
-from ..utils.agreement import AgreementCalculator
+from ..settings import settings
+from ..utils.agreement import markup_signatures, signature_agreement
+from ..utils.cache import invalidate_document
+from ..utils.gazetteer import GazetteerMatcher, annotate_chunk, init_worker_matcher
+from ..utils.streaming import EXPORT_BATCH_SIZE, encode_json_line
+from ..utils.workers import get_worker_count, initialized_process_pool
+from .assignments import (
+    assign_dataset_items,
+    count_assigned_dataset_items,
+    delete_annotator_assignments,
+    delete_project_assignments,
+    find_project_assignments,
+    set_visible_dataset_items,
+)
 from .schemas import (
     Annotator,
     AnnotatorRoles,
@@ -33,8 +56,7 @@ from .schemas import (
     Preprocessing,
     Project,
     ProjectDataset,
-    ProjectDatasetItem,
-    ProjectDownload,
+    ProjectDownloadItem,
     ProjectProgress,
     ProjectSocial,
     ProjectWithMetrics,
@@ -48,6 +70,11 @@ from .schemas import (
 
 logger = logging.getLogger(__name__)
 
+MARKUP_SIGNATURES_COLLECTION = "markup_signatures"
+
+# Number of blueprint markup copied between progress reports of an assignment job
+COPY_PROGRESS_INTERVAL = 500
+
 
 def assign_usernames_to_ids(
     ids: List[int], usernames: List[str], min_usernames_per_id: int
@@ -143,6 +170,9 @@ async def copy_dataset_blueprint(
     dataset["project_id"] = project_id
     dataset["created_by"] = username
     dataset.pop("_id", None)
+    # The copy is indexed once its items are copied.
+    dataset.pop("token_index_version", None)
+    dataset[TOKEN_INDEX_BUILD_FIELD] = datetime.utcnow()
 
     project_dataset = await db["datasets"].insert_one(dataset)
     logger.info("Copied blueprint dataset")
@@ -162,10 +192,18 @@ async def copy_dataset_blueprint(
 
         # dataset_item_copies.append(di)    # TODO: refactor back into bulk "insert_many"; using single to capture ids; this needs to be preserved.
 
+    await index_dataset_items(db=db, dataset_id=project_dataset.inserted_id)
+    await copy_dataset_clusters(
+        db=db,
+        source_dataset_id=blueprint_dataset_id,
+        target_dataset_id=project_dataset.inserted_id,
+    )
+
     # Update project with new dataset_id
     await db["projects"].update_one(
         {"_id": project_id}, {"$set": {"dataset_id": project_dataset.inserted_id}}
     )
+    invalidate_document("projects", project_id)
     return project_dataset.inserted_id, dataset_item_id_map_bp2project
 
 
@@ -206,17 +244,14 @@ async def add_project_annotators(
             )
 
         # Get dataset item ids for scope assignment - default scope is all dataset items
-        dataset_item_ids = (
-            await db["data"].find({"dataset_id": dataset_id}).to_list(None)
-        )
-        dataset_item_ids = [di["_id"] for di in dataset_item_ids]
+        dataset_item_ids = await db["data"].distinct("_id", {"dataset_id": dataset_id})
 
+        # Invited annotators are assigned dataset items after the project is created.
         annotators = [
             Annotator(
                 username=username,
                 role=AnnotatorRoles.annotator,
                 state=AnnotatorStates.invited,
-                scope=[],  # This is assigned after the project is created at the moment.
             )
             for username in annotators
         ]
@@ -226,17 +261,21 @@ async def add_project_annotators(
                 username=project_manager,
                 role=AnnotatorRoles.project_manager,
                 state=AnnotatorStates.accepted,
-                scope=[
-                    {"dataset_item_id": di, "visible": True} for di in dataset_item_ids
-                ],
             )
         ]
+        await assign_dataset_items(
+            db=db,
+            project_id=project_id,
+            username=project_manager,
+            dataset_item_ids=dataset_item_ids,
+        )
 
         # Add annotators to project
         await db["projects"].update_one(
             {"_id": project_id},
             {"$set": {"annotators": [a.dict() for a in annotators]}},
         )
+        invalidate_document("projects", project_id)
 
         return annotators
     except Exception as e:
@@ -263,48 +302,14 @@ def annotate_single_label(
     else:
         raise NotImplementedError("Tokenizer not supported")
 
+    # Phrases are compiled into a token trie once and each item is tagged in a single pass.
+    matcher = GazetteerMatcher(gazetteer=gazetteer, tokenizer=tokenizer)
+
     dataset_item_id_with_mentions = {}
     mention_count = 0
     for dataset_item in dataset_items:
-        _mentions = []
-        di_tokens = dataset_item.tokens
-
-        for mention_type, mention_phrases in gazetteer.items():
-            # Sort the phrases in descending order of length
-            mention_phrases.sort(key=len, reverse=True)
-
-            for mention_text in mention_phrases:
-                if mention_text in dataset_item.text:
-                    # logger.info("mention text identified")
-                    mention_tokenized = tokenizer(mention_text)
-
-                    # logger.info("mention_tokenized", mention_tokenized)
-
-                    for t_idx in range(len(di_tokens)):
-                        if (
-                            di_tokens[t_idx : t_idx + len(mention_tokenized)]
-                            == mention_tokenized
-                        ):
-                            mention_start = t_idx
-                            mention_end = t_idx + len(mention_tokenized) - 1
-
-                            _mentions.append(
-                                {
-                                    "classification": mention_type,
-                                    "surface_form": mention_text,
-                                    "start": mention_start,
-                                    "end": mention_end,
-                                }
-                            )
-                            mention_count += 1
-
-                            # Replace the phrase with a placeholder to prevent it from being matched again
-                            di_tokens = (
-                                di_tokens[:mention_start]
-                                + ["[MASK]"] * (mention_end - mention_start)
-                                + di_tokens[mention_end:]
-                            )
-
+        _mentions = matcher.annotate(dataset_item.tokens)
+        mention_count += len(_mentions)
         dataset_item_id_with_mentions[dataset_item.id] = _mentions
 
     logger.info(f"Entities identified: {mention_count}")
@@ -369,55 +374,78 @@ async def preannotate_entity_project(
                 set([sf["surface_form"] for sf in surface_forms])
             )
             for entity_classification, surface_forms in itertools.groupby(
-                valid_entities, key=lambda x: x["classification"]
+                sorted(valid_entities, key=lambda x: x["classification"]),
+                key=lambda x: x["classification"],
             )
         }
 
         logger.info(f"gazetteer: {gazetteer}")
 
-        # Apply annotations using resource for scope of annotators
+        if dataset.preprocessing.tokenizer != "whitespace":
+            raise NotImplementedError("Tokenizer not supported")
+
+        # Each dataset item is tagged once and its mentions fanned out to every
+        # annotator that has it in scope.
         # Note: Annotations are applied with preference to longer spans.
+        item_annotators = defaultdict(list)
+        assignments = await find_project_assignments(db=db, project_id=project_id)
         for annotator in annotators:
-            dataset_item_ids = annotator.scope
-            logger.info(f"{annotator.username} - dataset_item_ids", dataset_item_ids)
-
-            dataset_items = (
-                await db["data"].find({"_id": {"$in": dataset_item_ids}}).to_list(None)
-            )
-
-            # Extract entity mentions from dataset items
-            dataset_item_entity_mentions = annotate_single_label(
-                gazetteer=gazetteer,
-                dataset_items=[DatasetItem(**di) for di in dataset_items],
-                preprocessing=dataset.preprocessing,
-            )
-            logger.info("dataset_item_entity_mentions", dataset_item_entity_mentions)
-
-            # Create entity markups
-            entity_templates = list(
-                itertools.chain.from_iterable(
-                    [
-                        [
-                            RichCreateEntity(
-                                project_id=project_id,
-                                dataset_item_id=dataset_item_id,
-                                created_by=annotator.username,
-                                suggested=True,
-                                classification="entity",
-                                ontology_item_id=valid_entity_fullnames_to_ontology_item_ids[
-                                    m["classification"]
-                                ],
-                                start=m["start"],
-                                end=m["end"],
-                                surface_form=m["surface_form"],
-                            ).dict()
-                            for m in entity_mentions
-                        ]
-                        for dataset_item_id, entity_mentions in dataset_item_entity_mentions.items()
-                    ]
-                )
+            for dataset_item_id in assignments.get(annotator.username, []):
+                item_annotators[dataset_item_id].append(annotator.username)
+
+        async def insert_mentions(
+            dataset_item_mentions: List[Tuple[ObjectId, List[Dict[str, Any]]]],
+        ) -> None:
+            entity_templates = [
+                RichCreateEntity(
+                    project_id=project_id,
+                    dataset_item_id=dataset_item_id,
+                    created_by=annotator_username,
+                    suggested=True,
+                    classification="entity",
+                    ontology_item_id=valid_entity_fullnames_to_ontology_item_ids[
+                        m["classification"]
+                    ],
+                    start=m["start"],
+                    end=m["end"],
+                    surface_form=m["surface_form"],
+                ).model_dump()
+                for dataset_item_id, entity_mentions in dataset_item_mentions
+                for m in entity_mentions
+                for annotator_username in item_annotators[dataset_item_id]
+            ]
+            if entity_templates:
+                await db["markup"].insert_many(entity_templates, ordered=False)
+
+        # CPU-bound tagging runs in a process pool whose workers compile the gazetteer
+        # once; chunks are streamed from the cursor and the number of in-flight chunks
+        # is bounded to keep memory flat.
+        loop = asyncio.get_running_loop()
+        max_pending = get_worker_count() * 2
+        chunk_size = settings.workers.preannotation_chunk_size
+
+        with initialized_process_pool(init_worker_matcher, (gazetteer,)) as pool:
+            pending = set()
+            chunk = []
+            cursor = db["data"].find(
+                {"_id": {"$in": list(item_annotators.keys())}}, {"tokens": 1}
             )
-            await db["markup"].insert_many(entity_templates)
+            async for di in cursor:
+                chunk.append((di["_id"], di["tokens"]))
+                if len(chunk) < chunk_size:
+                    continue
+                pending.add(loop.run_in_executor(pool, annotate_chunk, chunk))
+                chunk = []
+                if len(pending) >= max_pending:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        await insert_mentions(future.result())
+            if chunk:
+                pending.add(loop.run_in_executor(pool, annotate_chunk, chunk))
+            for future in asyncio.as_completed(pending):
+                await insert_mentions(await future)
 
 
 async def assign_bp_markup(
@@ -518,12 +546,188 @@ async def assign_bp_markup(
     logger.info("Annotated data markup copies have been added.")
 
 
+async def update_annotator_assignment(
+    db: AsyncIOMotorDatabase,
+    project_id: ObjectId,
+    annotator_username: str,
+    dataset_item_ids: List[ObjectId],
+    project_manager: str,
+    job: Optional[JobContext] = None,
+) -> int:
+    """Updates the scope/assignment of dataset items for a given annotator.
+
+    Dataset item ids are those that should be visible to the annotator; all others in
+    their scope are hidden. If the project is using an 'annotated' dataset, newly
+    assigned items receive copies of their blueprint markup in accordance with the
+    projects "suggested_preannotations" setting. When run as a background job,
+    progress is reported to `job` as markup is copied. Returns the number of changed
+    assignments.
+    """
+    project = await db["projects"].find_one(
+        {
+            "_id": project_id,
+            "created_by": project_manager,
+            "annotators.username": annotator_username,
+        },
+        {"settings": 1, "dataset_id": 1, "tasks": 1},
+    )
+    if project is None:
+        return 0
+
+    # "out_of_scope" dataset item ids are those not previously assigned to the annotator. These will be assigned markup (if applicable).
+    modified_count, out_of_scope_dataset_item_ids = await set_visible_dataset_items(
+        db=db,
+        project_id=project_id,
+        username=annotator_username,
+        dataset_item_ids=[ObjectId(di) for di in dataset_item_ids],
+    )
+
+    logger.info(f'"out_of_scope_dataset_item_ids": {out_of_scope_dataset_item_ids}')
+    if job:
+        await job.update_progress(0.2, "Updated annotator assignment")
+
+    if len(out_of_scope_dataset_item_ids) > 0:
+        # Assign preannotations (if applicable)
+        dataset = await db["datasets"].find_one({"_id": project["dataset_id"]})
+
+        # Check if project dataset is "annotated"
+        if dataset["is_annotated"]:
+            # Get dataset items that are "out of scope"
+            oos_dataset_items = (
+                await db["data"]
+                .find(
+                    {
+                        "project_id": project_id,
+                        "_id": {"$in": list(out_of_scope_dataset_item_ids)},
+                    }
+                )
+                .to_list(None)
+            )
+
+            logger.info(f"Found {len(oos_dataset_items)} out of scope dataset items")
+
+            # Create mapping between blueprint and project dataset item ids
+            dataset_item_id_map_bp2project = {
+                di["blueprint_dataset_item_id"]: di["_id"] for di in oos_dataset_items
+            }
+
+            logger.info(
+                f'"dataset_item_id_map_bp2project": {dataset_item_id_map_bp2project}'
+            )
+
+            # Get blueprint "_id" of dataset items - these are used to find blueprint markup
+            oos_bp_dataset_item_ids = [
+                di["blueprint_dataset_item_id"] for di in oos_dataset_items
+            ]
+
+            logger.info(f'"oos_bp_dataset_item_ids": {oos_bp_dataset_item_ids}')
+
+            bp_markup = (
+                await db["markup"]
+                .find(
+                    {
+                        "dataset_item_id": {
+                            "$in": oos_bp_dataset_item_ids,
+                        },
+                        "is_blueprint": True,
+                    }
+                )
+                .to_list(None)
+            )
+
+            logger.info(
+                f"Found {len(bp_markup)} blueprint markups that will be associated with this annotator"
+            )
+
+            # Assign markups to user for all newly assigned scope items
+            # This object holds a mapping between the original bp markup and the created markup; specifically so relation markup can be connected properly.
+            bp_entity_markup_id_map = {}
+
+            async def _copy_bp_markup(classification: str, markup):
+                try:
+                    copy_markup = dict(markup)
+                    copy_markup.pop("_id")
+
+                    # Modify the markup
+                    copy_markup["is_blueprint"] = False
+                    copy_markup["dataset_item_id"] = dataset_item_id_map_bp2project[
+                        copy_markup["dataset_item_id"]
+                    ]
+                    copy_markup["project_id"] = project_id
+                    copy_markup["created_by"] = annotator_username
+                    copy_markup["suggested"] = project["settings"][
+                        "suggested_preannotations"
+                    ]
+
+                    if classification == "relation":
+                        copy_markup["source_id"] = bp_entity_markup_id_map[
+                            copy_markup["source_id"]
+                        ]
+                        copy_markup["target_id"] = bp_entity_markup_id_map[
+                            copy_markup["target_id"]
+                        ]
+
+                    # Insert the modified markup into the database
+                    new_markup = await db["markup"].insert_one({**copy_markup})
+                    return new_markup.inserted_id
+                except Exception as e:
+                    logger.info(f"Failed to copy bp markup: {e}")
+
+            copied = 0
+
+            async def _report_copy_progress():
+                nonlocal copied
+                copied += 1
+                if job and copied % COPY_PROGRESS_INTERVAL == 0:
+                    await job.update_progress(
+                        0.2 + 0.7 * copied / len(bp_markup),
+                        f"Copied {copied} of {len(bp_markup)} markup",
+                    )
+
+            # Process entity markup first
+            logger.info("Copying entity markup(s)")
+            for markup in [m for m in bp_markup if m["classification"] == "entity"]:
+                old_markup_id = markup["_id"]  # This is the blueprints _id
+                new_markup_id = await _copy_bp_markup(
+                    classification="entity", markup=markup
+                )
+                bp_entity_markup_id_map[old_markup_id] = new_markup_id
+                await _report_copy_progress()
+
+            logger.info("bp_entity_markup_id_map", bp_entity_markup_id_map)
+
+            # Process relation markup if project requests it
+            if project["tasks"]["relation"]:
+                logger.info("Copying relation markup(s)")
+                for markup in [
+                    m for m in bp_markup if m["classification"] == "relation"
+                ]:
+                    await _copy_bp_markup(classification="relation", markup=markup)
+                    await _report_copy_progress()
+
+            # Output the completion of the addition of annotated data markup copies
+            logger.info("Annotated data markup copies have been added.")
+
+            await update_project_graph(
+                db=db,
+                project_id=project_id,
+                dataset_item_ids=list(dataset_item_id_map_bp2project.values()),
+            )
+
+    return modified_count
+
+
 async def create_project(
-    db: AsyncIOMotorDatabase, project: CreateProject, username: str
+    db: AsyncIOMotorDatabase,
+    project: CreateProject,
+    username: str,
+    job: Optional[JobContext] = None,
 ) -> Optional[Project]:
     """Creates a project.
 
-    Optional preannotation will preannotate markup set as suggested.
+    Optional preannotation will preannotate markup set as suggested. When run as a
+    background job, progress is reported to `job` and a cancelled job removes the
+    partially created project.
     """
     logger.info("Creating new project.")
     project = project.model_dump()
@@ -605,6 +809,8 @@ async def create_project(
             return
         project_dataset_id, dataset_item_id_map_bp2project = bp_dataset_result
         logger.info("Created project dataset")
+        if job:
+            await job.update_progress(0.4, "Created project dataset")
 
         # Create annotators and send invitations to the project
         annotators = await add_project_annotators(
@@ -618,6 +824,8 @@ async def create_project(
         if annotators is None:
             return
         logger.info("Added project annotators")
+        if job:
+            await job.update_progress(0.6, "Added project annotators")
 
         bp_dataset_id = ObjectId(project["blueprint_dataset_id"])
         bp_dataset = await db["datasets"].find_one({"_id": bp_dataset_id})
@@ -670,6 +878,8 @@ async def create_project(
         await delete_one_project(
             db=db, project_id=new_project.inserted_id, username=username
         )
+        if isinstance(e, JobCancelledError):
+            raise
         return
 
 
@@ -880,9 +1090,18 @@ async def delete_one_project(
 
         # Delete project
         await db["projects"].delete_one({"_id": project_id, "created_by": username})
+        invalidate_document("projects", project_id)
 
         # Delete project dataset and dataset items
         await db["data"].delete_many({"dataset_id": project["dataset_id"]})
+        await remove_dataset_from_index(db=db, dataset_id=project["dataset_id"])
+        await db[CLUSTERS_COLLECTION].delete_many({"dataset_id": project["dataset_id"]})
+        await db[MARKUP_SIGNATURES_COLLECTION].delete_many(
+            {"dataset_id": project["dataset_id"]}
+        )
+        await db["project_stats"].delete_one({"_id": project_id})
+        await delete_project_graph(db=db, project_id=project_id)
+        await delete_project_assignments(db=db, project_id=project_id)
         await db["datasets"].delete_one({"_id": project["dataset_id"]})
 
         return True
@@ -942,91 +1161,124 @@ async def get_project_progress(
         return None
 
 
-async def calculate_and_update_iaa(
-    db: AsyncIOMotorDatabase, item_id: ObjectId, dataset_item: dict
+async def update_markup_signatures(
+    db: AsyncIOMotorDatabase, dataset_items: List[dict], username: str
 ) -> None:
-    """Helper function to calculate and update IAA for a single item."""
-    try:
-        saved_users = [ss["created_by"] for ss in dataset_item["save_states"]]
+    """Recomputes a user's markup signature sets on dataset items from their markup."""
+    markup = (
+        await db["markup"]
+        .find(
+            {
+                "dataset_item_id": {"$in": [di["_id"] for di in dataset_items]},
+                "created_by": username,
+            },
+            {
+                "classification": 1,
+                "dataset_item_id": 1,
+                "start": 1,
+                "end": 1,
+                "ontology_item_id": 1,
+                "source_id": 1,
+                "target_id": 1,
+            },
+        )
+        .to_list(None)
+    )
+    signatures = markup_signatures(markup)
 
-        # Only calculate IAA if we have more than one saved user
-        if len(saved_users) < 2:
-            return
+    await db[MARKUP_SIGNATURES_COLLECTION].bulk_write(
+        [
+            UpdateOne(
+                {"dataset_item_id": di["_id"], "created_by": username},
+                {
+                    "$set": {
+                        "dataset_id": di["dataset_id"],
+                        **signatures.get(di["_id"], {"entity": [], "relation": []}),
+                        "updated_at": datetime.utcnow(),
+                    }
+                },
+                upsert=True,
+            )
+            for di in dataset_items
+        ],
+        ordered=False,
+    )
 
-        entity_markup = [
-            e for e in dataset_item["markup"] if e["classification"] == "entity"
-        ]
-        relation_markup = [
-            r for r in dataset_item["markup"] if r["classification"] == "relation"
-        ]
 
-        agreement_calculator = AgreementCalculator(
-            entity_data=[
-                {
-                    "start": m["start"],
-                    "end": m["end"],
-                    "label": m["ontology_item_id"],
-                    "username": m["created_by"],
-                    "doc_id": str(dataset_item["_id"]),
-                }
-                for m in entity_markup
-                if m["created_by"] in saved_users
-            ],
-            relation_data=[
-                {
-                    "label": m["ontology_item_id"],
-                    "username": m["created_by"],
-                    "source": {
-                        "start": m["source"]["start"],
-                        "end": m["source"]["end"],
-                        "label": m["source"]["ontology_item_id"],
-                    },
-                    "target": {
-                        "start": m["target"]["start"],
-                        "end": m["target"]["end"],
-                        "label": m["target"]["ontology_item_id"],
-                    },
-                    "doc_id": str(dataset_item["_id"]),
-                }
-                for m in relation_markup
-                if m["created_by"] in saved_users
-            ],
-        )
+async def update_iaa(db: AsyncIOMotorDatabase, dataset_items: List[dict]) -> None:
+    """Calculates and writes IAA for dataset items saved by more than one user.
 
-        entity_overall_agreement_score = agreement_calculator.overall_agreement()
-        entity_pairwise_agreement_scores = agreement_calculator.calculate_agreements()
-        relation_overall_agreement_score = agreement_calculator.overall_agreement(
-            "relation"
+    Agreement is calculated from the markup signature sets of the saved users. Users
+    without signatures, e.g. those who saved before signatures were kept, have them
+    built from their markup first.
+    """
+    dataset_items = [di for di in dataset_items if len(di.get("save_states", [])) > 1]
+    if len(dataset_items) == 0:
+        return
+
+    dataset_item_ids = [di["_id"] for di in dataset_items]
+
+    async def find_signatures():
+        signatures = defaultdict(dict)
+        async for s in db[MARKUP_SIGNATURES_COLLECTION].find(
+            {"dataset_item_id": {"$in": dataset_item_ids}}
+        ):
+            signatures[s["dataset_item_id"]][s["created_by"]] = s
+        return signatures
+
+    signatures = await find_signatures()
+
+    missing = defaultdict(list)
+    for di in dataset_items:
+        for ss in di["save_states"]:
+            if ss["created_by"] not in signatures[di["_id"]]:
+                missing[ss["created_by"]].append(di)
+    if missing:
+        for username, items in missing.items():
+            await update_markup_signatures(
+                db=db, dataset_items=items, username=username
+            )
+        signatures = await find_signatures()
+
+    updates = []
+    for di in dataset_items:
+        saved_users = [ss["created_by"] for ss in di["save_states"]]
+        iaa = signature_agreement(
+            {username: signatures[di["_id"]][username] for username in saved_users}
         )
-        relation_pairwise_agreement_scores = agreement_calculator.calculate_agreements(
-            "relation"
+        logger.info(f'IAA for item "{di["_id"]}": {iaa["agreement"]["overall"]}')
+        updates.append(
+            UpdateOne(
+                {"_id": di["_id"]},
+                {"$set": {"iaa": {**iaa, "last_updated": datetime.utcnow()}}},
+            )
         )
-        overall_agreement_score = agreement_calculator.overall_average_agreement()
 
-        logger.info(f'IAA for item "{item_id}": {overall_agreement_score}')
+    await db["data"].bulk_write(updates, ordered=False)
 
-        await db["data"].update_one(
-            {"_id": item_id},
-            {
-                "$set": {
-                    "iaa": {
-                        "agreement": {
-                            "overall": overall_agreement_score,
-                            "entity": entity_overall_agreement_score,
-                            "relation": relation_overall_agreement_score,
-                        },
-                        "pairwise_agreement": {
-                            "relation": relation_pairwise_agreement_scores,
-                            "entity": entity_pairwise_agreement_scores,
-                        },
-                        "last_updated": datetime.utcnow(),
-                    }
-                }
-            },
-            upsert=False,
+
+async def refresh_item_iaa(
+    db: AsyncIOMotorDatabase, dataset_item_id: ObjectId, username: str
+) -> None:
+    """Updates a user's signatures and the IAA of an item after its markup changes.
+
+    Signatures only count towards IAA once an item is saved, so unsaved items are skipped;
+    their signatures are built when they are saved.
+    """
+    try:
+        dataset_item = await db["data"].find_one(
+            {"_id": dataset_item_id, "save_states.created_by": username},
+            {"dataset_id": 1, "save_states": 1},
         )
+        if dataset_item is None:
+            return
+
+        await update_markup_signatures(
+            db=db, dataset_items=[dataset_item], username=username
+        )
+        await update_iaa(db=db, dataset_items=[dataset_item])
     except Exception as e:
-        logger.error(f"Error calculating IAA for item {item_id}: {str(e)}")
+        logger.error(f"Error updating IAA for item {dataset_item_id}: {str(e)}")
 
 
 async def save_many_dataset_items(
@@ -1036,84 +1288,7 @@ async def save_many_dataset_items(
 ) -> SaveResponse:
     """Saves many dataset items for a user and calculates IAA when appropriate."""
     new_save_state = BaseSaveState(created_by=username).model_dump()
-
-    # Pipeline for getting markup data for IAA calculation
-    markup_pipeline = [
-        {"$match": {"_id": {"$in": [ObjectId(oid) for oid in dataset_item_ids]}}},
-        {
-            "$addFields": {
-                "save_states": {
-                    "$ifNull": ["$save_states", []],
-                },
-            },
-        },
-        {
-            "$lookup": {
-                "from": "markup",
-                "localField": "_id",
-                "foreignField": "dataset_item_id",
-                "as": "markup",
-            }
-        },
-        {
-            "$unwind": {
-                "path": "$markup",
-                "preserveNullAndEmptyArrays": True,
-            },
-        },
-        {
-            "$lookup": {
-                "from": "markup",
-                "localField": "markup.source_id",
-                "foreignField": "_id",
-                "as": "source",
-            }
-        },
-        {
-            "$lookup": {
-                "from": "markup",
-                "localField": "markup.target_id",
-                "foreignField": "_id",
-                "as": "target",
-            }
-        },
-        {"$unwind": {"path": "$source", "preserveNullAndEmptyArrays": True}},
-        {"$unwind": {"path": "$target", "preserveNullAndEmptyArrays": True}},
-        {
-            "$project": {
-                "source.project_id": 0,
-                "source.dataset_item_id": 0,
-                "source.created_at": 0,
-                "source.updated_at": 0,
-                "target.project_id": 0,
-                "target.dataset_item_id": 0,
-                "target.created_at": 0,
-                "target.updated_at": 0,
-                "project_id": 0,
-                "target._id": 0,
-                "source._id": 0,
-                "markup.dataset_item_id": 0,
-                "markup.is_blueprint": 0,
-                "markup.created_at": 0,
-                "markup.project_id": 0,
-                "markup._id": 0,
-                "markup.source_id": 0,
-                "markup.target_id": 0,
-                "markup.source.is_blueprint": 0,
-                "markup.target.is_blueprint": 0,
-            }
-        },
-        {"$addFields": {"markup.source": "$source", "markup.target": "$target"}},
-        {
-            "$group": {
-                "_id": "$_id",
-                "markup": {"$push": "$markup"},
-                "save_states": {"$first": "$save_states"},
-                "tokens": {"$first": "$tokens"},
-                "original": {"$first": "$original"},
-            }
-        },
-    ]
+    projection = {"dataset_id": 1, "save_states": 1}
 
     if len(dataset_item_ids) > 1:
         # Bulk save - only set to saved, doesn't permit unsave
@@ -1127,9 +1302,17 @@ async def save_many_dataset_items(
         )
 
         if result.modified_count > 0:
-            dataset_items = await db.data.aggregate(markup_pipeline).to_list(None)
-            for item in dataset_items:
-                await calculate_and_update_iaa(db, item["_id"], item)
+            dataset_items = await db.data.find(
+                {"_id": {"$in": dataset_item_ids}, "save_states.created_by": username},
+                projection,
+            ).to_list(None)
+            try:
+                await update_markup_signatures(
+                    db=db, dataset_items=dataset_items, username=username
+                )
+                await update_iaa(db=db, dataset_items=dataset_items)
+            except Exception as e:
+                logger.error(f"Error calculating IAA for saved items: {str(e)}")
 
         return SaveResponse(count=result.modified_count)
     else:
@@ -1147,13 +1330,8 @@ async def save_many_dataset_items(
                 upsert=False,
             )
 
-            # Get updated item data and calculate IAA
-            dataset_item = (
-                await db["data"]
-                .aggregate([{"$match": {"_id": item_id}}] + markup_pipeline[1:])
-                .next()
-            )
-            await calculate_and_update_iaa(db, item_id, dataset_item)
+            # Update the user's signatures and calculate IAA
+            await refresh_item_iaa(db=db, dataset_item_id=item_id, username=username)
 
             return SaveResponse(count=1)
         else:
@@ -1169,12 +1347,13 @@ async def save_many_dataset_items(
 
             # Recalculate IAA after unsave if there are still multiple saves
             if len(di_save_states) > 1:
-                dataset_item = (
-                    await db["data"]
-                    .aggregate([{"$match": {"_id": item_id}}] + markup_pipeline[1:])
-                    .next()
-                )
-                await calculate_and_update_iaa(db, item_id, dataset_item)
+                try:
+                    await update_iaa(
+                        db=db,
+                        dataset_items=[{**di, "save_states": di_save_states}],
+                    )
+                except Exception as e:
+                    logger.error(f"Error calculating IAA for item {item_id}: {str(e)}")
             else:
                 logger.info(f"Unsaved item {item_id} has less than 2 saves")
             return SaveResponse(count=1)
@@ -1229,9 +1408,7 @@ async def invite_single_project_annotator(
 
     dataset_id = project.dataset_id
 
-    # TODO: refactor
-    dataset_item_ids = await db["data"].find({"dataset_id": dataset_id}).to_list(None)
-    dataset_item_ids = [di["_id"] for di in dataset_item_ids]
+    dataset_item_ids = await db["data"].distinct("_id", {"dataset_id": dataset_id})
 
     # Add user to project
     await db["projects"].update_one(
@@ -1242,11 +1419,17 @@ async def invite_single_project_annotator(
                     username=invitee_username,
                     role=AnnotatorRoles.annotator.value,
                     state=AnnotatorStates.invited.value,
-                    scope=dataset_item_ids,
                 ).dict()
             }
         },
     )
+    invalidate_document("projects", project_id)
+    await assign_dataset_items(
+        db=db,
+        project_id=project_id,
+        username=invitee_username,
+        dataset_item_ids=dataset_item_ids,
+    )
 
     invited_annotator = await get_project_annotator(
         db=db, project_id=project_id, username=invitee_username
@@ -1301,11 +1484,17 @@ async def delete_single_project_annotator(
             {"_id": project_id},
             {"$pull": {"annotators": {"username": annotator_username}}},
         )
+        invalidate_document("projects", project_id)
+
+        await delete_annotator_assignments(
+            db=db, project_id=project_id, username=annotator_username
+        )
 
         # Remove annotator markup
         await db["markup"].delete_many(
             {"project_id": project_id, "created_by": annotator_username}
         )
+        await update_project_graph(db=db, project_id=project_id)
 
         # Remove existing notification(s)
         await db["notifications"].delete_many({"content_id": project_id})
@@ -1671,9 +1860,12 @@ async def invite_users_to_project(
     sender_username: str,
     project_id: ObjectId,
     body: UserInviteBody,
+    job: Optional[JobContext] = None,
 ) -> UserInviteResponse:
     """Invite one or more users to a project after checking existence.
 
+    When run as a background job, progress is reported to `job` before each write.
+
     TODO
     ----
     - add document distribution functionality.
@@ -1695,17 +1887,26 @@ async def invite_users_to_project(
         )
 
     # Check annotators exist and filter those that are invalid (don't exist or already on project/invited but not accepted)
+    existing_usernames = {
+        u["username"]
+        async for u in db.users.find(
+            {"username": {"$in": body.usernames}}, {"username": 1}
+        )
+    }
+    project_usernames = {a["username"] for a in project["annotators"]}
     valid_annotators = [
         username
         for username in body.usernames
-        if await db.users.find_one({"username": username})
-        and username not in [a["username"] for a in project["annotators"]]
+        if username in existing_usernames and username not in project_usernames
     ]
     logger.info(f"valid_annotators: {valid_annotators}")
 
     if len(valid_annotators) == 0:
         return UserInviteResponse(valid=[], invalid=body.usernames)
 
+    if job:
+        await job.update_progress(0.3, f"Inviting {len(valid_annotators)} users")
+
     # Create notifications
     notifications = await create_many_project_invitations(
         db=db,
@@ -1715,6 +1916,8 @@ async def invite_users_to_project(
         username=sender_username,
     )
     logger.info(f"Created {len(notifications)} notifications")
+    if job:
+        await job.update_progress(0.6, f"Created {len(notifications)} notifications")
 
     # Fetch dataset item ids to associate to users
     # dataset_item_ids = (
@@ -1729,14 +1932,14 @@ async def invite_users_to_project(
             username=username,
             role=AnnotatorRoles.annotator,
             state=AnnotatorStates.invited,
-            scope=[],  # Scope is assigned manually by PM -  [di["_id"] for di in dataset_item_ids
-        ).model_dump()
+        ).model_dump()  # Scope is assigned manually by PM
         for username in valid_annotators
     ]
 
     await db["projects"].update_one(
         {"_id": project_id}, {"$push": {"annotators": {"$each": rich_annotators}}}
     )
+    invalidate_document("projects", project_id)
 
     # TODO: assign preannotation markup to invited annotators...
     # - Check if project blue print is annotated.
@@ -1750,6 +1953,7 @@ async def invite_users_to_project(
     updated_project = await db["projects"].find_one(
         {"_id": project_id}, {"annotators": 1}
     )
+    scope_sizes = await count_assigned_dataset_items(db=db, project_id=project_id)
 
     return UserInviteResponse(
         valid=[
@@ -1757,7 +1961,7 @@ async def invite_users_to_project(
                 "username": a["username"],
                 "state": a["state"],
                 "role": a["role"],
-                "scope_size": len(a["scope"]),
+                "scope_size": scope_sizes.get(a["username"], 0),
             }
             for a in updated_project["annotators"]
         ],
@@ -1808,6 +2012,9 @@ async def remove_user_from_project(
             },
         },
     )
+    invalidate_document("projects", project_id)
+    await delete_annotator_assignments(db=db, project_id=project_id, username=username)
+    await update_project_graph(db=db, project_id=project_id)
 
     # Remove any invitations to the project
     await db["notifications"].delete_one(
@@ -1819,10 +2026,46 @@ async def remove_user_from_project(
     return {"detail": "User removed from project"}
 
 
+async def encode_project_download_items(
+    db: AsyncIOMotorDatabase, project_id: ObjectId, dataset_items: List[Dict[str, Any]]
+) -> str:
+    """Encodes a batch of dataset items, joined with their markup and social, as NDJSON."""
+    dataset_item_ids = [di["_id"] for di in dataset_items]
+
+    markup = defaultdict(list)
+    async for m in db["markup"].find(
+        {"project_id": project_id, "dataset_item_id": {"$in": dataset_item_ids}}
+    ):
+        markup[m["dataset_item_id"]].append(
+            Entity(**m) if m["classification"] == "entity" else Relation(**m)
+        )
+
+    social = defaultdict(list)
+    async for s in db["social"].find({"dataset_item_id": {"$in": dataset_item_ids}}):
+        social[s["dataset_item_id"]].append(ProjectSocial(**s))
+
+    return "".join(
+        encode_json_line(
+            {
+                "type": "dataset_item",
+                "dataset_item": ProjectDownloadItem(
+                    **di, markup=markup[di["_id"]], social=social[di["_id"]]
+                ).model_dump(mode="json", by_alias=True),
+            }
+        )
+        for di in dataset_items
+    )
+
+
 async def download_project(
     db: AsyncIOMotorDatabase, project_id: ObjectId
-) -> ProjectDownload:
-    """Creates a payload for entire project download."""
+) -> AsyncIterator[str]:
+    """Creates the NDJSON records of an entire project download.
+
+    The project and dataset records are followed by one record per dataset item holding
+    its markup and social. Items are read in id order one batch at a time, so memory use
+    does not depend on the size of the project.
+    """
     project = await db["projects"].find_one({"_id": project_id})
 
     if project is None:
@@ -1830,31 +2073,43 @@ async def download_project(
             status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
         )
 
-    # Dataset
     dataset = await db["datasets"].find_one({"_id": project["dataset_id"]})
 
-    # Dataset items
-    dataset_items = (
-        await db["data"].find({"dataset_id": project["dataset_id"]}).to_list(None)
-    )
-
-    # Markup
-    markup = await db["markup"].find({"project_id": project_id}).to_list(None)
+    async def records() -> AsyncIterator[str]:
+        yield encode_json_line(
+            {
+                "type": "project",
+                "project": Project(**project).model_dump(mode="json", by_alias=True),
+            }
+        )
+        yield encode_json_line(
+            {
+                "type": "dataset",
+                "dataset": ProjectDataset(**dataset).model_dump(
+                    mode="json", by_alias=True
+                ),
+            }
+        )
 
-    # Socials
-    social = (
-        await db["social"]
-        .find({"dataset_item_id": {"$in": [di["_id"] for di in dataset_items]}})
-        .to_list(None)
-    )
+        # Batches are read by id rather than from one cursor, which could time out
+        # while a slow client consumes the stream.
+        last_id = None
+        while True:
+            _filter = {"dataset_id": project["dataset_id"]}
+            if last_id is not None:
+                _filter["_id"] = {"$gt": last_id}
+            dataset_items = (
+                await db["data"]
+                .find(_filter)
+                .sort("_id", 1)
+                .limit(EXPORT_BATCH_SIZE)
+                .to_list(None)
+            )
+            if len(dataset_items) == 0:
+                break
+            yield await encode_project_download_items(
+                db=db, project_id=project_id, dataset_items=dataset_items
+            )
+            last_id = dataset_items[-1]["_id"]
 
-    return ProjectDownload(
-        project=project,
-        dataset=ProjectDataset(**dataset),
-        dataset_items=[ProjectDatasetItem(**i) for i in dataset_items],
-        markup=[
-            Entity(**i) if i["classification"] == "entity" else Relation(**i)
-            for i in markup
-        ],
-        social=[ProjectSocial(**i) for i in social],
-    )
+    return records()
@@ -0,0 +1,108 @@
+"""Compiled ontologies.
+
+Ontology resources hold a hierarchy of items. Compiling flattens it once into
+depth-first ordered columns (ids, names, fullnames, colours, active flags and ancestor
+paths) that are stored with the resource under `compiled` and recomputed only when its
+content changes. The id index is rebuilt when a compiled ontology is loaded, as item ids
+may contain dots and cannot be stored as document keys.
+"""
+
+from functools import cached_property
+from typing import Any, Dict, List, Optional
+
+# Increment when the compiled layout changes; older layouts are recompiled on load.
+COMPILED_ONTOLOGY_VERSION = 1
+
+# Defaults of the corresponding `OntologyItem` fields
+DEFAULT_COLOR = "#000000"
+
+
+def compile_ontology(content: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Compiles hierarchical ontology content into flat lookup tables."""
+    compiled = {
+        "version": COMPILED_ONTOLOGY_VERSION,
+        "ids": [],
+        "names": [],
+        "fullnames": [],
+        "colors": [],
+        "active": [],
+        "ancestors": [],
+    }
+
+    def visit(items: List[Dict[str, Any]], ancestors: List[int]) -> None:
+        for item in items:
+            position = len(compiled["ids"])
+            compiled["ids"].append(item.get("id"))
+            compiled["names"].append(item["name"])
+            compiled["fullnames"].append(item.get("fullname", ""))
+            compiled["colors"].append(item.get("color", DEFAULT_COLOR))
+            compiled["active"].append(item.get("active", True))
+            compiled["ancestors"].append(ancestors)
+            if item.get("children"):
+                visit(item["children"], ancestors + [position])
+
+    visit(content, [])
+    return compiled
+
+
+def is_compiled(resource: Dict[str, Any]) -> bool:
+    compiled = resource.get("compiled")
+    return compiled is not None and compiled.get("version") == COMPILED_ONTOLOGY_VERSION
+
+
+class CompiledOntology:
+    """Read-only lookup tables of a compiled ontology.
+
+    Instances are cached and shared between requests; they must not be modified.
+    """
+
+    def __init__(self, compiled: Dict[str, Any]) -> None:
+        self.ids: List[str] = compiled["ids"]
+        self.names: List[str] = compiled["names"]
+        self.fullnames: List[str] = compiled["fullnames"]
+        self.colors: List[Optional[str]] = compiled["colors"]
+        self.active: List[bool] = compiled["active"]
+        self.ancestors: List[List[int]] = compiled["ancestors"]
+        self.index: Dict[str, int] = {
+            item_id: position for position, item_id in enumerate(self.ids)
+        }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self.index
+
+    def fullname(self, item_id: str) -> Optional[str]:
+        position = self.index.get(item_id)
+        return None if position is None else self.fullnames[position]
+
+    def ancestor_ids(self, item_id: str) -> List[str]:
+        """Returns the ids of an item's ancestors, from the root down."""
+        position = self.index.get(item_id)
+        if position is None:
+            return []
+        return [self.ids[p] for p in self.ancestors[position]]
+
+    @cached_property
+    def id2fullname(self) -> Dict[str, str]:
+        return dict(zip(self.ids, self.fullnames))
+
+    @cached_property
+    def fullname2color(self) -> Dict[str, Optional[str]]:
+        return dict(zip(self.fullnames, self.colors))
+
+    @cached_property
+    def details(self) -> Dict[str, Dict[str, Any]]:
+        """Maps item ids to their name, fullname, color and active flag."""
+        return {
+            item_id: {
+                "name": name,
+                "fullname": fullname,
+                "color": color,
+                "active": active,
+            }
+            for item_id, name, fullname, color, active in zip(
+                self.ids, self.names, self.fullnames, self.colors, self.active
+            )
+        }
@@ -28,6 +28,7 @@ from .services import (
     update_one_resource,
 )
 from ..settings import settings
+from ..utils.cache import invalidate_document
 
 logger = logging.getLogger(__name__)
 
@@ -133,6 +134,7 @@ async def update_resource_constraints_endpoint(
             }
         },
     )
+    invalidate_document("resources", resource_id)
 
     if result.modified_count == 0:
         raise HTTPException(
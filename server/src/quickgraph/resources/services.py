@@ -11,7 +11,9 @@ from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from ..settings import settings
+from ..utils.cache import cached, invalidate_document
 from ..utils.misc import flatten_hierarchical_ontology
+from .ontology import CompiledOntology, compile_ontology, is_compiled
 from .schemas import (
     AggregateResourcesModel,
     BaseOntologyItem,
@@ -182,16 +184,12 @@ async def create_one_resource(
     resource = resource.model_dump(exclude_none=False)
     content = resource.pop("content")
 
+    if resource["classification"] == "ontology":
+        content = initialize_ontology(content)
+        resource["compiled"] = compile_ontology(content)
+
     new_resource = await db[COLLECTION_NAME].insert_one(
-        {
-            **resource,
-            "created_by": username,
-            **(
-                {"content": initialize_ontology(content)}
-                if resource["classification"] == "ontology"
-                else {"content": content}
-            ),
-        }
+        {**resource, "created_by": username, "content": content}
     )
     return await db[COLLECTION_NAME].find_one({"_id": new_resource.inserted_id})
 
@@ -254,9 +252,11 @@ async def find_many_resources(
 async def delete_one_resource(
     db: AsyncIOMotorDatabase, resource_id: ObjectId, username: str
 ):
-    return await db[COLLECTION_NAME].delete_one(
+    result = await db[COLLECTION_NAME].delete_one(
         {"_id": resource_id, "created_by": username}
     )
+    invalidate_document("resources", resource_id)
+    return result
 
 
 async def update_one_resource(
@@ -305,8 +305,10 @@ async def update_one_resource(
         updated_content = initialize_ontology(data=body["content"])
         logger.info(f"output content: {updated_content}")
         body["content"] = updated_content
+        body["compiled"] = compile_ontology(updated_content)
 
     result = await db.resources.update_one({"_id": resource_id}, {"$set": body})
+    invalidate_document("resources", resource_id)
 
     if result.modified_count == 0:
         logger.info("Resource not updated")
@@ -413,30 +415,75 @@ async def get_project_ontology_items(
     Returns:
         tuple: (entity_onto, relation_onto, combined_onto) where relation_onto might be empty
     """
-    # Get all ontology items for the project
-    entity_onto = await db[COLLECTION_NAME].find_one(
-        {
-            "classification": "ontology",
-            "sub_classification": "entity",
-            "project_id": project_id,
-        }
-    )
-    relation_onto = await db[COLLECTION_NAME].find_one(
-        {
-            "classification": "ontology",
-            "sub_classification": "relation",
-            "project_id": project_id,
-        }
-    )
 
-    entity_onto = [OntologyItem(**o) for o in entity_onto["content"]]
+    async def load():
+        # Get all ontology items for the project
+        entity_resource = await db[COLLECTION_NAME].find_one(
+            {
+                "classification": "ontology",
+                "sub_classification": "entity",
+                "project_id": project_id,
+            }
+        )
+        relation_resource = await db[COLLECTION_NAME].find_one(
+            {
+                "classification": "ontology",
+                "sub_classification": "relation",
+                "project_id": project_id,
+            }
+        )
+
+        entity_onto = [OntologyItem(**o) for o in entity_resource["content"]]
 
-    if relation_onto is None:
-        relation_onto = []
-    else:
-        relation_onto = [OntologyItem(**o) for o in relation_onto["content"]]
+        if relation_resource is None:
+            relation_onto = []
+        else:
+            relation_onto = [OntologyItem(**o) for o in relation_resource["content"]]
+
+        return (entity_onto, relation_onto), [
+            r for r in [entity_resource, relation_resource] if r is not None
+        ]
+
+    entity_onto, relation_onto = await cached(
+        "resources", ("ontology", project_id), load
+    )
 
     # Combine ontologies, even if relation_onto is empty
     combined_onto = entity_onto + relation_onto
 
-    return entity_onto, relation_onto, combined_onto
+    return list(entity_onto), list(relation_onto), combined_onto
+
+
+async def get_project_compiled_ontologies(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> Dict[str, CompiledOntology]:
+    """Get the compiled entity and relation ontologies of a project.
+
+    Ontologies stored without an up-to-date compiled form are compiled once and the
+    result is saved with the resource.
+
+    Returns:
+        dict: compiled ontologies keyed by sub classification; "relation" may be missing.
+    """
+
+    async def load():
+        resources = (
+            await db[COLLECTION_NAME]
+            .find({"classification": "ontology", "project_id": project_id})
+            .to_list(None)
+        )
+        for resource in resources:
+            if not is_compiled(resource):
+                resource["compiled"] = compile_ontology(resource["content"])
+                await db[COLLECTION_NAME].update_one(
+                    {"_id": resource["_id"]},
+                    {"$set": {"compiled": resource["compiled"]}},
+                )
+
+        ontologies = {
+            r["sub_classification"]: CompiledOntology(r["compiled"]) for r in resources
+        }
+        return ontologies or None, resources
+
+    ontologies = await cached("resources", ("compiled", project_id), load)
+    return dict(ontologies or {})
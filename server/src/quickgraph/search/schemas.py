@@ -0,0 +1,24 @@
+"""Search schemas."""
+
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from ..utils.schemas import PydanticObjectIdAnnotated
+
+
+class SearchTerm(BaseModel):
+    words: List[str] = Field(description="The normalized words of the term, in order")
+    prefix: bool = Field(
+        default=False, description="Whether the last word is matched as a prefix"
+    )
+
+
+class SearchResult(BaseModel):
+    dataset_item_ids: List[PydanticObjectIdAnnotated] = Field(
+        description="The ids of the matching dataset items in id order"
+    )
+    count: int = Field(description="The number of matching dataset items returned")
+    has_more: bool = Field(
+        default=False, description="Whether more dataset items match beyond the limit"
+    )
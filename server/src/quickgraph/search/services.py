@@ -0,0 +1,362 @@
+"""Search services.
+
+Dataset items are searched through the normalized terms of the token index and entity
+markup through the normalized `terms` of its surface forms, in place of case-insensitive
+regular expressions over text. A search is a comma separated list of terms that must all
+be present. A term may hold several words, which must be adjacent and in order, and a
+trailing `*` matches its last word as a prefix.
+
+Dataset items are searched in id order, in batches driven by the postings of one search
+word, so a page of results is found without collecting every matching item.
+"""
+
+import logging
+import re
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from ..dataset.index import (
+    TOKEN_INDEX_COLLECTION,
+    ensure_dataset_indexed,
+    normalize_term,
+    surface_form_terms,
+)
+from .schemas import SearchResult, SearchTerm
+
+logger = logging.getLogger(__name__)
+
+TERM_SEPARATOR = ","
+PREFIX_WILDCARD = "*"
+
+# Dataset items checked against every search term at a time
+SEARCH_BATCH_SIZE = 1000
+
+# Entity markup given search terms per `bulk_write` when backfilling
+BACKFILL_BATCH_SIZE = 1000
+
+
+def parse_search_terms(search_term: str, prefix_last: bool = False) -> List[SearchTerm]:
+    """Parses a comma separated search into its terms.
+
+    Args:
+        search_term: The search entered by the user.
+        prefix_last: Matches the last word of every term as a prefix, as when searching
+            while the user types.
+    """
+    terms = []
+    for raw_term in search_term.split(TERM_SEPARATOR):
+        raw_term = raw_term.strip()
+        words = [normalize_term(w) for w in raw_term.rstrip(PREFIX_WILDCARD).split()]
+        if words:
+            terms.append(
+                SearchTerm(
+                    words=words,
+                    prefix=prefix_last or raw_term.endswith(PREFIX_WILDCARD),
+                )
+            )
+    return terms
+
+
+def term_positions(tokens: Iterable[str]) -> Dict[str, Set[int]]:
+    """Maps the normalized terms of a token sequence to their positions."""
+    positions = defaultdict(set)
+    for i, token in enumerate(tokens):
+        positions[normalize_term(token)].add(i)
+    return positions
+
+
+def match_search_term(term: SearchTerm, positions: Dict[str, Set[int]]) -> bool:
+    """Checks whether a term occurs in a token sequence given its term positions."""
+    columns = []
+    for i, word in enumerate(term.words):
+        if term.prefix and i == len(term.words) - 1:
+            columns.append(
+                set().union(*(p for t, p in positions.items() if t.startswith(word)))
+            )
+        else:
+            columns.append(positions.get(word, set()))
+
+    return any(
+        all(start + i in column for i, column in enumerate(columns[1:], 1))
+        for start in columns[0]
+    )
+
+
+def create_term_query(terms: List[SearchTerm]) -> Dict[str, Any]:
+    """Creates the token index query for the postings of every word of the terms."""
+    exact_words = set()
+    prefixes = set()
+    for term in terms:
+        exact_words.update(term.words[:-1] if term.prefix else term.words)
+        if term.prefix:
+            prefixes.add(term.words[-1])
+
+    conditions = [{"term": {"$in": list(exact_words)}}] if exact_words else []
+    # Anchored prefix expressions are answered from the term index.
+    conditions += [{"term": {"$regex": f"^{re.escape(p)}"}} for p in prefixes]
+    return {"$or": conditions}
+
+
+def create_markup_term_query(terms: List[SearchTerm]) -> Dict[str, Any]:
+    """Creates the markup query for entities whose surface forms hold every word of the
+    terms; adjacency is checked by `match_surface_forms`."""
+    exact_words = set()
+    conditions = []
+    for term in terms:
+        exact_words.update(term.words[:-1] if term.prefix else term.words)
+        if term.prefix:
+            conditions.append({"terms": {"$regex": f"^{re.escape(term.words[-1])}"}})
+    if exact_words:
+        conditions.insert(0, {"terms": {"$all": list(exact_words)}})
+    return {"$and": conditions}
+
+
+def find_driver_query(terms: List[SearchTerm]) -> Dict[str, Any]:
+    """Finds the token index query for the postings that drive a search.
+
+    The longest exact word, most likely the rarest, drives the search; otherwise the
+    longest prefix does.
+    """
+    exact_words = [w for t in terms for w in (t.words[:-1] if t.prefix else t.words)]
+    if exact_words:
+        return {"term": max(exact_words, key=len)}
+    prefix = max((t.words[-1] for t in terms), key=len)
+    return {"term": {"$regex": f"^{re.escape(prefix)}"}}
+
+
+async def match_dataset_items(
+    db: AsyncIOMotorDatabase,
+    terms: List[SearchTerm],
+    dataset_item_ids: List[ObjectId],
+) -> List[ObjectId]:
+    """Finds the dataset items of a batch that contain every search term."""
+    positions = defaultdict(lambda: defaultdict(set))
+    async for posting in db[TOKEN_INDEX_COLLECTION].find(
+        {"dataset_item_id": {"$in": dataset_item_ids}, **create_term_query(terms)},
+        {"dataset_item_id": 1, "term": 1, "positions": 1},
+    ):
+        # Tokens that differ only in case or punctuation share a term.
+        positions[posting["dataset_item_id"]][posting["term"]].update(
+            posting["positions"]
+        )
+    return [
+        dataset_item_id
+        for dataset_item_id in dataset_item_ids
+        if all(match_search_term(term, positions[dataset_item_id]) for term in terms)
+    ]
+
+
+async def iterate_search_matches(
+    db: AsyncIOMotorDatabase,
+    dataset_id: ObjectId,
+    terms: List[SearchTerm],
+    match: Optional[Dict[str, Any]] = None,
+    after: Optional[ObjectId] = None,
+) -> AsyncIterator[List[ObjectId]]:
+    """Yields batches of the ids of dataset items, in id order, that contain every search
+    term and match the `match` filter on dataset items."""
+    driver_query = {"dataset_id": dataset_id, **find_driver_query(terms)}
+    if after is not None:
+        driver_query["dataset_item_id"] = {"$gt": after}
+    cursor = (
+        db[TOKEN_INDEX_COLLECTION]
+        .find(driver_query, {"dataset_item_id": 1}, allow_disk_use=True)
+        .sort("dataset_item_id", 1)
+    )
+
+    async def check(batch: List[ObjectId]) -> List[ObjectId]:
+        dataset_item_ids = await match_dataset_items(
+            db=db, terms=terms, dataset_item_ids=batch
+        )
+        if match is None or len(dataset_item_ids) == 0:
+            return dataset_item_ids
+        return [
+            di["_id"]
+            async for di in db["data"]
+            .find({"$and": [match, {"_id": {"$in": dataset_item_ids}}]}, {"_id": 1})
+            .sort("_id", 1)
+        ]
+
+    batch = []
+    last_id = None
+    async for posting in cursor:
+        # A prefix may match several terms of an item, including across batches.
+        if posting["dataset_item_id"] == last_id:
+            continue
+        last_id = posting["dataset_item_id"]
+        batch.append(last_id)
+        if len(batch) == SEARCH_BATCH_SIZE:
+            yield await check(batch)
+            batch = []
+    if batch:
+        yield await check(batch)
+
+
+async def search_dataset_items(
+    db: AsyncIOMotorDatabase,
+    dataset_id: ObjectId,
+    search_term: str,
+    prefix_last: bool = False,
+    match: Optional[Dict[str, Any]] = None,
+    after: Optional[ObjectId] = None,
+    skip: int = 0,
+    limit: Optional[int] = None,
+) -> Optional[SearchResult]:
+    """Finds a page of the dataset items of a dataset that contain every search term.
+
+    Args:
+        match: A filter the dataset items must also match.
+        after: Only items with greater ids are returned, as when continuing from the
+            last item of a previous page.
+        skip: The number of matching items skipped.
+        limit: The maximum number of items returned; the search stops once found.
+
+    Returns:
+        The matching dataset items in id order, or None if the search holds no terms.
+    """
+    terms = parse_search_terms(search_term=search_term, prefix_last=prefix_last)
+    if len(terms) == 0:
+        return None
+
+    await ensure_dataset_indexed(db=db, dataset_id=dataset_id)
+
+    dataset_item_ids = []
+    has_more = False
+    async for batch in iterate_search_matches(
+        db=db, dataset_id=dataset_id, terms=terms, match=match, after=after
+    ):
+        if skip >= len(batch):
+            skip -= len(batch)
+            continue
+        dataset_item_ids.extend(batch[skip:])
+        skip = 0
+        if limit is not None and len(dataset_item_ids) > limit:
+            has_more = True
+            dataset_item_ids = dataset_item_ids[:limit]
+            break
+
+    logger.info(f'Search "{search_term}" matched {len(dataset_item_ids)} dataset items')
+    return SearchResult(
+        dataset_item_ids=dataset_item_ids,
+        count=len(dataset_item_ids),
+        has_more=has_more,
+    )
+
+
+async def count_search_matches(
+    db: AsyncIOMotorDatabase,
+    dataset_id: ObjectId,
+    search_term: str,
+    match: Optional[Dict[str, Any]] = None,
+) -> Optional[int]:
+    """Counts the dataset items of a dataset that contain every search term and match a
+    filter, without holding their ids.
+
+    Returns:
+        The number of matching dataset items, or None if the search holds no terms.
+    """
+    terms = parse_search_terms(search_term=search_term)
+    if len(terms) == 0:
+        return None
+
+    await ensure_dataset_indexed(db=db, dataset_id=dataset_id)
+
+    count = 0
+    async for batch in iterate_search_matches(
+        db=db, dataset_id=dataset_id, terms=terms, match=match
+    ):
+        count += len(batch)
+    return count
+
+
+async def search_surface_forms(
+    db: AsyncIOMotorDatabase,
+    search_term: str,
+    markup_filter: Dict[str, Any],
+    prefix_last: bool = False,
+) -> Optional[List[str]]:
+    """Finds the entity surface forms of the markup matching a filter that contain every
+    search term.
+
+    Only entities holding every word of the search are read, through the index of their
+    normalized surface form terms.
+
+    Returns:
+        The matching surface forms, or None if the search holds no terms.
+    """
+    terms = parse_search_terms(search_term=search_term, prefix_last=prefix_last)
+    if len(terms) == 0:
+        return None
+
+    surface_forms = await db["markup"].distinct(
+        "surface_form",
+        {
+            **markup_filter,
+            "classification": "entity",
+            **create_markup_term_query(terms),
+        },
+    )
+    return match_surface_forms(terms=terms, surface_forms=surface_forms)
+
+
+async def backfill_markup_terms(db: AsyncIOMotorDatabase) -> int:
+    """Adds the normalized surface form terms to entity markup written before them.
+
+    Returns:
+        The number of backfilled entities.
+    """
+    _filter = {"classification": "entity", "terms": {"$exists": False}}
+    backfilled = 0
+    last_id = None
+    while True:
+        entities = (
+            await db["markup"]
+            .find(
+                _filter if last_id is None else {**_filter, "_id": {"$gt": last_id}},
+                {"surface_form": 1},
+            )
+            .sort("_id", 1)
+            .limit(BACKFILL_BATCH_SIZE)
+            .to_list(None)
+        )
+        if len(entities) == 0:
+            break
+        last_id = entities[-1]["_id"]
+        await db["markup"].bulk_write(
+            [
+                UpdateOne(
+                    {"_id": e["_id"]},
+                    {
+                        "$set": {
+                            "terms": surface_form_terms(e.get("surface_form") or "")
+                        }
+                    },
+                )
+                for e in entities
+            ],
+            ordered=False,
+        )
+        backfilled += len(entities)
+
+    if backfilled:
+        logger.info(f"Backfilled search terms of {backfilled} entities")
+    return backfilled
+
+
+def match_surface_forms(
+    terms: List[SearchTerm], surface_forms: Iterable[str]
+) -> List[str]:
+    """Filters surface forms for those that contain every search term."""
+    return [
+        surface_form
+        for surface_form in surface_forms
+        if surface_form
+        and all(
+            match_search_term(term, term_positions(surface_form.split(" ")))
+            for term in terms
+        )
+    ]
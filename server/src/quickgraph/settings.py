@@ -1,9 +1,9 @@
 """Settings."""
 
 from functools import lru_cache
-from typing import List
+from typing import List, Optional
 
-from pydantic import BaseModel, Field, SecretStr
+from pydantic import BaseModel, ConfigDict, Field, SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -25,6 +25,13 @@ class SettingsAPI(BaseModel):
     system_default_dir: str = "./system"
     dummy_username: str = "janedoe"
     prefix: str = "/api"
+    debug_headers: bool = Field(
+        default=False,
+        description="Report the database round trips of each request in the X-DB-Round-Trips header",
+    )
+    max_markup_batch: int = Field(
+        default=500, description="Maximum number of operations in a markup batch"
+    )
 
 
 class SettingsAuth(BaseModel):
@@ -37,10 +44,66 @@ class SettingsAuth(BaseModel):
         return self.secret_key.get_secret_value()
 
 
+class SettingsWorkers(BaseModel):
+    processes: Optional[int] = Field(
+        default=None, description="Size of the CPU process pool; defaults to CPU count"
+    )
+    preannotation_chunk_size: int = Field(
+        default=1000, description="Dataset items tagged per process pool task"
+    )
+    ingestion_chunk_size: int = Field(
+        default=5000,
+        description="Uploaded dataset items prepared per process pool task",
+    )
+    jobs: int = Field(
+        default=2, description="Number of background jobs run concurrently"
+    )
+    heartbeat_interval: float = Field(
+        default=30,
+        description="Seconds between heartbeats of the job worker; jobs of workers that miss three are failed",
+    )
+
+
+class SettingsEmbeddings(BaseModel):
+    # `model_name` clashes with pydantic's protected `model_` namespace
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_name: str = Field(
+        default="all-distilroberta-v1", description="SentenceTransformer model name"
+    )
+    batch_size: int = Field(default=64, description="Texts encoded per model batch")
+    cache_size: int = Field(
+        default=100000, description="Maximum number of embeddings cached in memory"
+    )
+
+
+class SettingsCache(BaseModel):
+    enabled: bool = Field(
+        default=True, description="Cache projects, users and ontologies in memory"
+    )
+    ttl: float = Field(default=300, description="Seconds a cached document is kept")
+    max_entries: int = Field(
+        default=1024, description="Maximum number of cached entries per collection"
+    )
+    max_graphs: int = Field(
+        default=32, description="Maximum number of project graphs cached in memory"
+    )
+    poll_interval: float = Field(
+        default=2,
+        description="Seconds between checks for changed documents when change streams are unavailable",
+    )
+    count_ttl: float = Field(
+        default=30, description="Seconds a filtered dataset item count is kept"
+    )
+
+
 class Settings(BaseSettings):
     mongodb: SettingsMongoDB
     api: SettingsAPI = SettingsAPI()
     auth: SettingsAuth
+    workers: SettingsWorkers = SettingsWorkers()
+    embeddings: SettingsEmbeddings = SettingsEmbeddings()
+    cache: SettingsCache = SettingsCache()
 
     model_config = SettingsConfigDict(
         env_file=".env", env_nested_delimiter="__", env_file_encoding="utf-8"
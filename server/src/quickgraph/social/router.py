@@ -4,6 +4,7 @@ from bson import ObjectId
 from fastapi import APIRouter, Depends, HTTPException, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from ..dashboard.stats import mark_dataset_item_project_stats_stale
 from ..dependencies import get_db, get_user
 from ..users.schemas import UserDocumentModel
 from .schemas import Comment, Context, CreateComment
@@ -31,6 +32,10 @@ async def create_one_comment(
             detail="Unable to create comment",
         )
 
+    await mark_dataset_item_project_stats_stale(
+        db=db, dataset_item_id=new_comment["dataset_item_id"]
+    )
+
     return Comment(**new_comment, read_only=False)
 
 
@@ -53,7 +58,13 @@ async def delete_one_comment(
     comment_id = ObjectId(comment_id)
 
     # Delete comment
-    await db["social"].delete_one({"_id": comment_id, "created_by": user.username})
+    comment = await db["social"].find_one_and_delete(
+        {"_id": comment_id, "created_by": user.username}, {"dataset_item_id": 1}
+    )
+    if comment:
+        await mark_dataset_item_project_stats_stale(
+            db=db, dataset_item_id=comment["dataset_item_id"]
+        )
 
     # Make sure it is deleted
     comment = await db["social"].find_one({"_id": comment_id})
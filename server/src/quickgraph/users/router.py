@@ -12,6 +12,7 @@ from passlib.context import CryptContext
 
 from ..dependencies import get_db, get_user
 from ..settings import settings
+from ..utils.cache import invalidate_document
 from .schemas import (
     SecurityQuestionReset,
     UserCreate,
@@ -121,6 +122,7 @@ async def delete_user_endpoint(
         )
 
     await db.users.delete_one({"_id": ObjectId(user_id)})
+    invalidate_document("users", ObjectId(user_id))
 
     return {"message": f"User with id '{user_id}' deleted successfully"}
 
@@ -157,6 +159,7 @@ async def update_user_endpoint(
         },
         upsert=True,
     )
+    invalidate_document("users", ObjectId(user.id))
 
     if update.modified_count == 0:
         raise HTTPException(
@@ -199,6 +202,7 @@ async def reset_password_endpoint(
         {"_id": user["_id"]},
         {"$set": {"hashed_password": hashed_password, "updated_at": current_time}},
     )
+    invalidate_document("users", user["_id"])
 
     return {"detail": "Password reset successfully"}
 
@@ -1,8 +1,11 @@
 """User Agreement utilities."""
 
 import itertools
-from collections import Counter, defaultdict
-from typing import Dict, List, Optional, Tuple
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
 
 
 class AgreementCalculator:
@@ -10,6 +13,11 @@ class AgreementCalculator:
     A class to calculate inter-annotator agreement between each pair of users and overall
     using Jaccard similarity.
 
+    Annotations are interned to integer ids and each user's annotations are held as a
+    row of a sparse user x annotation matrix, so every pairwise intersection is computed
+    by a single matrix product. Results are memoized per data type and shared by the
+    pairwise, overall and majority calculations.
+
     Attributes:
         entity_data (List[Dict[str, str]]): A list of entities. Each entity is a dictionary containing 'start', 'end',
             'label', 'username' and 'doc_id' keys.
@@ -52,6 +60,8 @@ class AgreementCalculator:
         """
         self.entity_data = entity_data
         self.relation_data = relation_data if relation_data else []
+        self._memberships = {}
+        self._similarities = {}
 
     def jaccard_similarity(
         self,
@@ -77,6 +87,99 @@ class AgreementCalculator:
             union = len(set(data_set1) | set(data_set2))
             return intersection / union
 
+    def get_data(self, data_type: str) -> List[Dict[str, str]]:
+        if data_type == "entity":
+            return self.entity_data
+        elif data_type == "relation":
+            return self.relation_data
+        raise ValueError(
+            f"Invalid data_type: {data_type}. Expected 'entity' or 'relation'."
+        )
+
+    @staticmethod
+    def annotation_key(item: Dict[str, str]) -> Optional[Tuple]:
+        """Returns the hashable identity of an annotation, ending with its document id."""
+        if "source" in item and "target" in item:
+            return (
+                item["source"]["start"],
+                item["source"]["end"],
+                item["source"]["label"],
+                item["target"]["start"],
+                item["target"]["end"],
+                item["target"]["label"],
+                item["label"],
+                item["doc_id"],
+            )
+        elif "start" in item and "end" in item and "label" in item:
+            return (item["start"], item["end"], item["label"], item["doc_id"])
+        return None
+
+    def memberships(
+        self, data_type: str = "entity"
+    ) -> Tuple[List[str], csr_matrix, np.ndarray]:
+        """
+        Intern annotations and build the user x annotation count matrix for a data type.
+
+        Returns:
+            A tuple of the users (matrix row order), the sparse matrix counting how often
+            each user made each annotation and the document id index of each annotation.
+        """
+        if data_type in self._memberships:
+            return self._memberships[data_type]
+
+        user_ids = {}
+        annotation_ids = {}
+        doc_ids = {}
+        annotation_docs = []
+        rows = []
+        cols = []
+        for item in self.get_data(data_type):
+            user_id = user_ids.setdefault(item["username"], len(user_ids))
+            key = self.annotation_key(item)
+            if key is None:
+                continue
+            annotation_id = annotation_ids.get(key)
+            if annotation_id is None:
+                annotation_id = annotation_ids[key] = len(annotation_ids)
+                annotation_docs.append(doc_ids.setdefault(key[-1], len(doc_ids)))
+            rows.append(user_id)
+            cols.append(annotation_id)
+
+        counts = csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(len(user_ids), len(annotation_ids)),
+        )
+        counts.sum_duplicates()
+
+        self._memberships[data_type] = (
+            list(user_ids),
+            counts,
+            np.asarray(annotation_docs, dtype=np.int64),
+        )
+        return self._memberships[data_type]
+
+    def similarity_matrix(self, data_type: str = "entity") -> np.ndarray:
+        """Calculate the Jaccard similarity matrix between all users for a data type."""
+        if data_type in self._similarities:
+            return self._similarities[data_type]
+
+        _, counts, _ = self.memberships(data_type)
+        membership = counts.copy()
+        membership.data[:] = 1
+
+        intersections = (membership @ membership.T).toarray().astype(np.float64)
+        sizes = np.diag(intersections)
+        unions = sizes[:, None] + sizes[None, :] - intersections
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            similarities = np.where(unions > 0, intersections / unions, 0.0)
+        # Two users without annotations agree completely
+        empty = sizes == 0
+        similarities[np.ix_(empty, empty)] = 1.0
+
+        self._similarities[data_type] = similarities
+        return similarities
+
     def calculate_agreements(
         self, data_type: str = "entity"
     ) -> Dict[str, Dict[str, float]]:
@@ -89,48 +192,14 @@ class AgreementCalculator:
         Returns:
             A dictionary containing agreement scores between each pair of users.
         """
-        if data_type == "entity":
-            data = self.entity_data
-        elif data_type == "relation":
-            data = self.relation_data
-        else:
-            raise ValueError(
-                f"Invalid data_type: {data_type}. Expected 'entity' or 'relation'."
-            )
-
-        user_data = defaultdict(list)
-        users = set()
-        for item in data:
-            users.add(item["username"])
-
-            if "source" in item and "target" in item:
-                user_data[item["username"]].append(
-                    (
-                        item["source"]["start"],
-                        item["source"]["end"],
-                        item["source"]["label"],
-                        item["target"]["start"],
-                        item["target"]["end"],
-                        item["target"]["label"],
-                        item["label"],
-                        item["doc_id"],
-                    )
-                )
-            elif "start" in item and "end" in item and "label" in item:
-                user_data[item["username"]].append(
-                    (
-                        item["start"],
-                        item["end"],
-                        item["label"],
-                        item["doc_id"],
-                    )
-                )
+        users, _, _ = self.memberships(data_type)
+        similarities = self.similarity_matrix(data_type)
 
         agreements = defaultdict(dict)
-        for user1, user2 in itertools.combinations(users, 2):
-            similarity = self.jaccard_similarity(user_data[user1], user_data[user2])
-            agreements[user1][user2] = similarity
-            agreements[user2][user1] = similarity
+        for i, j in itertools.combinations(range(len(users)), 2):
+            similarity = float(similarities[i, j])
+            agreements[users[i]][users[j]] = similarity
+            agreements[users[j]][users[i]] = similarity
 
         return agreements
 
@@ -144,14 +213,11 @@ class AgreementCalculator:
         Returns:
             Overall agreement as a float.
         """
-        agreements = self.calculate_agreements(data_type)
-        total_similarity = 0
-        count = 0
-        for user1 in agreements:
-            for user2 in agreements[user1]:
-                total_similarity += agreements[user1][user2]
-                count += 1
-        return total_similarity / count if count > 0 else 0
+        similarities = self.similarity_matrix(data_type)
+        n = len(similarities)
+        if n < 2:
+            return 0
+        return float((similarities.sum() - np.trace(similarities)) / (n * (n - 1)))
 
     def overall_average_agreement(self) -> float:
         """
@@ -181,48 +247,117 @@ class AgreementCalculator:
 
     def count_majority_agreements(self, data_type: str = "entity"):
         """Counts the instances that have majority agreement."""
+        users, counts, annotation_docs = self.memberships(data_type)
+        if counts.nnz == 0:
+            return 0
 
-        if data_type == "entity":
-            data = self.entity_data
-        elif data_type == "relation":
-            data = self.relation_data
-        else:
-            raise ValueError(
-                f"Invalid data_type: {data_type}. Expected 'entity' or 'relation'."
-            )
+        # Get the counts of saved annotators on the documents
+        coo = counts.tocoo()
+        user_docs = np.unique(
+            np.stack([coo.row, annotation_docs[coo.col]], axis=1), axis=0
+        )
+        users_per_doc = np.bincount(user_docs[:, 1])
 
-        _data = []
-        users_per_doc = defaultdict(set)
-        for item in data:
-            users_per_doc[item["doc_id"]].add(item["username"])
-            if "source" in item and "target" in item:
-                _data.append(
-                    (
-                        item["source"]["start"],
-                        item["source"]["end"],
-                        item["source"]["label"],
-                        item["target"]["start"],
-                        item["target"]["end"],
-                        item["target"]["label"],
-                        item["label"],
-                        item["doc_id"],
-                    )
-                )
-            elif "start" in item and "end" in item and "label" in item:
-                _data.append(
-                    (item["start"], item["end"], item["label"], item["doc_id"])
+        # Count frequencies
+        frequencies = np.asarray(counts.sum(axis=0)).ravel()
+
+        return int(np.sum(frequencies / users_per_doc[annotation_docs] > 0.5))
+
+
+def entity_signature(start: int, end: int, label: str) -> str:
+    """Returns the signature of an entity; equal entities have equal signatures."""
+    return f"{start}:{end}:{label}"
+
+
+def markup_signatures(markup: List[Dict]) -> Dict[Any, Dict[str, List[str]]]:
+    """Creates entity and relation signature sets for one user's markup.
+
+    Args:
+        markup: Markup documents of a single user, containing 'classification',
+            'dataset_item_id', 'start', 'end', 'ontology_item_id' and for relations
+            'source_id' and 'target_id' keys.
+
+    Returns:
+        A dictionary mapping dataset item ids to sorted entity and relation signatures.
+    """
+    entities = {m["_id"]: m for m in markup if m["classification"] == "entity"}
+
+    signatures = defaultdict(lambda: {"entity": set(), "relation": set()})
+    for m in markup:
+        if m["classification"] == "entity":
+            signatures[m["dataset_item_id"]]["entity"].add(
+                entity_signature(m["start"], m["end"], m["ontology_item_id"])
+            )
+        elif m["classification"] == "relation":
+            source = entities.get(m["source_id"])
+            target = entities.get(m["target_id"])
+            if source is None or target is None:
+                continue
+            signatures[m["dataset_item_id"]]["relation"].add(
+                "|".join(
+                    [
+                        entity_signature(
+                            source["start"], source["end"], source["ontology_item_id"]
+                        ),
+                        entity_signature(
+                            target["start"], target["end"], target["ontology_item_id"]
+                        ),
+                        m["ontology_item_id"],
+                    ]
                 )
+            )
 
-        # Get the counts of saved annotators on the documents
-        users_per_doc = {doc_id: len(users) for doc_id, users in users_per_doc.items()}
+    return {
+        item_id: {data_type: sorted(s) for data_type, s in item_signatures.items()}
+        for item_id, item_signatures in signatures.items()
+    }
 
-        # Count frequencies
-        counter = Counter(_data)
 
-        majority_count = sum(
-            1
-            for item, count in counter.items()
-            if count / users_per_doc[item[-1]] > 0.5
+def signature_agreement(signatures: Dict[str, Dict[str, List[str]]]) -> Dict[str, Dict]:
+    """Calculates the agreement on a single item from its annotators' signature sets.
+
+    Equivalent to `AgreementCalculator` applied to a single item: only users with
+    markup of a type take part in its pairwise agreement and the overall agreement is
+    the entity and relation agreement weighted by their number of annotations.
+
+    Args:
+        signatures: A dictionary mapping usernames to their 'entity' and 'relation' signatures.
+
+    Returns:
+        A dictionary containing the 'agreement' and 'pairwise_agreement' scores.
+    """
+    agreement = {}
+    pairwise_agreement = {}
+    counts = {}
+    for data_type in ["entity", "relation"]:
+        user_data = {
+            username: set(s[data_type])
+            for username, s in signatures.items()
+            if len(s[data_type]) > 0
+        }
+
+        agreements = defaultdict(dict)
+        for user1, user2 in itertools.combinations(user_data, 2):
+            similarity = len(user_data[user1] & user_data[user2]) / len(
+                user_data[user1] | user_data[user2]
+            )
+            agreements[user1][user2] = similarity
+            agreements[user2][user1] = similarity
+
+        scores = [s for a in agreements.values() for s in a.values()]
+        pairwise_agreement[data_type] = dict(agreements)
+        agreement[data_type] = sum(scores) / len(scores) if scores else 0
+        counts[data_type] = sum(len(s) for s in user_data.values())
+
+    total_items = counts["entity"] + counts["relation"]
+    agreement["overall"] = (
+        (
+            agreement["entity"] * counts["entity"]
+            + agreement["relation"] * counts["relation"]
         )
+        / total_items
+        if total_items > 0
+        else 0
+    )
 
-        return majority_count
+    return {"agreement": agreement, "pairwise_agreement": pairwise_agreement}
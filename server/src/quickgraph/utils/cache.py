@@ -0,0 +1,275 @@
+"""In-process document cache.
+
+Projects, users, project ontologies and project graphs are read on almost every
+request. They are cached per process with TTL and LRU eviction and invalidated when
+their source documents change: through a MongoDB change stream where the deployment
+supports one (replica sets) and otherwise by periodically polling the cached documents
+for changes. Writes made by this process also invalidate the affected documents
+directly.
+
+Within a request, `find_project` and `find_user` load each document at most once and
+return the same copy to every caller; callers must not modify it.
+"""
+
+import asyncio
+import copy
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+import bson
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure
+
+from ..settings import settings
+from .context import get_request_context
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(document: Dict[str, Any]) -> str:
+    return hashlib.sha1(bson.encode(document)).hexdigest()
+
+
+class DocumentCache:
+    """TTL and LRU bounded cache of values derived from documents of one collection.
+
+    Each entry records the documents it was built from so that a change to any of them
+    invalidates the entry.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expires_at, value, source document ids)
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, List[Any]]]" = (
+            OrderedDict()
+        )
+        # source document id -> {"fingerprint": str, "keys": set of entry keys}
+        self._sources: Dict[Any, Dict[str, Any]] = {}
+        # Incremented on every invalidation; loads that overlap one are not cached.
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value, _ = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, documents: List[Dict[str, Any]]) -> None:
+        self._remove(key)
+        self._entries[key] = (
+            time.monotonic() + self.ttl,
+            value,
+            [d["_id"] for d in documents],
+        )
+        for document in documents:
+            source = self._sources.setdefault(document["_id"], {"keys": set()})
+            source["fingerprint"] = fingerprint(document)
+            source["keys"].add(key)
+
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        load: Callable[[], Awaitable[Tuple[Any, List[Dict[str, Any]]]]],
+    ) -> Optional[Any]:
+        """Returns a cached value or loads it as `(value, source documents)` and caches it."""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        generation = self._generation
+        value, documents = await load()
+        if value is not None and generation == self._generation:
+            self.set(key, value, documents)
+        return value
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for source_id in entry[2]:
+            source = self._sources.get(source_id)
+            if source is None:
+                continue
+            source["keys"].discard(key)
+            if not source["keys"]:
+                del self._sources[source_id]
+
+    def invalidate(self, document_id: Any) -> None:
+        """Removes every entry built from a document."""
+        self._generation += 1
+        source = self._sources.pop(document_id, None)
+        if source is None:
+            return
+        for key in list(source["keys"]):
+            self._remove(key)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+        self._sources.clear()
+
+    async def poll(self, db: AsyncIOMotorDatabase, collection_name: str) -> None:
+        """Invalidates entries whose source documents changed or were deleted."""
+        source_ids = list(self._sources)
+        if len(source_ids) == 0:
+            return
+
+        current = {
+            d["_id"]: fingerprint(d)
+            async for d in db[collection_name].find({"_id": {"$in": source_ids}})
+        }
+        for source_id in source_ids:
+            source = self._sources.get(source_id)
+            if source and current.get(source_id) != source["fingerprint"]:
+                self.invalidate(source_id)
+
+
+# Caches keyed by the collection their source documents belong to.
+CACHES: Dict[str, DocumentCache] = {
+    collection_name: DocumentCache(
+        maxsize=settings.cache.max_entries, ttl=settings.cache.ttl
+    )
+    for collection_name in ["projects", "users", "resources"]
+}
+# Graphs are cached against the state of the projection they were built from.
+CACHES["graph_projections"] = DocumentCache(
+    maxsize=settings.cache.max_graphs, ttl=settings.cache.ttl
+)
+
+
+def invalidate_document(collection_name: str, document_id: Any) -> None:
+    """Invalidates cached values built from a document written by this process."""
+    context = get_request_context()
+    if context is not None:
+        context.forget(collection_name, document_id)
+    cache = CACHES.get(collection_name)
+    if cache is not None:
+        cache.invalidate(document_id)
+
+
+def clear_caches() -> None:
+    for cache in CACHES.values():
+        cache.clear()
+
+
+async def cached(
+    collection_name: str,
+    key: Hashable,
+    load: Callable[[], Awaitable[Tuple[Any, List[Dict[str, Any]]]]],
+) -> Optional[Any]:
+    if not settings.cache.enabled:
+        value, _ = await load()
+        return value
+    return await CACHES[collection_name].get_or_load(key, load)
+
+
+async def find_document(
+    collection_name: str,
+    key: Hashable,
+    load: Callable[[], Awaitable[Tuple[Any, List[Dict[str, Any]]]]],
+) -> Optional[Dict[str, Any]]:
+    """Finds a document once per request, reading through the process cache."""
+    context = get_request_context()
+    if context is not None:
+        document = context.get(collection_name, key)
+        if document is not None:
+            return document
+
+    document = copy.deepcopy(await cached(collection_name, key, load))
+    if context is not None and document is not None:
+        context.set(collection_name, key, document)
+    return document
+
+
+async def find_project(
+    db: AsyncIOMotorDatabase, project_id: ObjectId
+) -> Optional[Dict[str, Any]]:
+    """Finds a project document by id."""
+
+    async def load():
+        project = await db["projects"].find_one({"_id": project_id})
+        return project, [project] if project else []
+
+    return await find_document("projects", project_id, load)
+
+
+async def find_user(
+    db: AsyncIOMotorDatabase, username: str
+) -> Optional[Dict[str, Any]]:
+    """Finds a user document by username."""
+
+    async def load():
+        user = await db["users"].find_one({"username": username})
+        return user, [user] if user else []
+
+    return await find_document("users", username, load)
+
+
+async def watch_for_changes(db: AsyncIOMotorDatabase) -> None:
+    """Invalidates cached documents from a change stream until it is unavailable."""
+    pipeline = [{"$match": {"ns.coll": {"$in": list(CACHES)}}}]
+    while True:
+        try:
+            async with db.watch(pipeline) as stream:
+                logger.info("Watching change stream for cache invalidation")
+                async for change in stream:
+                    cache = CACHES.get(change.get("ns", {}).get("coll"))
+                    if "documentKey" in change and cache is not None:
+                        cache.invalidate(change["documentKey"]["_id"])
+                    elif change["operationType"] in [
+                        "drop",
+                        "dropDatabase",
+                        "rename",
+                        "invalidate",
+                    ]:
+                        clear_caches()
+        except OperationFailure as e:
+            # Standalone servers do not support change streams.
+            logger.info(
+                f"Change streams unavailable ({e}); polling for cache invalidation"
+            )
+            clear_caches()
+            return
+        except Exception as e:
+            # Events may have been missed while disconnected.
+            logger.error(f"Cache invalidation change stream failed: {e}")
+            clear_caches()
+            await asyncio.sleep(settings.cache.poll_interval)
+
+
+async def poll_for_changes(db: AsyncIOMotorDatabase) -> None:
+    """Invalidates cached documents by periodically comparing them to the database."""
+    while True:
+        await asyncio.sleep(settings.cache.poll_interval)
+        for collection_name, cache in CACHES.items():
+            try:
+                await cache.poll(db, collection_name)
+            except Exception as e:
+                logger.error(
+                    f"Cache invalidation poll of {collection_name} failed: {e}"
+                )
+                cache.clear()
+
+
+async def run_cache_invalidation(db: AsyncIOMotorDatabase) -> None:
+    """Keeps the caches coherent with the database; runs until cancelled."""
+    if not settings.cache.enabled:
+        return
+    await watch_for_changes(db)
+    await poll_for_changes(db)
@@ -0,0 +1,119 @@
+"""Request-scoped context.
+
+A context is created for every HTTP request by `RequestContextMiddleware`. It holds the
+project and user documents loaded while serving the request, so the dependencies and
+services of one request share a single decoded copy of each, and counts the database
+commands the request issues. Motor runs commands on executor threads with a copy of the
+calling context, so the command listener can attribute each command to its request.
+"""
+
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from pymongo import monitoring
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+DB_ROUND_TRIPS_HEADER = "X-DB-Round-Trips"
+
+
+class RequestContext:
+    """Documents loaded and database commands issued while serving one request."""
+
+    def __init__(self) -> None:
+        # (collection name, lookup key) -> document
+        self._documents: Dict[Tuple[str, Hashable], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.db_round_trips = 0
+
+    def get(self, collection_name: str, key: Hashable) -> Optional[Dict[str, Any]]:
+        return self._documents.get((collection_name, key))
+
+    def set(
+        self, collection_name: str, key: Hashable, document: Dict[str, Any]
+    ) -> None:
+        self._documents[(collection_name, key)] = document
+
+    def forget(self, collection_name: str, document_id: Any) -> None:
+        """Drops a document written during the request so it is loaded again."""
+        for key, document in list(self._documents.items()):
+            if key[0] == collection_name and document.get("_id") == document_id:
+                del self._documents[key]
+
+    def count_round_trip(self) -> None:
+        # Commands of one request may run concurrently on several executor threads.
+        with self._lock:
+            self.db_round_trips += 1
+
+
+_request_context: ContextVar[Optional[RequestContext]] = ContextVar(
+    "request_context", default=None
+)
+
+
+def get_request_context() -> Optional[RequestContext]:
+    """Returns the context of the request being served, if any."""
+    return _request_context.get()
+
+
+def detach_request_context() -> None:
+    """Detaches the current task from the request it was started by.
+
+    Tasks that outlive a request (background jobs and refreshes) inherit its context;
+    they call this first so they neither reuse its documents nor add to its counts.
+    """
+    _request_context.set(None)
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts the database commands issued by each request."""
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        context = _request_context.get()
+        if context is not None:
+            context.count_round_trip()
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        pass
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        pass
+
+
+class RequestContextMiddleware:
+    """Serves each HTTP request within its own `RequestContext`.
+
+    When `report_round_trips` is set, the number of database commands issued before the
+    response starts is returned in the `X-DB-Round-Trips` header.
+    """
+
+    def __init__(self, app: ASGIApp, report_round_trips: bool = False) -> None:
+        self.app = app
+        self.report_round_trips = report_round_trips
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        context = RequestContext()
+        token = _request_context.set(context)
+
+        async def send_with_round_trips(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                if self.report_round_trips:
+                    headers = MutableHeaders(scope=message)
+                    headers.append(DB_ROUND_TRIPS_HEADER, str(context.db_round_trips))
+                logger.debug(
+                    f"{scope['method']} {scope['path']}: {context.db_round_trips} database round trips"
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_round_trips)
+        finally:
+            _request_context.reset(token)
@@ -0,0 +1,101 @@
+"""Gazetteer matching utilities."""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class GazetteerMatcher:
+    """Token-level trie matcher for gazetteers of classified phrases.
+
+    The trie is compiled once from a gazetteer and then applied to documents in a
+    single left-to-right pass. At each token the longest matching phrase is taken and
+    matching resumes after it, so longer phrases are preferred and mentions never
+    overlap, e.g. "Western Australia" is tagged instead of "Australia".
+    """
+
+    # Key of the terminal entry in a trie node; tokens are strings so it cannot collide.
+    _END = 0
+
+    def __init__(
+        self,
+        gazetteer: Dict[str, List[str]],
+        tokenizer: Callable[[str], List[str]] = lambda x: x.split(" "),
+    ):
+        self.root = {}
+        self.size = 0
+        for classification, phrases in gazetteer.items():
+            for phrase in phrases:
+                self.add(phrase, classification, tokenizer(phrase))
+
+    def add(self, phrase: str, classification: str, tokens: List[str]) -> None:
+        """Adds a phrase to the trie; a phrase may hold several classifications."""
+        if len(tokens) == 0:
+            return
+        node = self.root
+        for token in tokens:
+            node = node.setdefault(token, {})
+        _, classifications = node.setdefault(self._END, (phrase, []))
+        if classification not in classifications:
+            classifications.append(classification)
+            self.size += 1
+
+    def find_matches(self, tokens: List[str]) -> List[Tuple[int, int, str, List[str]]]:
+        """Finds the longest non-overlapping phrase matches in a list of tokens.
+
+        Returns a list of (start, end, surface_form, classifications) where `end` is
+        the inclusive index of the last token.
+        """
+        matches = []
+        i = 0
+        n = len(tokens)
+        while i < n:
+            node = self.root
+            longest = None
+            j = i
+            while j < n and tokens[j] in node:
+                node = node[tokens[j]]
+                if self._END in node:
+                    longest = (j, node[self._END])
+                j += 1
+
+            if longest is None:
+                i += 1
+                continue
+
+            end, (surface_form, classifications) = longest
+            matches.append((i, end, surface_form, classifications))
+            i = end + 1
+        return matches
+
+    def annotate(self, tokens: List[str]) -> List[Dict[str, object]]:
+        """Annotates tokens with one mention per matched span and classification."""
+        return [
+            {
+                "classification": classification,
+                "surface_form": surface_form,
+                "start": start,
+                "end": end,
+            }
+            for start, end, surface_form, classifications in self.find_matches(tokens)
+            for classification in classifications
+        ]
+
+
+# Matcher compiled inside a pool worker process by `init_worker_matcher`.
+_worker_matcher: Optional[GazetteerMatcher] = None
+
+
+def init_worker_matcher(gazetteer: Dict[str, List[str]]) -> None:
+    """Compiles the matcher used by `annotate_chunk`; a process pool initializer, so the
+    gazetteer is sent to each worker once rather than with every chunk."""
+    global _worker_matcher
+    _worker_matcher = GazetteerMatcher(gazetteer=gazetteer)
+
+
+def annotate_chunk(
+    items: List[Tuple[Any, List[str]]],
+) -> List[Tuple[Any, List[Dict[str, object]]]]:
+    """Annotates a chunk of (id, tokens) items; intended to run in a process pool whose
+    workers were initialized with `init_worker_matcher`."""
+    if _worker_matcher is None:
+        raise RuntimeError("Gazetteer matcher has not been initialized in this worker")
+    return [(item_id, _worker_matcher.annotate(tokens)) for item_id, tokens in items]
@@ -1,7 +1,6 @@
 """Services utilities."""
 
 import logging
-import re
 
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
@@ -31,35 +30,3 @@ async def soft_delete_document(
     except Exception as e:
         logger.info(f'Failed to soft delete document with ID "{doc_id}": {e}')
         return False
-
-
-def create_search_regex(search_terms: str) -> re.Pattern:
-    """
-    Create a regular expression pattern that matches all of the given search terms.
-
-    Args:
-        search_terms (str): A comma-separated string of search terms to match.
-
-    Returns:
-        re.Pattern: A compiled regular expression pattern that matches all of the search terms, or a
-        regex pattern that matches anything if the input string is empty.
-
-    Example:
-        >>> create_search_regex("apple, banana, cherry")
-        re.compile('(?=.*\\bapple\\b)(?=.*\\bbanana\\b)(?=.*\\bcherry\\b)', re.IGNORECASE)
-    """
-
-    if search_terms is None:
-        # Defaults to match anything regular expression
-        return re.compile(".*")
-
-    search_terms_list = search_terms.split(",")
-    search_term_regex_list = []
-    for term in search_terms_list:
-        search_term_regex_list.append(rf"(?=.*\b{re.escape(term.strip())}\b)")
-    search_term_regex = "".join(search_term_regex_list)
-    return (
-        re.compile(search_term_regex, re.IGNORECASE)
-        if search_terms
-        else re.compile(".*")
-    )
@@ -0,0 +1,78 @@
+"""Streaming responses.
+
+Exports are produced as an asynchronous stream of encoded chunks, one per batch of
+dataset items, so that the memory used to serve them does not grow with project size.
+Chunks are gzip compressed on the fly when the client accepts it.
+"""
+
+import json
+import zlib
+from datetime import date
+from typing import Any, AsyncIterator, Dict, Optional
+
+from bson import ObjectId
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+# Dataset items read, joined and written per chunk
+EXPORT_BATCH_SIZE = 500
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# `wbits` selecting a gzip header and trailer for zlib streams
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def _encode_bson_value(value: Any) -> str:
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_json(document: Any) -> str:
+    """Encodes a document, which may hold ObjectIds and datetimes, as compact JSON."""
+    return json.dumps(document, default=_encode_bson_value, separators=(",", ":"))
+
+
+def encode_json_line(document: Any) -> str:
+    return encode_json(document) + "\n"
+
+
+def accepts_gzip(request: Request) -> bool:
+    return "gzip" in request.headers.get("accept-encoding", "").lower()
+
+
+async def gzip_chunks(
+    chunks: AsyncIterator[bytes], level: int = 6
+) -> AsyncIterator[bytes]:
+    """Compresses a stream of chunks into a single gzip stream."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def encode_chunks(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        yield chunk.encode("utf-8")
+
+
+def create_streaming_response(
+    request: Request,
+    chunks: AsyncIterator[str],
+    media_type: str,
+    filename: Optional[str] = None,
+) -> StreamingResponse:
+    """Streams text chunks, gzip compressed if the client accepts it."""
+    body = encode_chunks(chunks)
+    headers: Dict[str, str] = {"Vary": "Accept-Encoding"}
+    if filename is not None:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    if accepts_gzip(request):
+        body = gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=media_type, headers=headers)
@@ -1,20 +1,156 @@
 """System utilities."""
 
+import logging
+from typing import Any, Dict, List
+
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from pymongo import ASCENDING
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
 
 from ..database import get_client
 from .system_resources import datasets, resources
 from ..settings import settings
+from ..resources.ontology import compile_ontology
 from ..resources.services import initialize_ontology
+from ..dataset.index import TOKEN_INDEX_INDEXES
 from ..dataset.services import create_dataset
 
+logger = logging.getLogger(__name__)
+
+# Index catalog keyed by collection name. Every hot query shape ($lookup joins, project
+# scoped filters and per-user lookups) should be covered by an entry here.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "data": [
+        # Compound with `_id` so exports can page through items in id order.
+        IndexModel([("dataset_id", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("project_id", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("save_states.created_by", ASCENDING)]),
+    ],
+    "markup": [
+        IndexModel([("dataset_item_id", ASCENDING)]),
+        IndexModel(
+            [
+                ("project_id", ASCENDING),
+                ("created_by", ASCENDING),
+                ("classification", ASCENDING),
+            ]
+        ),
+        IndexModel(
+            [
+                ("project_id", ASCENDING),
+                ("classification", ASCENDING),
+                ("surface_form", ASCENDING),
+            ]
+        ),
+        IndexModel([("project_id", ASCENDING), ("dataset_item_id", ASCENDING)]),
+        IndexModel(
+            [
+                ("project_id", ASCENDING),
+                ("classification", ASCENDING),
+                ("terms", ASCENDING),
+            ]
+        ),
+        IndexModel([("source_id", ASCENDING)]),
+        IndexModel([("target_id", ASCENDING)]),
+    ],
+    "token_index": TOKEN_INDEX_INDEXES,
+    "graph_nodes": [
+        IndexModel(
+            [("project_id", ASCENDING), ("annotator", ASCENDING), ("key", ASCENDING)],
+            unique=True,
+        ),
+        # Nodes are read most frequent first.
+        IndexModel(
+            [("project_id", ASCENDING), ("annotator", ASCENDING), ("count", DESCENDING)]
+        ),
+    ],
+    "graph_edges": [
+        IndexModel(
+            [
+                ("project_id", ASCENDING),
+                ("annotator", ASCENDING),
+                ("source", ASCENDING),
+                ("target", ASCENDING),
+                ("ontology_item_id", ASCENDING),
+                ("suggested", ASCENDING),
+            ],
+            unique=True,
+        ),
+    ],
+    "graph_contributions": [
+        IndexModel([("project_id", ASCENDING)]),
+    ],
+    "markup_signatures": [
+        IndexModel([("dataset_item_id", ASCENDING), ("created_by", ASCENDING)]),
+        IndexModel([("dataset_id", ASCENDING)]),
+    ],
+    "assignments": [
+        IndexModel(
+            [
+                ("project_id", ASCENDING),
+                ("username", ASCENDING),
+                ("dataset_item_id", ASCENDING),
+            ],
+            unique=True,
+        ),
+        IndexModel([("project_id", ASCENDING), ("dataset_item_id", ASCENDING)]),
+    ],
+    "clusters": [
+        IndexModel([("dataset_id", ASCENDING), ("cluster_id", ASCENDING)]),
+    ],
+    "jobs": [
+        IndexModel([("created_by", ASCENDING), ("created_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING)]),
+    ],
+    "social": [
+        IndexModel([("dataset_item_id", ASCENDING)]),
+    ],
+    "notifications": [
+        IndexModel([("recipient", ASCENDING)]),
+    ],
+    "users": [
+        IndexModel([("username", ASCENDING)]),
+    ],
+}
+
 
 async def create_indexes(db: AsyncIOMotorDatabase) -> None:
     """Creates database indexes if they does not already exist otherwise will have no effect."""
-    await db["markup"].create_index(
-        [("dataset_item_id", ASCENDING)]
-    )  # Used to speed up $lookup operations.
+    for collection_name, indexes in INDEXES.items():
+        try:
+            names = await db[collection_name].create_indexes(indexes)
+            logger.info(f"Ensured indexes on '{collection_name}': {names}")
+        except OperationFailure as e:
+            # An existing index with the same keys but different options should not prevent the remaining catalog from being built.
+            logger.error(f"Failed to create indexes on '{collection_name}': {e}")
+
+
+async def check_indexes(db: AsyncIOMotorDatabase) -> Dict[str, Dict[str, Any]]:
+    """Compares the index catalog against the indexes present in the database.
+
+    Returns a report per collection with catalog indexes that are `missing` and
+    existing indexes that are `unused` (zero operations since the last server
+    restart according to `$indexStats`).
+    """
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        existing_keys = {tuple(v["key"]) for v in existing.values()}
+
+        missing = [
+            i.document["name"]
+            for i in indexes
+            if tuple(i.document["key"].items()) not in existing_keys
+        ]
+
+        unused = []
+        async for stat in collection.aggregate([{"$indexStats": {}}]):
+            if stat["name"] != "_id_" and stat["accesses"]["ops"] == 0:
+                unused.append(stat["name"])
+
+        report[collection_name] = {"missing": missing, "unused": sorted(unused)}
+    return report
 
 
 async def create_system_resources() -> None:
@@ -27,11 +163,10 @@ async def create_system_resources() -> None:
         resource_dict = resource.model_dump()
         resource_dict["created_by"] = settings.api.system_username
         content = resource_dict.get("content")
-        content_dict = (
-            {"content": initialize_ontology(content)}
-            if resource.classification == "ontology"
-            else {"content": content}
-        )
+        content_dict = {"content": content}
+        if resource.classification == "ontology":
+            content_dict["content"] = initialize_ontology(content)
+            content_dict["compiled"] = compile_ontology(content_dict["content"])
         await db["resources"].update_one(
             {"name": resource.name},
             {"$setOnInsert": {**resource_dict, **content_dict}},
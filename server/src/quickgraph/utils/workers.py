@@ -0,0 +1,52 @@
+"""Worker pool utilities."""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+from ..settings import settings
+
+logger = logging.getLogger(__name__)
+
+process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_worker_count() -> int:
+    """Returns the number of processes in a process pool."""
+    return settings.workers.processes or os.cpu_count() or 1
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Returns the process pool used for CPU-bound work, creating it on first use."""
+    global process_pool
+    if process_pool is None:
+        process_pool = ProcessPoolExecutor(max_workers=get_worker_count())
+        logger.info(f"Started process pool (max_workers={get_worker_count()})")
+    return process_pool
+
+
+@contextmanager
+def initialized_process_pool(
+    initializer: Callable[..., Any], initargs: Tuple = ()
+) -> Iterator[ProcessPoolExecutor]:
+    """Yields a process pool whose workers each run `initializer` once on start.
+
+    Used when every task of a job needs the same large state, which is then sent once
+    per worker rather than with every task.
+    """
+    pool = ProcessPoolExecutor(
+        max_workers=get_worker_count(), initializer=initializer, initargs=initargs
+    )
+    try:
+        yield pool
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_process_pool() -> None:
+    global process_pool
+    if process_pool:
+        process_pool.shutdown(wait=False, cancel_futures=True)
+        process_pool = None
@@ -0,0 +1,8 @@
+"""Test configuration."""
+
+import os
+
+# Settings are read on import; unit tests do not connect to a database.
+os.environ.setdefault("MONGODB__DATABASE_NAME", "quickgraph_test")
+os.environ.setdefault("MONGODB__URI", "mongodb://localhost:27017")
+os.environ.setdefault("AUTH__SECRET_KEY", "test")
@@ -0,0 +1,118 @@
+"""Tests of inter-annotator agreement."""
+
+import itertools
+import random
+from collections import Counter, defaultdict
+
+import pytest
+
+from quickgraph.utils.agreement import AgreementCalculator
+
+
+def loop_annotations(data):
+    """Reads the users, their annotations and the users of each document as the loop
+    implementation replaced by the membership matrix did."""
+    users = set()
+    user_data = defaultdict(list)
+    users_per_doc = defaultdict(set)
+    for item in data:
+        users.add(item["username"])
+        users_per_doc[item["doc_id"]].add(item["username"])
+        key = AgreementCalculator.annotation_key(item)
+        if key is not None:
+            user_data[item["username"]].append(key)
+    return users, user_data, users_per_doc
+
+
+def loop_agreements(data):
+    users, user_data, _ = loop_annotations(data)
+    calculator = AgreementCalculator([])
+    agreements = defaultdict(dict)
+    for user1, user2 in itertools.combinations(users, 2):
+        similarity = calculator.jaccard_similarity(user_data[user1], user_data[user2])
+        agreements[user1][user2] = similarity
+        agreements[user2][user1] = similarity
+    return agreements
+
+
+def loop_overall_agreement(data):
+    scores = [s for a in loop_agreements(data).values() for s in a.values()]
+    return sum(scores) / len(scores) if scores else 0
+
+
+def loop_majority_agreements(data):
+    _, user_data, users_per_doc = loop_annotations(data)
+    counter = Counter(key for keys in user_data.values() for key in keys)
+    return sum(
+        1 for key, count in counter.items() if count / len(users_per_doc[key[-1]]) > 0.5
+    )
+
+
+def random_entity(rng, username):
+    start = rng.randint(0, 4)
+    return {
+        "username": username,
+        "doc_id": rng.choice("xyz"),
+        "start": start,
+        "end": start + rng.randint(0, 1),
+        "label": rng.choice("AB"),
+    }
+
+
+def random_relation(rng, username):
+    source = random_entity(rng, username)
+    target = random_entity(rng, username)
+    return {
+        "username": username,
+        "doc_id": source["doc_id"],
+        "source": {k: source[k] for k in ("start", "end", "label")},
+        "target": {k: target[k] for k in ("start", "end", "label")},
+        "label": rng.choice("rs"),
+    }
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_loop_implementation(seed):
+    rng = random.Random(seed)
+    users = [f"user{i}" for i in range(rng.randint(1, 5))]
+    entities = [
+        random_entity(rng, rng.choice(users)) for _ in range(rng.randint(0, 40))
+    ]
+    relations = [
+        random_relation(rng, rng.choice(users)) for _ in range(rng.randint(0, 20))
+    ]
+    calculator = AgreementCalculator(entities, relations)
+
+    for data_type, data in (("entity", entities), ("relation", relations)):
+        agreements = calculator.calculate_agreements(data_type)
+        expected = loop_agreements(data)
+        assert agreements.keys() == expected.keys()
+        for user in expected:
+            assert agreements[user] == pytest.approx(expected[user])
+
+        assert calculator.overall_agreement(data_type) == pytest.approx(
+            loop_overall_agreement(data)
+        )
+        assert calculator.count_majority_agreements(
+            data_type
+        ) == loop_majority_agreements(data)
+
+
+def test_duplicate_annotations_count_once():
+    entity = {"username": "a", "doc_id": "x", "start": 0, "end": 0, "label": "A"}
+    calculator = AgreementCalculator(
+        [entity, entity, {**entity, "username": "b"}, {**entity, "username": "c"}]
+    )
+
+    assert calculator.calculate_agreements()["a"] == {"b": 1.0, "c": 1.0}
+    assert calculator.count_majority_agreements() == 1
+
+
+def test_users_without_annotations_agree():
+    calculator = AgreementCalculator(
+        [{"username": "a", "doc_id": "x"}, {"username": "b", "doc_id": "x"}]
+    )
+
+    assert calculator.calculate_agreements()["a"] == {"b": 1.0}
+    assert calculator.overall_agreement() == 1.0
+    assert calculator.count_majority_agreements() == 0
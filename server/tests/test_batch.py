@@ -0,0 +1,59 @@
+"""Tests of markup batches."""
+
+from bson import ObjectId
+
+from quickgraph.markup.batch import MarkupBatchWriter
+from quickgraph.markup.schemas import EntityOperation
+from quickgraph.resources.ontology import CompiledOntology, compile_ontology
+
+
+def create_writer(tokens):
+    return MarkupBatchWriter(
+        project_id=ObjectId(),
+        username="a",
+        ontologies={
+            "entity": CompiledOntology(
+                compile_ontology([{"id": "1", "name": "Pump", "fullname": "Pump"}])
+            )
+        },
+        markup={},
+        tokens=tokens,
+    )
+
+
+def create_operation(dataset_item_id, start, end, surface_form="pump"):
+    return EntityOperation(
+        op="entity",
+        dataset_item_id=str(dataset_item_id),
+        content={
+            "ontology_item_id": "1",
+            "start": start,
+            "end": end,
+            "surface_form": surface_form,
+        },
+    )
+
+
+def test_create_entity_derives_surface_form():
+    dataset_item_id = ObjectId()
+    writer = create_writer({dataset_item_id: ["replace", "pump", "seal"]})
+
+    result = writer.apply(0, create_operation(dataset_item_id, 1, 2, "anything"))
+
+    assert result.applied
+    entity = writer.markup[ObjectId(result.entity_ids[0])]
+    assert entity["surface_form"] == "pump seal"
+
+
+def test_create_entity_rejects_unknown_items_and_spans():
+    dataset_item_id = ObjectId()
+    writer = create_writer({dataset_item_id: ["replace", "pump"]})
+
+    # Items of other projects are not loaded.
+    assert writer.apply(0, create_operation(ObjectId(), 0, 0)).detail == (
+        "Dataset item not found"
+    )
+    for start, end in ((-1, 0), (1, 0), (1, 2)):
+        result = writer.apply(0, create_operation(dataset_item_id, start, end))
+        assert not result.applied
+    assert writer.writes == []
@@ -0,0 +1,190 @@
+"""Tests of annotation downloads."""
+
+import asyncio
+
+from bson import ObjectId
+
+from quickgraph.dashboard import export
+from quickgraph.dashboard.export import create_conll_item, find_download_items
+
+
+def test_create_conll_item():
+    item = {
+        "id": "item",
+        "tokens": ["replace", "pump", "seal", "today"],
+        "entities": [
+            {"start": 1, "end": 2, "label": "Equipment", "annotator": "a"},
+            # Overlaps the longer entity at the same start.
+            {"start": 1, "end": 1, "label": "Pump", "annotator": "a"},
+            # Runs past the last token.
+            {"start": 3, "end": 5, "label": "Time", "annotator": "a"},
+            # Labels of deleted ontology items are left out.
+            {"start": 0, "end": 0, "label": None, "annotator": "a"},
+            {"start": 0, "end": 0, "label": "Activity", "annotator": "b"},
+        ],
+    }
+
+    assert create_conll_item(item, ["a", "b"]) == (
+        "# id = item\n"
+        "# annotator = a\n"
+        "replace\tO\n"
+        "pump\tB-Equipment\n"
+        "seal\tI-Equipment\n"
+        "today\tB-Time\n"
+        "\n"
+        "# id = item\n"
+        "# annotator = b\n"
+        "replace\tB-Activity\n"
+        "pump\tO\n"
+        "seal\tO\n"
+        "today\tO\n"
+        "\n"
+    )
+
+
+def test_create_conll_item_without_annotators():
+    assert create_conll_item({"id": "item", "tokens": [], "entities": []}, []) == ""
+
+
+def matches(document, _filter):
+    """Matches a document against the query operators used by downloads."""
+    for field, condition in _filter.items():
+        value = document.get(field)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for operator, operand in condition.items():
+            if operator == "$in" and value not in operand:
+                return False
+            if operator == "$gt" and not value > operand:
+                return False
+            if operator == "$gte" and not value >= operand:
+                return False
+            if operator == "$lte" and not value <= operand:
+                return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, field, direction):
+        self.documents.sort(key=lambda d: d[field], reverse=direction < 0)
+        return self
+
+    def limit(self, limit):
+        self.documents = self.documents[:limit]
+        return self
+
+    async def to_list(self, length):
+        return self.documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, _filter, projection=None):
+        return FakeCursor([d for d in self.documents if matches(d, _filter)])
+
+
+def create_markup(project_id, dataset_item_id, created_by, **fields):
+    return {
+        "_id": ObjectId(),
+        "project_id": project_id,
+        "dataset_item_id": dataset_item_id,
+        "created_by": created_by,
+        "ontology_item_id": "1",
+        **fields,
+    }
+
+
+def create_entity(project_id, dataset_item_id, created_by, start):
+    return create_markup(
+        project_id,
+        dataset_item_id,
+        created_by,
+        classification="entity",
+        start=start,
+        end=start,
+    )
+
+
+def test_find_download_items_merges_markup_into_items(monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_BATCH_SIZE", 2)
+    project_id = ObjectId()
+    item_ids = [ObjectId() for _ in range(6)]
+    deleted_item_id = item_ids.pop(3)
+    items = [
+        {
+            "_id": item_id,
+            "project_id": project_id,
+            "original": f"item {i}",
+            "text": f"item {i}",
+            "tokens": ["item", str(i)],
+        }
+        for i, item_id in enumerate(item_ids)
+    ]
+    other_project_item = {**items[0], "_id": ObjectId(), "project_id": ObjectId()}
+
+    entity = create_entity(project_id, item_ids[0], "a", start=0)
+    markup = [
+        entity,
+        create_markup(
+            project_id,
+            item_ids[0],
+            "a",
+            classification="relation",
+            source_id=entity["_id"],
+            target_id=entity["_id"],
+        ),
+        create_entity(project_id, item_ids[2], "b", start=1),
+        # Markup of other annotators, deleted items and other projects is left out.
+        create_entity(project_id, item_ids[2], "c", start=0),
+        create_entity(project_id, deleted_item_id, "a", start=0),
+        create_entity(ObjectId(), item_ids[4], "a", start=0),
+        create_entity(project_id, item_ids[4], "a", start=1),
+    ]
+    db = {
+        "data": FakeCollection(items + [other_project_item]),
+        "markup": FakeCollection(markup),
+    }
+
+    async def download():
+        return [
+            batch
+            async for batch in find_download_items(
+                db=db,
+                project_id=project_id,
+                usernames=["a", "b"],
+                ontology_id2fullname={"1": "Label"},
+            )
+        ]
+
+    batches = asyncio.run(download())
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    records = [record for batch in batches for record in batch]
+    assert [record["id"] for record in records] == [str(i) for i in item_ids]
+    assert [
+        [(e["start"], e["annotator"]) for e in record["entities"]] for record in records
+    ] == [[(0, "a")], [], [(1, "b")], [], [(1, "a")]]
+    assert records[0]["relations"] == [
+        {
+            "id": str(markup[1]["_id"]),
+            "source_id": str(entity["_id"]),
+            "target_id": str(entity["_id"]),
+            "label": "Label",
+            "annotator": "a",
+        }
+    ]
+    assert all(record["relations"] == [] for record in records[1:])
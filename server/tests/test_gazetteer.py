@@ -0,0 +1,60 @@
+"""Tests of gazetteer matching."""
+
+import pytest
+
+from quickgraph.utils import gazetteer
+from quickgraph.utils.gazetteer import (
+    GazetteerMatcher,
+    annotate_chunk,
+    init_worker_matcher,
+)
+
+
+def test_find_matches_prefers_longest_phrase():
+    matcher = GazetteerMatcher(
+        {"location": ["Australia", "Western Australia"], "state": ["Western"]}
+    )
+    tokens = "I live in Western Australia".split(" ")
+
+    assert matcher.find_matches(tokens) == [(3, 4, "Western Australia", ["location"])]
+
+
+def test_find_matches_does_not_overlap():
+    matcher = GazetteerMatcher({"a": ["x y"], "b": ["y z"]})
+
+    assert matcher.find_matches(["x", "y", "z"]) == [(0, 1, "x y", ["a"])]
+
+
+def test_find_matches_falls_back_to_shorter_prefix():
+    matcher = GazetteerMatcher({"a": ["new", "new york city"]})
+
+    # "new york" is a path in the trie but not a phrase.
+    assert matcher.find_matches(["new", "york", "state"]) == [(0, 0, "new", ["a"])]
+
+
+def test_phrase_with_several_classifications():
+    matcher = GazetteerMatcher({"a": ["pump"], "b": ["pump", "pump"]})
+
+    assert matcher.size == 2
+    assert matcher.annotate(["replace", "pump"]) == [
+        {"classification": "a", "surface_form": "pump", "start": 1, "end": 1},
+        {"classification": "b", "surface_form": "pump", "start": 1, "end": 1},
+    ]
+
+
+def test_empty_phrases_are_ignored():
+    matcher = GazetteerMatcher({"a": [""]}, tokenizer=lambda x: x.split())
+
+    assert matcher.size == 0
+    assert matcher.find_matches(["a"]) == []
+
+
+def test_annotate_chunk_uses_worker_matcher(monkeypatch):
+    monkeypatch.setattr(gazetteer, "_worker_matcher", None)
+    with pytest.raises(RuntimeError):
+        annotate_chunk([(1, ["pump"])])
+
+    init_worker_matcher({"equipment": ["pump"]})
+
+    pump = {"classification": "equipment", "surface_form": "pump", "start": 0, "end": 0}
+    assert annotate_chunk([(1, ["pump"]), (2, ["valve"])]) == [(1, [pump]), (2, [])]
@@ -0,0 +1,100 @@
+"""Tests of the graph engine."""
+
+from quickgraph.graph.engine import GraphIndex
+
+
+def create_nodes(*surface_forms):
+    """Creates nodes in descending count order, as read from the projection."""
+    return [
+        {"key": surface_form, "surface_form": surface_form, "count": 10 - i}
+        for i, surface_form in enumerate(surface_forms)
+    ]
+
+
+def create_edges(*pairs):
+    return [{"source": s, "target": t, "ontology_item_id": "r"} for s, t in pairs]
+
+
+def create_index():
+    """A triangle of "pump", "pump seal" and "valve", with "seal" hanging off "valve"
+    and joined to itself, and an orphan "motor"."""
+    return GraphIndex(
+        nodes=create_nodes("pump", "pump seal", "valve", "seal", "motor"),
+        edges=create_edges(
+            ("pump", "pump seal"),
+            # Edges to nodes outside of the graph are dropped.
+            ("pump", "impeller"),
+            ("pump", "valve"),
+            ("pump seal", "valve"),
+            ("valve", "seal"),
+            ("seal", "seal"),
+        ),
+    )
+
+
+def test_adjacency():
+    index = create_index()
+
+    assert len(index) == 5
+    assert [(e["source"], e["target"]) for e in index.edges] == [
+        ("pump", "pump seal"),
+        ("pump", "valve"),
+        ("pump seal", "valve"),
+        ("valve", "seal"),
+        ("seal", "seal"),
+    ]
+    assert list(index.degrees) == [2, 2, 3, 2, 0]
+    # Self loops are listed once.
+    assert sorted(index.neighbours(3)) == [(2, 3), (3, 4)]
+    assert list(index.neighbours(4)) == []
+
+
+def test_search():
+    index = create_index()
+
+    assert index.search("pu") == [0, 1]
+    assert index.search("seal") == [1, 3]
+    assert index.search("pump, valve") == []
+    assert index.search("") is None
+
+
+def test_top_nodes():
+    index = create_index()
+
+    # Ties on degree are broken by count.
+    assert index.top_nodes() == [2, 0, 1, 3, 4]
+    assert index.top_nodes(limit=2) == [2, 0]
+    assert index.top_nodes(node_ids=[4, 3, 1]) == [1, 3, 4]
+    assert index.top_nodes(show_orphans=False) == [2, 0, 1, 3]
+
+
+def test_top_nodes_without_orphans_tops_up_to_limit():
+    index = GraphIndex(
+        nodes=create_nodes("a", "b", "c", "d", "e", "f"),
+        edges=create_edges(("a", "b"), ("a", "e"), ("c", "d")),
+    )
+
+    # "c" is only joined to "d", which is outside of the top three nodes, so "e" takes
+    # its place.
+    assert index.top_nodes(limit=3, show_orphans=True) == [0, 1, 2]
+    assert index.top_nodes(limit=3, show_orphans=False) == [0, 1, 4]
+
+
+def test_expand():
+    index = create_index()
+
+    assert index.expand(focus=0, hops=0) == [0]
+    # Nodes are ordered by hop and then by degree.
+    assert index.expand(focus=0, hops=1) == [0, 2, 1]
+    assert index.expand(focus=0, hops=2) == [0, 2, 1, 3]
+    assert index.expand(focus=0, hops=5) == [0, 2, 1, 3]
+    assert index.expand(focus=4, hops=2) == [4]
+
+
+def test_subgraph_edges():
+    index = create_index()
+
+    assert index.subgraph_edges([0, 1, 2]) == [0, 1, 2]
+    assert index.subgraph_edges([3]) == [4]
+    assert index.subgraph_edges([2], other_node_ids={3}) == [3]
+    assert index.subgraph_edges([0, 4]) == []
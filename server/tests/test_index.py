@@ -0,0 +1,76 @@
+"""Tests of the dataset token index."""
+
+import itertools
+import random
+from collections import defaultdict
+
+from quickgraph.dataset.index import match_phrase, match_phrase_pairs
+from quickgraph.markup.utils import find_sub_lists, get_entity_offset
+
+
+def token_positions(tokens):
+    positions = defaultdict(list)
+    for i, token in enumerate(tokens):
+        positions[token].append(i)
+    return positions
+
+
+def test_match_phrase():
+    tokens = "the pump and the pump seal".split(" ")
+
+    assert match_phrase(["pump"], token_positions(tokens)) == [(1, 1), (4, 4)]
+    assert match_phrase(["the", "pump"], token_positions(tokens)) == [(0, 1), (3, 4)]
+    assert match_phrase(["pump", "seal"], token_positions(tokens)) == [(4, 5)]
+    assert match_phrase(["seal", "the"], token_positions(tokens)) == []
+
+
+def test_match_phrase_matches_find_sub_lists():
+    rng = random.Random(0)
+    for _ in range(500):
+        tokens = rng.choices("abc", k=rng.randint(1, 12))
+        phrase = rng.choices("abc", k=rng.randint(1, 3))
+        positions = token_positions(tokens)
+        # Postings are only read for items holding every token of the phrase.
+        if any(t not in positions for t in phrase):
+            continue
+
+        assert match_phrase(phrase, positions) == find_sub_lists(phrase, tokens)
+
+
+def test_match_phrase_pairs():
+    # "replace pump seal on the pump"
+    pump = [(1, 1), (5, 5)]
+    seal = [(2, 2)]
+
+    # Adjacent entities have an offset of 0.
+    assert match_phrase_pairs(pump, seal, offset=0, lr_direction=True) == [
+        ((1, 1), (2, 2))
+    ]
+    assert match_phrase_pairs(seal, pump, offset=2, lr_direction=True) == [
+        ((2, 2), (5, 5))
+    ]
+    assert match_phrase_pairs(seal, pump, offset=0, lr_direction=False) == [
+        ((2, 2), (1, 1))
+    ]
+    assert match_phrase_pairs(pump, seal, offset=1, lr_direction=True) == []
+
+
+def test_match_phrase_pairs_matches_pairwise_scan():
+    rng = random.Random(0)
+    for _ in range(500):
+        tokens = rng.choices("abc", k=rng.randint(2, 12))
+        source_spans = find_sub_lists(rng.choices("abc", k=rng.randint(1, 2)), tokens)
+        target_spans = find_sub_lists(rng.choices("abc", k=rng.randint(1, 2)), tokens)
+        offset = rng.randint(-1, 4)
+        lr_direction = rng.random() < 0.5
+
+        # Pairs separated as the focus relation's entities, in the same direction.
+        expected = [
+            (src_span, tgt_span)
+            for src_span, tgt_span in itertools.product(source_spans, target_spans)
+            if get_entity_offset({"end": src_span[1]}, {"start": tgt_span[0]}) == offset
+            and (src_span[1] <= tgt_span[0]) == lr_direction
+        ]
+        assert sorted(
+            match_phrase_pairs(source_spans, target_spans, offset, lr_direction)
+        ) == sorted(expected)
@@ -0,0 +1,86 @@
+"""Tests of compiled ontologies."""
+
+from quickgraph.resources.ontology import (
+    COMPILED_ONTOLOGY_VERSION,
+    DEFAULT_COLOR,
+    CompiledOntology,
+    compile_ontology,
+    is_compiled,
+)
+
+CONTENT = [
+    {
+        "id": "1",
+        "name": "Equipment",
+        "fullname": "Equipment",
+        "color": "#ff0000",
+        "children": [
+            {
+                "id": "1.1",
+                "name": "Pump",
+                "fullname": "Equipment/Pump",
+                "children": [
+                    {
+                        "id": "1.1.1",
+                        "name": "Seal",
+                        "fullname": "Equipment/Pump/Seal",
+                        "active": False,
+                    }
+                ],
+            },
+            {"id": "1.2", "name": "Valve", "fullname": "Equipment/Valve"},
+        ],
+    },
+    {"id": "2", "name": "State", "fullname": "State", "color": "#00ff00"},
+]
+
+
+def test_compile_ontology_flattens_depth_first():
+    compiled = compile_ontology(CONTENT)
+
+    assert compiled["version"] == COMPILED_ONTOLOGY_VERSION
+    assert compiled["ids"] == ["1", "1.1", "1.1.1", "1.2", "2"]
+    assert compiled["names"] == ["Equipment", "Pump", "Seal", "Valve", "State"]
+    assert compiled["fullnames"][2] == "Equipment/Pump/Seal"
+    assert compiled["colors"] == [
+        "#ff0000",
+        DEFAULT_COLOR,
+        DEFAULT_COLOR,
+        DEFAULT_COLOR,
+        "#00ff00",
+    ]
+    assert compiled["active"] == [True, True, False, True, True]
+    assert compiled["ancestors"] == [[], [0], [0, 1], [0], []]
+
+
+def test_compile_empty_ontology():
+    compiled = compile_ontology([])
+
+    assert compiled["ids"] == []
+    assert len(CompiledOntology(compiled)) == 0
+
+
+def test_is_compiled():
+    assert is_compiled({"compiled": compile_ontology(CONTENT)})
+    assert not is_compiled({})
+    assert not is_compiled({"compiled": {"version": COMPILED_ONTOLOGY_VERSION - 1}})
+
+
+def test_compiled_ontology_lookups():
+    ontology = CompiledOntology(compile_ontology(CONTENT))
+
+    assert len(ontology) == 5
+    assert "1.1.1" in ontology
+    assert "3" not in ontology
+    assert ontology.fullname("1.2") == "Equipment/Valve"
+    assert ontology.fullname("3") is None
+    assert ontology.ancestor_ids("1.1.1") == ["1", "1.1"]
+    assert ontology.ancestor_ids("3") == []
+    assert ontology.id2fullname["2"] == "State"
+    assert ontology.fullname2color["Equipment"] == "#ff0000"
+    assert ontology.details["1.1.1"] == {
+        "name": "Seal",
+        "fullname": "Equipment/Pump/Seal",
+        "color": DEFAULT_COLOR,
+        "active": False,
+    }
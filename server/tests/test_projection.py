@@ -0,0 +1,81 @@
+"""Tests of the graph projection."""
+
+import asyncio
+from collections import Counter
+
+from bson import ObjectId
+
+from quickgraph.graph.projection import (
+    GRAPH_CONTRIBUTIONS_COLLECTION,
+    claim_item_contributions,
+    swap_item_contribution,
+)
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = {}
+
+    def find(self, _filter):
+        document = self.documents.get(_filter["_id"])
+        if document is None or document.get("claim") != _filter["claim"]:
+            return None
+        return document
+
+    async def bulk_write(self, operations, ordered):
+        for operation in operations:
+            _id = operation._filter["_id"]
+            if _id not in self.documents:
+                self.documents[_id] = {"_id": _id, **operation._doc["$setOnInsert"]}
+            self.documents[_id].update(operation._doc["$set"])
+
+    async def find_one_and_replace(self, _filter, replacement, return_document):
+        previous = self.find(_filter)
+        if previous is not None:
+            self.documents[_filter["_id"]] = {"_id": _filter["_id"], **replacement}
+        return previous
+
+    async def find_one_and_delete(self, _filter):
+        previous = self.find(_filter)
+        if previous is not None:
+            del self.documents[_filter["_id"]]
+        return previous
+
+
+def test_superseded_refreshes_keep_the_latest_contribution():
+    project_id = ObjectId()
+    dataset_item_id = ObjectId()
+    db = {GRAPH_CONTRIBUTIONS_COLLECTION: FakeCollection()}
+    node = ("a", "pump", "1", False)
+
+    async def claim():
+        claims = await claim_item_contributions(
+            db=db, project_id=project_id, dataset_item_ids=[dataset_item_id]
+        )
+        return claims[dataset_item_id]
+
+    async def swap(claim, count):
+        return await swap_item_contribution(
+            db=db,
+            project_id=project_id,
+            dataset_item_id=dataset_item_id,
+            claim=claim,
+            nodes=Counter({node: count} if count else {}),
+            edges=Counter(),
+        )
+
+    async def refresh():
+        stale_claim = await claim()
+        latest_claim = await claim()
+        # The refresh that claimed the item last swaps first; the stale one is ignored.
+        latest = await swap(latest_claim, 2)
+        stale = await swap(stale_claim, 1)
+        removed = await swap(await claim(), 0)
+        return latest, stale, removed
+
+    latest, stale, removed = asyncio.run(refresh())
+
+    assert latest == (Counter({node: 2}), Counter())
+    assert stale == (Counter(), Counter())
+    assert removed == (Counter({node: -2}), Counter())
+    assert db[GRAPH_CONTRIBUTIONS_COLLECTION].documents == {}
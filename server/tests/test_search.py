@@ -0,0 +1,86 @@
+"""Tests of search."""
+
+import asyncio
+
+from bson import ObjectId
+
+from quickgraph.search import services
+from quickgraph.search.schemas import SearchTerm
+from quickgraph.search.services import (
+    iterate_search_matches,
+    match_search_term,
+    parse_search_terms,
+    term_positions,
+)
+
+
+def test_parse_search_terms():
+    assert parse_search_terms("Pump Seal, leak*") == [
+        SearchTerm(words=["pump", "seal"], prefix=False),
+        SearchTerm(words=["leak"], prefix=True),
+    ]
+    assert parse_search_terms("pump", prefix_last=True) == [
+        SearchTerm(words=["pump"], prefix=True)
+    ]
+    assert parse_search_terms(" , ") == []
+
+
+def test_match_search_term():
+    positions = term_positions(["Replace", "pump", "seal."])
+
+    assert match_search_term(SearchTerm(words=["pump", "seal"]), positions)
+    assert not match_search_term(SearchTerm(words=["seal", "pump"]), positions)
+    assert match_search_term(SearchTerm(words=["pump", "se"], prefix=True), positions)
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, field, direction):
+        self.documents.sort(key=lambda d: d[field])
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, _filter, projection=None, **kwargs):
+        return FakeCursor(list(self.documents))
+
+
+def test_iterate_search_matches_yields_items_once(monkeypatch):
+    async def match_dataset_items(db, terms, dataset_item_ids):
+        return dataset_item_ids
+
+    monkeypatch.setattr(services, "SEARCH_BATCH_SIZE", 2)
+    monkeypatch.setattr(services, "match_dataset_items", match_dataset_items)
+    item_ids = [ObjectId() for _ in range(3)]
+    # A prefix driver reads one posting per matching term of an item, so the second
+    # item's postings straddle the first batch boundary.
+    db = {
+        services.TOKEN_INDEX_COLLECTION: FakeCollection(
+            [{"dataset_item_id": i} for i in [item_ids[0]] + item_ids[1:2] * 3]
+            + [{"dataset_item_id": item_ids[2]}]
+        )
+    }
+
+    async def search():
+        return [
+            batch
+            async for batch in iterate_search_matches(
+                db=db,
+                dataset_id=ObjectId(),
+                terms=parse_search_terms("p", prefix_last=True),
+            )
+        ]
+
+    assert asyncio.run(search()) == [item_ids[:2], item_ids[2:]]